@@ -1,23 +1,38 @@
-from fastapi import Depends, FastAPI
+from contextlib import asynccontextmanager
+
+from fastapi import Depends, FastAPI, HTTPException, Response
+from starlette import status
+from starlette.concurrency import run_in_threadpool
 
 from auth import init
+from auth.health import get_liveness, get_readiness, warm_up
 from auth.model.user import User
+from auth.profiling import allocation_profiler
 from auth.userProvider import ValidateAndReturnUser
 from config import get_settings
 
-app = FastAPI()
-
 settings = get_settings()
 
-# Initialize the role auth framework
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm up the auth subsystem before the instance reports ready, so that the first requests are not slower
+    await run_in_threadpool(warm_up)
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
+
+# Initialize the role auth framework, this loads ROLE_HIERARCHY_FILE if it is set
 role_heirarchy_spec = init()
 
 # Define role hierarchy spec
-admin_role = role_heirarchy_spec.create_role(settings.ADMIN_ROLE_NAME)
-contributor_role = role_heirarchy_spec.create_role(settings.CONTRIBUTOR_ROLE_NAME)
-reader_role = role_heirarchy_spec.create_role(settings.READER_ROLE_NAME)
-admin_role.provide_implicit_permissions(contributor_role, reader_role)
-contributor_role.provide_implicit_permissions(reader_role)
+if not settings.ROLE_HIERARCHY_FILE:
+    admin_role = role_heirarchy_spec.create_role(settings.ADMIN_ROLE_NAME)
+    contributor_role = role_heirarchy_spec.create_role(settings.CONTRIBUTOR_ROLE_NAME)
+    reader_role = role_heirarchy_spec.create_role(settings.READER_ROLE_NAME)
+    admin_role.provide_implicit_permissions(contributor_role, reader_role)
+    contributor_role.provide_implicit_permissions(reader_role)
 
 
 # API for unauthenticated messages
@@ -40,6 +55,24 @@ async def get_messages(
     return {"messages": f"some messages for user {user.name}"}
 
 
+@app.get("/authenticated/{env}/messages")
+async def get_messages_for_env(
+    env: str,
+    user: User = Depends(
+        ValidateAndReturnUser(
+            expected_roles=[settings.READER_ROLE_NAME], env_param="env"
+        )
+    ),
+):
+    """
+    Returns messages for a single environment. The reader role must be held in the environment given in the path.
+
+    Returns:
+        dict: A dictionary containing messages for the specified user and environment.
+    """
+    return {"messages": f"some {env} messages for user {user.name}"}
+
+
 @app.post("/authenticated/message/{message}")
 async def post_message(
     message: str,
@@ -50,3 +83,31 @@ async def post_message(
 
 
 # API for health check
+@app.get("/health/live")
+async def get_live():
+    """
+    Liveness probe, answers as long as the process is running.
+    """
+    return get_liveness()
+
+
+@app.get("/health/ready")
+async def get_ready(response: Response):
+    """
+    Readiness probe for the App Service health check. Returns 503 until the auth subsystem is warmed up, together with the state of the signing keys, caches and circuit breakers.
+    """
+    readiness = get_readiness()
+    if not readiness["ready"]:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return readiness
+
+
+# API for allocation profiling, see AUTH_ALLOCATION_PROFILING_ENABLED
+@app.get("/debug/allocations")
+async def get_allocations():
+    """
+    Returns the average allocations of each auth pipeline stage and of whole requests. Answers 404 unless allocation profiling is enabled.
+    """
+    if not allocation_profiler.enabled:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    return allocation_profiler.get_stats()
@@ -1,8 +1,21 @@
+import threading
+from types import MappingProxyType
+from typing import Optional
+
 import requests
-from requests.adapters import HTTPAdapter, Retry
+from requests.adapters import HTTPAdapter
 
+from auth.audit import configure_audit_log
+from auth.auth_config import compile_auth_config
 from auth.exception import AuthInitializationException
+from auth.http import resilience
+from auth.http.resilience import BudgetedRetry, get_circuit_breaker
+from auth.logs import configure_auth_logging
+from auth.profiling import allocation_profiler
 from auth.model.roles import Role
+from config import get_settings
+
+settings = get_settings()
 
 
 class Singleton(type):
@@ -25,14 +38,18 @@ class Singleton(type):
     print(my_instance1 is my_instance2)  # Output: True"""
 
     _instances = {}
+    _lock = threading.Lock()
 
     def __call__(cls, *args, **kwargs):
         """
         The purpose of this method is to implement a singleton pattern, which ensures that only one instance of the class exists. It does this by checking if the class is already present in the `_instances` dictionary attribute of the class. If it is not present, it creates a new instance of the class using the `super().__call__` method and adds it to the `_instances` dictionary. Finally, it returns the instance from the `_instances` dictionary.
 
+        The check is repeated under a lock before creating the instance, so that threads racing on the first call all get the same instance.
         """
         if cls not in cls._instances:
-            cls._instances[cls] = super().__call__(*args, **kwargs)
+            with cls._lock:
+                if cls not in cls._instances:
+                    cls._instances[cls] = super().__call__(*args, **kwargs)
         return cls._instances[cls]
 
 
@@ -95,6 +112,7 @@ class RoleHierarchy:
         """
         for hierarchy in roleheirarchies:
             self.implicit_permissions.append(hierarchy)
+        hierarchy_changed()
 
     def __repr__(self):
         return f"{self.name}"
@@ -114,22 +132,108 @@ class RoleHierarchy:
 role_hierarhcy_repo = RoleHierarchyRepository()
 
 
-def add_additional_permissions_based_on_hierarchy(role: Role):
+class RoleHierarchySnapshot:
+    """The `RoleHierarchySnapshot` class is an immutable, compiled view of the role hierarchy that request threads read without locking.
+
+    For each role it holds the transitive closure of the roles it implicitly grants, in the order they were declared. A snapshot is never modified after it has been compiled; changes to the hierarchy compile a new snapshot and swap it in with a single assignment (copy-on-write), so a reader always sees either the old or the new hierarchy as a whole.
+
+    Attributes:
+    - `version` (int): Increases with every compiled snapshot.
+    - `implicit_roles` (Mapping[str, tuple]): The role names implicitly granted by each role.
+    """
+
+    __slots__ = ("version", "implicit_roles")
+
+    def __init__(self, version: int, implicit_roles: dict):
+        self.version = version
+        self.implicit_roles = MappingProxyType(dict(implicit_roles))
+
+    @classmethod
+    def compile(cls, graph: dict, version: int) -> "RoleHierarchySnapshot":
+        """Compiles a snapshot from a `role name -> directly implied role names` mapping."""
+        implicit_roles = {}
+        for role_name in graph:
+            closure = []
+            pending = list(graph[role_name])
+            while pending:
+                implied = pending.pop(0)
+                if implied == role_name or implied in closure:
+                    continue
+                closure.append(implied)
+                pending.extend(graph.get(implied, ()))
+            implicit_roles[role_name] = tuple(closure)
+        return cls(version, implicit_roles)
+
+    def get_implicit_roles(self, role_name: str) -> tuple:
+        """Returns the role names implicitly granted by `role_name`."""
+        return self.implicit_roles.get(role_name, ())
+
+
+role_hierarchy_snapshot = RoleHierarchySnapshot(0, {})
+role_hierarchy_lock = threading.Lock()
+
+
+def get_role_hierarchy_snapshot() -> RoleHierarchySnapshot:
+    """Returns the current role hierarchy snapshot."""
+    return role_hierarchy_snapshot
+
+
+def swap_role_hierarchy(roles: Optional[dict] = None) -> RoleHierarchySnapshot:
+    """Compiles a new snapshot and makes it the current one.
+
+    Parameters:
+    - `roles` (dict, optional): A new `role name -> RoleHierarchy` mapping that replaces the roles of the repository. If `None`, the snapshot is recompiled from the roles currently in the repository.
+
+    Returns:
+    - `RoleHierarchySnapshot`: The new snapshot."""
+    global role_hierarchy_snapshot
+    with role_hierarchy_lock:
+        if roles is not None:
+            role_hierarhcy_repo.roles = roles
+        # `None` entries, which `provide_implicit_permissions` stores as given, grant nothing
+        graph = {
+            name: [
+                permission.name
+                for permission in role.get_all_implicit_permissions()
+                if permission is not None
+            ]
+            for name, role in list(role_hierarhcy_repo.roles.items())
+        }
+        snapshot = RoleHierarchySnapshot.compile(
+            graph, role_hierarchy_snapshot.version + 1
+        )
+        role_hierarchy_snapshot = snapshot
+    return snapshot
+
+
+def hierarchy_changed():
+    """Records that the role hierarchy has changed by compiling a new snapshot, so that anything derived from it (e.g. cached permission sets) is recomputed."""
+    swap_role_hierarchy()
+
+
+def get_hierarchy_version() -> int:
+    """Returns a number that changes whenever the role hierarchy changes."""
+    return role_hierarchy_snapshot.version
+
+
+def add_additional_permissions_based_on_hierarchy(
+    role: Role, snapshot: Optional[RoleHierarchySnapshot] = None
+):
     '''"""
     This function takes a role object as input and adds additional permissions based on the role's hierarchy.
 
     Parameters:
     - role: A Role object representing the role for which additional permissions need to be added.
+    - snapshot: The role hierarchy snapshot to use. Defaults to the current one.
 
     Returns:
     - A list of Role objects representing all the roles, including the original role and any additional roles with implicit permissions based on the role's hierarchy.
 
     """'''
+    snapshot = snapshot or role_hierarchy_snapshot
     all_roles = [Role(role.app_name, role.env, role.role_type)]
-    role_type_map = role_hierarhcy_repo.get_all_roles()
-    if role.role_type in role_type_map:
-        for permission in role_type_map[role.role_type].get_all_implicit_permissions():
-            all_roles.append(Role(role.app_name, role.env, permission.name))
+    for role_name in snapshot.get_implicit_roles(role.role_type):
+        all_roles.append(Role(role.app_name, role.env, role_name))
     return all_roles
 
 
@@ -182,19 +286,33 @@ class RoleHierarchySpec:
         if not role:
             role = RoleHierarchy(role_name)
             self.role_hierarchy_repo.roles[role_name] = role
+            hierarchy_changed()
         return role
 
 
 def init() -> RoleHierarchySpec:
-    """The `init` function initializes the role hierarchy specification by creating an instance of the `RoleHierarchySpec` class and setting its `role_hierarchy_repo` attribute to an instance of the `RoleHierarchyRepository` class. It also sets a global variable `initialized` to `True`. The function returns the initialized `RoleHierarchySpec` object.
+    """The `init` function initializes the role hierarchy specification by creating an instance of the `RoleHierarchySpec` class and setting its `role_hierarchy_repo` attribute to an instance of the `RoleHierarchyRepository` class. It also sets a global variable `initialized` to `True` and compiles the `AuthConfig` from the current settings (see `auth.auth_config`). If `AUTH_AUDIT_LOG_ENABLED` is set, it also starts the audit log writer (see `auth.audit`), and likewise the traffic capture if `AUTH_CAPTURE_ENABLED` is set (see `auth.capture`). The function returns the initialized `RoleHierarchySpec` object.
 
     Parameters: None
 
     Returns:
     - `role_hierarchy_spec` (RoleHierarchySpec): The initialized role hierarchy specification object.
     """
+    from auth.capture import configure_traffic_capture
+    from auth.hierarchy import init_role_hierarchy_from_settings
+
     global initialized
     initialized = True
+    compile_auth_config()
+    if settings.AUTH_ASYNC_LOGGING_ENABLED:
+        configure_auth_logging()
+    if settings.AUTH_ALLOCATION_PROFILING_ENABLED:
+        allocation_profiler.enable()
+    if settings.AUTH_AUDIT_LOG_ENABLED:
+        configure_audit_log()
+    if settings.AUTH_CAPTURE_ENABLED:
+        configure_traffic_capture()
+    init_role_hierarchy_from_settings()
     role_hierarhcy_spec = RoleHierarchySpec()
     role_hierarhcy_spec.role_hierarchy_repo = RoleHierarchyRepository()
     return role_hierarhcy_spec
@@ -202,7 +320,7 @@ def init() -> RoleHierarchySpec:
 
 def retryable_requester():
     '''"""
-    This function creates a retryable requester object using the requests library. It sets up a session and configures the session to automatically retry requests in case of certain HTTP status codes (500, 502, 503, 504). The maximum number of retries is set to 3, and a backoff factor of 0.5 is used to increase the delay between retries. The function returns the retryable requester object.
+    This function creates a retryable requester object using the requests library. It sets up a session and configures the session to automatically retry requests in case of certain HTTP status codes (500, 502, 503, 504). The maximum number of retries is set to 3, and a backoff factor of 0.5 is used to increase the delay between retries. Retries are only made while the process wide retry budget allows it (see `auth.http.resilience.RetryBudget`). The function returns the retryable requester object.
 
     Parameters:
         None
@@ -215,11 +333,37 @@ def retryable_requester():
         response = requester.get('https://example.com')
     """'''
     s = requests.session()
-    retries = Retry(total=3, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504])
+    retries = BudgetedRetry(
+        total=3, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504]
+    )
     s.mount("https://", HTTPAdapter(max_retries=retries))
+    s.mount("http://", HTTPAdapter(max_retries=retries))
     return s
 
 
+def guarded_request(endpoint: str, method: str, url: str, **kwargs):
+    '''"""
+    This function makes an HTTP request to an upstream endpoint through its circuit breaker and the retry budget.
+
+    Parameters:
+        endpoint (str): The name of the circuit breaker to use, e.g. "jwks" or "appservice".
+        method (str): The HTTP method.
+        url (str): The URL to call.
+        **kwargs: Passed to `requests.Session.request`.
+
+    Returns:
+        The response. Responses with a 5xx status code and raised request exceptions count as failures of the endpoint.
+
+    Raises:
+        CircuitOpenException: If the circuit of the endpoint is open, without calling the endpoint.
+    """'''
+    resilience.retry_budget.deposit()
+    return get_circuit_breaker(endpoint).call(
+        lambda: retryable_requester().request(method, url, **kwargs),
+        is_failure=lambda response: response.status_code >= 500,
+    )
+
+
 def is_initialized():
     '''"""
     This function checks if a variable named 'initialized' has been initialized or not.
@@ -0,0 +1,190 @@
+import asyncio
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from auth.exception import OverloadedException
+from config import get_settings
+
+settings = get_settings()
+
+QUEUE_FULL = "queue_full"
+QUEUE_TIMEOUT = "queue_timeout"
+
+
+class VerificationExecutor:
+    """The `VerificationExecutor` class runs token verification on a dedicated, bounded pool of threads and sheds the requests it cannot serve in time.
+
+    A sync dependency would run on the shared thread pool of the application (40 threads by default), so an overload of authenticated requests would queue there without bound, unseen by any admission control, and starve every other route. `ValidateAndReturnUser` is therefore async and awaits `run_async`, which holds no thread of the application pool while the request waits or is verified. With the executor:
+
+    - At most `workers` verifications run at once, and at most `queue_size` more wait for a worker. Any further request is rejected immediately with an `OverloadedException` (reason `queue_full`), without waiting.
+    - A request that waited longer than `queue_timeout` seconds for a worker is rejected when it is dequeued (reason `queue_timeout`) instead of being verified for a client that has likely given up.
+
+    `ValidateAndReturnUser` turns an `OverloadedException` into a 503 response with a `Retry-After` header. Queue depth, wait times and shed requests are reported by `get_stats`, see `auth.health.get_readiness`. With `workers` set to `0`, verification runs without admission control: `run` calls it on the calling thread and `run_async` on the application thread pool, like a sync dependency.
+
+    Example usage:
+    ```python
+    executor = VerificationExecutor(workers=4, queue_size=16)
+    user = await executor.run_async(token_service.decode_and_check_authorization, expected_roles, request=request)
+    ```
+    """
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        queue_size: Optional[int] = None,
+        queue_timeout: Optional[float] = None,
+        retry_after: Optional[int] = None,
+        wait_samples: int = 1024,
+    ):
+        """Parameters:
+        - `workers` (int, optional): The number of verification threads. Defaults to `AUTH_VERIFICATION_WORKERS`.
+        - `queue_size` (int, optional): The number of requests that may wait for a thread. Defaults to `AUTH_VERIFICATION_QUEUE_SIZE`.
+        - `queue_timeout` (float, optional): How many seconds a request may wait for a thread. Defaults to `AUTH_VERIFICATION_QUEUE_TIMEOUT_SECONDS`.
+        - `retry_after` (int, optional): The `Retry-After` seconds suggested to shed requests. Defaults to `AUTH_VERIFICATION_RETRY_AFTER_SECONDS`.
+        - `wait_samples` (int): The number of recent wait times the percentiles are computed from.
+        """
+        self.workers = (
+            settings.AUTH_VERIFICATION_WORKERS if workers is None else workers
+        )
+        self.queue_size = (
+            settings.AUTH_VERIFICATION_QUEUE_SIZE if queue_size is None else queue_size
+        )
+        self.queue_timeout = (
+            settings.AUTH_VERIFICATION_QUEUE_TIMEOUT_SECONDS
+            if queue_timeout is None
+            else queue_timeout
+        )
+        self.retry_after = (
+            settings.AUTH_VERIFICATION_RETRY_AFTER_SECONDS
+            if retry_after is None
+            else retry_after
+        )
+        self.admitted = 0
+        self.completed = 0
+        self.shed = {QUEUE_FULL: 0, QUEUE_TIMEOUT: 0}
+        self.pending = 0
+        self.running = 0
+        self.max_wait = 0.0
+        self.waits: deque[float] = deque(maxlen=wait_samples)
+        self.__lock = threading.Lock()
+        self.__executor = (
+            ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="auth-verification"
+            )
+            if self.workers > 0
+            else None
+        )
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """Admits `fn(*args, **kwargs)` to run on a verification thread, in a copy of the context of the caller, and returns its `Future`. Exceptions raised by `fn` are set on the future.
+
+        Raises:
+        - `OverloadedException`: If the queue is full. Calls that wait longer than `queue_timeout` for a thread fail their future with an `OverloadedException`. Cancelling the future before it runs releases its place in the queue.
+        - `RuntimeError`: If the executor has no workers."""
+        if self.__executor is None:
+            raise RuntimeError("The verification executor has no workers")
+        with self.__lock:
+            if self.pending >= self.workers + self.queue_size:
+                self.shed[QUEUE_FULL] += 1
+                raise OverloadedException(
+                    f"Verification queue is full ({self.queue_size} waiting)",
+                    reason=QUEUE_FULL,
+                    retry_after=self.retry_after,
+                )
+            self.pending += 1
+            self.admitted += 1
+        context = contextvars.copy_context()
+        try:
+            future = self.__executor.submit(
+                self.__run, time.perf_counter(), context, fn, args, kwargs
+            )
+        except BaseException:
+            with self.__lock:
+                self.pending -= 1
+            raise
+        future.add_done_callback(self.__release_cancelled)
+        return future
+
+    def run(self, fn: Callable, *args, **kwargs):
+        """Runs `fn(*args, **kwargs)` on a verification thread and blocks until it returns its result, see `submit`. Without workers, `fn` runs on the calling thread.
+
+        Raises:
+        - `OverloadedException`: If the queue is full, or the call waited longer than `queue_timeout` for a thread.
+        """
+        if self.__executor is None:
+            return fn(*args, **kwargs)
+        return self.submit(fn, *args, **kwargs).result()
+
+    async def run_async(self, fn: Callable, *args, **kwargs):
+        """Runs `fn(*args, **kwargs)` on a verification thread and awaits its result without blocking the event loop or holding a thread of the application pool, see `submit`. Without workers, `fn` runs on the application thread pool.
+
+        Raises:
+        - `OverloadedException`: If the queue is full, or the call waited longer than `queue_timeout` for a thread.
+        """
+        if self.__executor is None:
+            return await run_in_threadpool(fn, *args, **kwargs)
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def __release_cancelled(self, future: Future):
+        # A future can only be cancelled while it waits for a thread, e.g. when the request awaiting `run_async` is cancelled because its client disconnected. `__run` then never runs, so its slot in the queue is released here.
+        if future.cancelled():
+            with self.__lock:
+                self.pending -= 1
+
+    def __run(
+        self, enqueued: float, context: contextvars.Context, fn: Callable, args, kwargs
+    ):
+        wait = time.perf_counter() - enqueued
+        with self.__lock:
+            self.waits.append(wait)
+            self.max_wait = max(self.max_wait, wait)
+            if wait > self.queue_timeout:
+                self.pending -= 1
+                self.shed[QUEUE_TIMEOUT] += 1
+                raise OverloadedException(
+                    f"Waited {wait:.3f}s for a verification thread",
+                    reason=QUEUE_TIMEOUT,
+                    retry_after=self.retry_after,
+                )
+            self.running += 1
+        try:
+            return context.run(fn, *args, **kwargs)
+        finally:
+            with self.__lock:
+                self.running -= 1
+                self.pending -= 1
+                self.completed += 1
+
+    def get_stats(self) -> dict:
+        """Returns the configuration, the current queue depth and running verifications, the admitted, completed and shed requests and the recent queue wait times (p50, p95 and max in milliseconds)."""
+        with self.__lock:
+            waits = sorted(self.waits)
+            stats = {
+                "workers": self.workers,
+                "queue_size": self.queue_size,
+                "queue_depth": self.pending - self.running,
+                "running": self.running,
+                "admitted": self.admitted,
+                "completed": self.completed,
+                "shed": dict(self.shed),
+                "max_wait_ms": round(self.max_wait * 1000, 3),
+            }
+        stats["wait_ms"] = {
+            "p50": round(waits[len(waits) // 2] * 1000, 3) if waits else None,
+            "p95": round(waits[int(len(waits) * 0.95)] * 1000, 3) if waits else None,
+        }
+        return stats
+
+    def shutdown(self):
+        """Stops the verification threads once the running verifications are done."""
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=True)
+
+
+verification_executor = VerificationExecutor()
@@ -0,0 +1,333 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+from config import get_settings
+
+settings = get_settings()
+log = logging.getLogger(__name__)
+
+DROP_OLDEST = "drop_oldest"
+BLOCK = "block"
+BACKPRESSURE_POLICIES = (DROP_OLDEST, BLOCK)
+
+
+class AuditRecord:
+    """One authorization decision of `ValidateAndReturnUser`.
+
+    Records are created on the request path, so they only keep references to what the request already computed. The role collection is rendered to group names and the record to JSON by the background writer (see `to_dict`).
+
+    Attributes:
+    - `timestamp` (float): When the decision was made, in seconds since the epoch.
+    - `user` (str): The name of the user, `None` if the request was not authenticated.
+    - `route` (str): The path template of the route, e.g. `/{env}/messages`.
+    - `expected_roles` (list): The roles the route requires.
+    - `role_collection` (RoleCollection): The effective roles of the user, including those granted by the role hierarchy.
+    - `outcome` (str): `allowed`, `forbidden`, `unauthenticated` or `unavailable`.
+    - `env` (str): The environment the roles were needed in, if the check was environment scoped.
+    """
+
+    __slots__ = (
+        "timestamp",
+        "user",
+        "route",
+        "expected_roles",
+        "role_collection",
+        "outcome",
+        "env",
+    )
+
+    def __init__(self, user, route, expected_roles, role_collection, outcome, env=None):
+        self.timestamp = time.time()
+        self.user = user
+        self.route = route
+        self.expected_roles = expected_roles
+        self.role_collection = role_collection
+        self.outcome = outcome
+        self.env = env
+
+    def to_dict(self) -> dict:
+        roles = () if self.role_collection is None else self.role_collection.roles
+        record = {
+            "ts": round(self.timestamp, 3),
+            "user": self.user,
+            "route": self.route,
+            "expected": list(self.expected_roles),
+            "effective": sorted({role.get_role_in_group_format() for role in roles}),
+            "outcome": self.outcome,
+        }
+        if self.env is not None:
+            record["env"] = self.env
+        return record
+
+
+class AuditRingBuffer:
+    """A bounded buffer of audit records between request threads and the writer thread.
+
+    When the buffer is full, `put` applies the backpressure policy:
+    - `drop_oldest`: the oldest record is dropped to make room, so request threads never wait.
+    - `block`: the request thread waits up to `block_timeout` seconds for the writer to make room, then drops the new record so a stuck writer cannot hang requests. Callers on the event loop pass `block=False` and drop the new record at once, since waiting there would stall every request.
+
+    Dropped records are counted in `dropped`.
+    """
+
+    def __init__(
+        self, capacity: int, policy: str = DROP_OLDEST, block_timeout: float = 0.1
+    ):
+        if policy not in BACKPRESSURE_POLICIES:
+            raise ValueError(
+                f"Unknown audit backpressure policy {policy}, expected one of {BACKPRESSURE_POLICIES}"
+            )
+        self.capacity = capacity
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.dropped = 0
+        self.enqueued = 0
+        self.closed = False
+        self.__records = deque()
+        self.__condition = threading.Condition()
+
+    def __len__(self):
+        return len(self.__records)
+
+    def put(self, record: AuditRecord, block: bool = True) -> bool:
+        """Adds a record to the buffer. With `block` set to `False`, the `block` policy drops the new record instead of waiting for room. Returns `False` if the record was dropped."""
+        with self.__condition:
+            if len(self.__records) >= self.capacity:
+                if self.policy == DROP_OLDEST:
+                    self.__records.popleft()
+                    self.dropped += 1
+                elif (
+                    not block
+                    or not self.__condition.wait_for(
+                        lambda: len(self.__records) < self.capacity or self.closed,
+                        self.block_timeout,
+                    )
+                    or self.closed
+                ):
+                    self.dropped += 1
+                    return False
+            self.__records.append(record)
+            self.enqueued += 1
+            if len(self.__records) == 1:
+                self.__condition.notify_all()
+        return True
+
+    def take(self, max_records: int, timeout: Optional[float] = None) -> list:
+        """Removes and returns up to `max_records` records, waiting up to `timeout` seconds for the first one. Returns an empty list if the buffer stayed empty."""
+        with self.__condition:
+            if not self.__records and not self.closed:
+                self.__condition.wait(timeout)
+            batch = [
+                self.__records.popleft()
+                for _ in range(min(max_records, len(self.__records)))
+            ]
+            if batch:
+                self.__condition.notify_all()
+        return batch
+
+    def close(self):
+        """Wakes up the writer and any blocked `put` so they can stop."""
+        with self.__condition:
+            self.closed = True
+            self.__condition.notify_all()
+
+
+class RotatingJsonlWriter:
+    """Appends lines to a JSONL file and rotates it once it exceeds `max_bytes`: `audit.jsonl` becomes `audit.jsonl.1`, `audit.jsonl.1` becomes `audit.jsonl.2` and so on, keeping `backup_count` rotated files. Not thread-safe; it is only used by the writer thread."""
+
+    def __init__(self, path: str, max_bytes: int, backup_count: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.__file = None
+
+    def write(self, lines: list[str]):
+        data = "".join(lines)
+        if self.__file is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.__file = open(self.path, "a", encoding="utf-8")
+        if (
+            self.max_bytes
+            and self.__file.tell()
+            and self.__file.tell() + len(data) > self.max_bytes
+        ):
+            self.rotate()
+        self.__file.write(data)
+        self.__file.flush()
+
+    def rotate(self):
+        self.close()
+        for index in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        if self.backup_count:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self.__file = open(self.path, "a", encoding="utf-8")
+
+    def close(self):
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+
+class AuditLog:
+    """The `AuditLog` class records authorization decisions without adding I/O to the request path.
+
+    `record` only appends an `AuditRecord` to a bounded `AuditRingBuffer`. A background thread takes the records off the buffer in batches of up to `batch_size`, or whatever arrived within `flush_interval` seconds, serializes them and appends them to rotating JSONL files in one write per batch.
+
+    Example usage:
+    ```python
+    audit_log = AuditLog("audit/auth-decisions.jsonl")
+    audit_log.start()
+    audit_log.record("John", "/messages", ["reader"], user.role_collection, "allowed")
+    ```
+    """
+
+    def __init__(
+        self,
+        path: str,
+        capacity: int = 10000,
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        policy: str = DROP_OLDEST,
+        block_timeout: float = 0.1,
+        max_bytes: int = 10 * 1024 * 1024,
+        backup_count: int = 5,
+    ):
+        self.buffer = AuditRingBuffer(capacity, policy, block_timeout)
+        self.writer = RotatingJsonlWriter(path, max_bytes, backup_count)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.batches = 0
+        self.write_errors = 0
+        self.__write_lock = threading.Lock()
+        self.__thread: Optional[threading.Thread] = None
+
+    def record(
+        self,
+        user,
+        route,
+        expected_roles,
+        role_collection,
+        outcome,
+        env=None,
+        block: bool = True,
+    ) -> bool:
+        """Enqueues an authorization decision. Pass `block=False` on the event loop, see `AuditRingBuffer`. Returns `False` if the record was dropped because the buffer was full."""
+        return self.put(
+            AuditRecord(user, route, expected_roles, role_collection, outcome, env),
+            block,
+        )
+
+    def put(self, record, block: bool = True) -> bool:
+        """Enqueues any record with a `to_dict` method, e.g. the records of the traffic capture (see `auth.capture`). Pass `block=False` on the event loop, see `AuditRingBuffer`. Returns `False` if the record was dropped because the buffer was full."""
+        return self.buffer.put(record, block)
+
+    def start(self):
+        """Starts the background writer."""
+        if self.__thread is None:
+            self.__thread = threading.Thread(
+                target=self.__run, name="auth-audit-writer", daemon=True
+            )
+            self.__thread.start()
+
+    def stop(self):
+        """Stops the background writer after writing the records still in the buffer."""
+        self.buffer.close()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+        self.flush()
+        self.writer.close()
+
+    def flush(self):
+        """Writes the records currently in the buffer from the calling thread."""
+        while True:
+            batch = self.buffer.take(self.batch_size, timeout=0)
+            if not batch:
+                return
+            self.__write(batch)
+
+    def __run(self):
+        while not self.buffer.closed:
+            batch = self.buffer.take(self.batch_size, self.flush_interval)
+            if batch:
+                self.__write(batch)
+
+    def __write(self, batch: list[AuditRecord]):
+        with self.__write_lock:
+            try:
+                self.writer.write(
+                    [
+                        json.dumps(record.to_dict(), separators=(",", ":")) + "\n"
+                        for record in batch
+                    ]
+                )
+                self.written += len(batch)
+                self.batches += 1
+            except Exception as e:
+                log.error("Failed to write %s audit records: %s", len(batch), e)
+                self.write_errors += 1
+                self.buffer.dropped += len(batch)
+
+    def get_stats(self) -> dict:
+        '''"""
+        This function returns the counters of the audit log.
+
+        Returns:
+            dict: The number of records enqueued, written, dropped (buffer full or failed writes) and still pending, the number of batches written and of failed writes.
+        """'''
+        return {
+            "enqueued": self.buffer.enqueued,
+            "written": self.written,
+            "dropped": self.buffer.dropped,
+            "pending": len(self.buffer),
+            "batches": self.batches,
+            "write_errors": self.write_errors,
+        }
+
+
+audit_log: Optional[AuditLog] = None
+configure_lock = threading.Lock()
+
+
+def configure_audit_log() -> AuditLog:
+    '''"""
+    This function creates the audit log from the `AUTH_AUDIT_*` settings and starts its writer. The records still buffered are written when the process exits. Calling the function again returns the same audit log.
+
+    Returns:
+        AuditLog: The audit log.
+    """'''
+    global audit_log
+    with configure_lock:
+        if audit_log is None:
+            audit_log = AuditLog(
+                settings.AUTH_AUDIT_LOG_FILE,
+                capacity=settings.AUTH_AUDIT_BUFFER_SIZE,
+                batch_size=settings.AUTH_AUDIT_BATCH_SIZE,
+                flush_interval=settings.AUTH_AUDIT_FLUSH_INTERVAL_SECONDS,
+                policy=settings.AUTH_AUDIT_BACKPRESSURE,
+                block_timeout=settings.AUTH_AUDIT_BLOCK_TIMEOUT_SECONDS,
+                max_bytes=settings.AUTH_AUDIT_LOG_MAX_BYTES,
+                backup_count=settings.AUTH_AUDIT_LOG_BACKUP_COUNT,
+            )
+            audit_log.start()
+            atexit.register(audit_log.stop)
+    return audit_log
+
+
+def get_audit_log() -> Optional[AuditLog]:
+    """Returns the audit log, or `None` if auditing is not enabled."""
+    return audit_log
@@ -0,0 +1,114 @@
+import re
+from dataclasses import dataclass
+from typing import Optional
+
+from auth.model.claims import ClaimProjection, get_claim_projection
+from config import get_settings, settings as Settings
+
+
+@dataclass(frozen=True)
+class AuthConfig:
+    """The `AuthConfig` class holds the auth settings in the form the request path needs them, compiled once from `config.settings`.
+
+    Reading pydantic settings attributes, splitting `VALID_ROLES` and looking up `GROUP_PATTERN` on every request is avoided by compiling them here. The object is immutable; a new one is compiled by `compile_auth_config`, which `auth.init()` calls. Feature toggles that are flipped at runtime (`WEBSITE_AUTH_ENABLED`, `FEATURE_RBAC_ENABLED`, `IS_ON_APP_SERVICE`) are not part of it and are still read from the settings.
+
+    Attributes:
+    - `group_pattern` (re.Pattern): The compiled `GROUP_PATTERN`.
+    - `admin_group_pattern` (re.Pattern): The compiled `ADMIN_GROUP_PATTERN`.
+    - `valid_roles` (frozenset): The lowercase role names of `VALID_ROLES`.
+    - `admin_role_name`, `contributor_role_name`, `reader_role_name` (str): The lowercase role names.
+    - `app_name` (str): `CP_APP_NAME`.
+    - `bypass_env` (str): `CP_AUTH_BYPASS_ENV`.
+    - `group_claim` (str): `GROUP_NODE_IN_DECODED_TOKEN`.
+    - `jwt_backend` (str): `JWT_BACKEND`, the library used for JWTs, see `auth.jwttoken.backends`.
+    - `allowed_algorithms` (tuple): The signing algorithms of `JWT_ALLOWED_ALGORITHMS`.
+    - `max_token_size` (int): `MAX_TOKEN_SIZE`, the maximum length of a token in characters.
+    - `id_token_header`, `access_token_header`, `session_cookie` (str): The App Service header and cookie names.
+    - `id_token_header_raw`, `access_token_header_raw` (bytes): The header names lowercased and latin-1 encoded, as they appear in the headers of an ASGI scope.
+    - `retained_claims` (ClaimProjection): The projection of `RETAINED_CLAIMS`, `None` if the setting is `*` and every claim is kept.
+    - `token_refresh_ahead_seconds` (float): `TOKEN_REFRESH_AHEAD_SECONDS`.
+    - `bypass_auth_identity_header` (str): `BYPASS_AUTH_IDENTITY_HEADER`, the header selecting a synthetic identity in bypass mode.
+    """
+
+    group_pattern: re.Pattern
+    admin_group_pattern: re.Pattern
+    valid_roles: frozenset
+    admin_role_name: str
+    contributor_role_name: str
+    reader_role_name: str
+    app_name: str
+    bypass_env: str
+    group_claim: str
+    jwt_backend: str
+    allowed_algorithms: tuple
+    max_token_size: int
+    id_token_header: str
+    access_token_header: str
+    session_cookie: str
+    id_token_header_raw: bytes
+    access_token_header_raw: bytes
+    retained_claims: Optional[ClaimProjection]
+    token_refresh_ahead_seconds: float
+    bypass_auth_identity_header: str
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> "AuthConfig":
+        """Compiles an `AuthConfig` from `settings`."""
+        return cls(
+            group_pattern=re.compile(settings.GROUP_PATTERN),
+            admin_group_pattern=re.compile(settings.ADMIN_GROUP_PATTERN),
+            valid_roles=frozenset(
+                role.strip().lower()
+                for role in settings.VALID_ROLES.split(",")
+                if role.strip()
+            ),
+            admin_role_name=settings.ADMIN_ROLE_NAME.lower(),
+            contributor_role_name=settings.CONTRIBUTOR_ROLE_NAME.lower(),
+            reader_role_name=settings.READER_ROLE_NAME.lower(),
+            app_name=settings.CP_APP_NAME,
+            bypass_env=settings.CP_AUTH_BYPASS_ENV,
+            group_claim=settings.GROUP_NODE_IN_DECODED_TOKEN,
+            jwt_backend=settings.JWT_BACKEND,
+            allowed_algorithms=tuple(
+                algorithm.strip()
+                for algorithm in settings.JWT_ALLOWED_ALGORITHMS.split(",")
+                if algorithm.strip()
+            ),
+            max_token_size=settings.MAX_TOKEN_SIZE,
+            id_token_header=settings.APP_SERVICE_ID_TOKEN_HEADER,
+            access_token_header=settings.APP_SERVICE_ACCESS_TOKEN_HEADER,
+            session_cookie=settings.APP_SERVICE_SESSION_COOKIE,
+            id_token_header_raw=settings.APP_SERVICE_ID_TOKEN_HEADER.lower().encode(
+                "latin-1"
+            ),
+            access_token_header_raw=settings.APP_SERVICE_ACCESS_TOKEN_HEADER.lower().encode(
+                "latin-1"
+            ),
+            retained_claims=(
+                None
+                if settings.RETAINED_CLAIMS.strip() == "*"
+                else get_claim_projection(settings.RETAINED_CLAIMS)
+            ),
+            token_refresh_ahead_seconds=settings.TOKEN_REFRESH_AHEAD_SECONDS,
+            bypass_auth_identity_header=settings.BYPASS_AUTH_IDENTITY_HEADER,
+        )
+
+
+auth_config = AuthConfig.from_settings(get_settings())
+
+
+def get_auth_config() -> AuthConfig:
+    """Returns the current `AuthConfig`."""
+    return auth_config
+
+
+def compile_auth_config() -> AuthConfig:
+    '''"""
+    This function compiles a new `AuthConfig` from the current settings and makes it the current one.
+
+    Returns:
+        AuthConfig: The new configuration.
+    """'''
+    global auth_config
+    auth_config = AuthConfig.from_settings(get_settings())
+    return auth_config
@@ -0,0 +1,228 @@
+import atexit
+import hashlib
+import os
+import threading
+import time
+from typing import Optional
+
+from fastapi import Request
+
+from auth.audit import AuditLog
+from auth.auth_config import get_auth_config
+from auth.http.appservice import get_header
+from auth.jwttoken.backends import get_jwt_backend
+from config import get_settings
+
+settings = get_settings()
+
+SHAPE_CLAIMS = frozenset({"aud", "iss", "tid", "ver", "_claim_names"})
+TIME_CLAIMS = frozenset({"iat", "nbf", "exp", "auth_time"})
+REMOVED_HEADER_FIELDS = frozenset({"kid", "x5t", "jku", "x5u"})
+
+
+def pseudonymize(name: str, value, salt: bytes) -> str:
+    """Returns a salted pseudonym of `value`, e.g. `email-3f2a...`, which is the same for the same value and salt."""
+    digest = hashlib.sha256(salt + str(value).encode()).hexdigest()[:16]
+    return f"{name}-{digest}"
+
+
+def sanitize_path_params(
+    path_params: dict, env_param: Optional[str], salt: bytes
+) -> dict:
+    """Returns the path parameters of a request with their values replaced by salted pseudonyms, as they may identify users or resources (ids, emails, ...). The environment parameter named by `env_param` is kept, since it decides the authorization outcome."""
+    return {
+        name: value if name == env_param else pseudonymize(name, value, salt)
+        for name, value in path_params.items()
+    }
+
+
+def sanitize_token(
+    token: Optional[str], captured_at: float, salt: bytes
+) -> Optional[dict]:
+    '''"""
+    This function returns the shape of a token without anything that identifies the user or could be replayed against the real deployment.
+
+    - The signature is dropped, as are the header fields naming the signing key (`kid`, `x5t`, ...).
+    - Only the claims that shape the auth decision are kept: the group claim (`GROUP_NODE_IN_DECODED_TOKEN`), `aud`, `iss`, `tid`, `ver` and `_claim_names`, which marks a group overage.
+    - Time claims (`iat`, `nbf`, `exp`, `auth_time`) are stored relative to the time the request was captured, so the replayed token has the same remaining lifetime.
+    - Every other claim (`name`, `email`, `oid`, `sid`, `login_hint`, `xms_*`, ...) is replaced by a salted pseudonym, which stays the same for the same value within one capture, so repeated users can still be told apart. Claims are pseudonymized unless they are known to be safe, so claims added to tokens later cannot leak into a capture.
+
+    Parameters:
+        token (str): The token, or `None` if the header was missing.
+        captured_at (float): When the request was captured, in seconds since the epoch.
+        salt (bytes): The salt of the pseudonyms.
+
+    Returns:
+        dict: The `size` of the token in characters, and its `header` and `claims`, or `malformed` if the token could not be parsed, e.g. because it is an opaque access token. `None` if the token was missing.
+    """'''
+    if token is None:
+        return None
+    backend = get_jwt_backend()
+    try:
+        header = backend.get_unverified_header(token) or {}
+        claims = backend.get_unverified_claims(token)
+    except Exception:
+        return {"size": len(token), "malformed": True}
+    group_claim = get_auth_config().group_claim
+    sanitized = {}
+    for claim, value in claims.items():
+        if claim in SHAPE_CLAIMS or claim == group_claim:
+            sanitized[claim] = value
+        elif claim in TIME_CLAIMS and isinstance(value, (int, float)):
+            sanitized[claim] = int(value - captured_at)
+        else:
+            sanitized[claim] = pseudonymize(claim, value, salt)
+    return {
+        "size": len(token),
+        "header": {
+            field: value
+            for field, value in header.items()
+            if field not in REMOVED_HEADER_FIELDS
+        },
+        "claims": sanitized,
+    }
+
+
+class CaptureRecord:
+    """One request to a protected route, as seen by `ValidateAndReturnUser`.
+
+    Like `AuditRecord`, it only keeps references on the request path; the path parameters and tokens are sanitized by the background writer (see `sanitize_path_params` and `sanitize_token`).
+    """
+
+    __slots__ = (
+        "timestamp",
+        "method",
+        "route",
+        "path_params",
+        "env_param",
+        "id_token",
+        "access_token",
+        "duration",
+        "outcome",
+        "salt",
+    )
+
+    def __init__(
+        self,
+        method,
+        route,
+        path_params,
+        env_param,
+        id_token,
+        access_token,
+        duration,
+        outcome,
+        salt,
+    ):
+        self.timestamp = time.time()
+        self.method = method
+        self.route = route
+        self.path_params = path_params
+        self.env_param = env_param
+        self.id_token = id_token
+        self.access_token = access_token
+        self.duration = duration
+        self.outcome = outcome
+        self.salt = salt
+
+    def to_dict(self) -> dict:
+        return {
+            "ts": round(self.timestamp, 4),
+            "method": self.method,
+            "route": self.route,
+            "path_params": sanitize_path_params(
+                self.path_params, self.env_param, self.salt
+            ),
+            "duration_ms": round(self.duration * 1000, 3),
+            "outcome": self.outcome,
+            "id_token": sanitize_token(self.id_token, self.timestamp, self.salt),
+            "access_token": sanitize_token(
+                self.access_token, self.timestamp, self.salt
+            ),
+        }
+
+
+class TrafficCapture:
+    """The `TrafficCapture` class records the shape of the requests to protected routes, so that production load can be replayed offline with `tools/replay.py`.
+
+    Each request is recorded with its method, route template and sanitized path parameters (see `sanitize_path_params`), arrival time, the time the auth decision took, its outcome and the sanitized ID and access tokens (see `sanitize_token`). Records are written to rotating JSONL files by an `AuditLog`, so capturing adds no I/O to the request path. Pseudonyms are salted with a random salt per capture, so they cannot be linked to users or across captures.
+    """
+
+    def __init__(
+        self, path: str, max_bytes: int = 100 * 1024 * 1024, backup_count: int = 5
+    ):
+        self.log = AuditLog(path, max_bytes=max_bytes, backup_count=backup_count)
+        self.salt = os.urandom(16)
+
+    def record(
+        self,
+        request: Request,
+        route: str,
+        outcome: str,
+        duration: float,
+        env_param: Optional[str] = None,
+    ) -> bool:
+        """Enqueues a captured request. `env_param` names the path parameter holding the environment the roles were needed in, which is kept unsanitized. Returns `False` if the record was dropped because the buffer was full."""
+        auth_config = get_auth_config()
+        return self.log.put(
+            CaptureRecord(
+                request.scope.get("method"),
+                route,
+                request.scope.get("path_params") or {},
+                env_param,
+                get_header(
+                    request,
+                    auth_config.id_token_header,
+                    auth_config.id_token_header_raw,
+                ),
+                get_header(
+                    request,
+                    auth_config.access_token_header,
+                    auth_config.access_token_header_raw,
+                ),
+                duration,
+                outcome,
+                self.salt,
+            )
+        )
+
+    def start(self):
+        self.log.start()
+
+    def stop(self):
+        self.log.stop()
+
+    def flush(self):
+        self.log.flush()
+
+    def get_stats(self) -> dict:
+        return self.log.get_stats()
+
+
+traffic_capture: Optional[TrafficCapture] = None
+configure_lock = threading.Lock()
+
+
+def configure_traffic_capture() -> TrafficCapture:
+    '''"""
+    This function creates the traffic capture from the `AUTH_CAPTURE_*` settings and starts its writer. Calling the function again returns the same capture.
+
+    Returns:
+        TrafficCapture: The traffic capture.
+    """'''
+    global traffic_capture
+    with configure_lock:
+        if traffic_capture is None:
+            traffic_capture = TrafficCapture(
+                settings.AUTH_CAPTURE_FILE,
+                max_bytes=settings.AUTH_CAPTURE_MAX_BYTES,
+                backup_count=settings.AUTH_CAPTURE_BACKUP_COUNT,
+            )
+            traffic_capture.start()
+            atexit.register(traffic_capture.stop)
+    return traffic_capture
+
+
+def get_traffic_capture() -> Optional[TrafficCapture]:
+    """Returns the traffic capture, or `None` if capturing is not enabled."""
+    return traffic_capture
@@ -0,0 +1,106 @@
+import itertools
+import threading
+from typing import Callable, Optional
+
+from auth import get_hierarchy_version
+from auth.auth_config import get_auth_config
+from auth.model.roles import RoleCollection
+from config import get_settings
+
+settings = get_settings()
+
+
+class DecisionCache:
+    """The `DecisionCache` class memoizes authorization decisions so that a repeated check is a single dictionary lookup.
+
+    Decisions are keyed on an interned permission-set id and an interned policy id:
+
+    - The permission-set id identifies the effective roles of a frozen `RoleCollection` by its fingerprint, so every user with the same permissions shares it. It is stored on the collection after the first lookup.
+    - The policy id identifies the expected roles and the optional environment and application of a check.
+
+    Only frozen collections, as built by the token service, are memoized; mutable ones are always evaluated. The cache is cleared whenever the role hierarchy version or the `AuthConfig` changes, and at most `maxsize` decisions are kept, dropping the oldest ones first.
+    """
+
+    def __init__(self, maxsize: int = None):
+        self.maxsize = maxsize or settings.DECISION_CACHE_SIZE
+        self.hits = 0
+        self.misses = 0
+        self.__decisions: dict[tuple, bool] = {}
+        self.__permission_set_ids: dict[str, int] = {}
+        self.__policy_ids: dict[tuple, int] = {}
+        self.__ids = itertools.count()
+        self.__generation = (None, None)
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__decisions)
+
+    def get_permission_set_id(self, role_collection: RoleCollection) -> int:
+        """Returns the interned id of the permission set of a frozen `role_collection`."""
+        permission_set_id = getattr(role_collection, "_permission_set_id", None)
+        if permission_set_id is None:
+            fingerprint = role_collection.fingerprint()
+            with self.__lock:
+                permission_set_id = self.__permission_set_ids.get(fingerprint)
+                if permission_set_id is None:
+                    if len(self.__permission_set_ids) >= self.maxsize:
+                        self.__permission_set_ids.clear()
+                    permission_set_id = self.__permission_set_ids[fingerprint] = next(
+                        self.__ids
+                    )
+            role_collection._permission_set_id = permission_set_id
+        return permission_set_id
+
+    def get_policy_id(
+        self, roles, env: Optional[str] = None, app_name: Optional[str] = None
+    ) -> int:
+        """Returns the interned id of the policy "holds all of `roles`, in `env` for `app_name` if given"."""
+        policy = (tuple(roles), env, app_name)
+        policy_id = self.__policy_ids.get(policy)
+        if policy_id is None:
+            with self.__lock:
+                if len(self.__policy_ids) >= self.maxsize:
+                    self.__policy_ids.clear()
+                policy_id = self.__policy_ids.setdefault(policy, next(self.__ids))
+        return policy_id
+
+    def is_authorized(
+        self,
+        role_collection: RoleCollection,
+        roles,
+        env: Optional[str],
+        app_name: Optional[str],
+        evaluate: Callable[[], bool],
+    ) -> bool:
+        """Returns the memoized decision of the policy for `role_collection`, calling `evaluate` to make it on a miss."""
+        if not role_collection.is_frozen():
+            return evaluate()
+        generation = self.__generation
+        hierarchy_version = get_hierarchy_version()
+        auth_config = get_auth_config()
+        if generation[0] != hierarchy_version or generation[1] is not auth_config:
+            self.clear()
+            self.__generation = (hierarchy_version, auth_config)
+        key = (
+            self.get_permission_set_id(role_collection),
+            self.get_policy_id(roles, env, app_name),
+        )
+        decision = self.__decisions.get(key)
+        if decision is not None:
+            self.hits += 1
+            return decision
+        self.misses += 1
+        decision = evaluate()
+        with self.__lock:
+            if len(self.__decisions) >= self.maxsize:
+                del self.__decisions[next(iter(self.__decisions))]
+            self.__decisions[key] = decision
+        return decision
+
+    def clear(self):
+        """Drops every memoized decision."""
+        with self.__lock:
+            self.__decisions.clear()
+
+
+decision_cache = DecisionCache()
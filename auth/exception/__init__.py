@@ -29,9 +29,11 @@ class UnAuthorizedException(Exception):
     - `message` (str): The error message associated with the exception.
     - `user_roles` (list or None): The roles of the user who triggered the exception.
     - `expected_roles` (list or None): The roles that were expected for the user to perform the action.
+    - `user_name` (str or None): The name of the user who triggered the exception.
+    - `role_collection` (RoleCollection or None): The effective roles of the user.
 
     Methods:
-    - `__init__(self, message, **kwargs)`: Initializes the exception with the given error message and optional keyword arguments. The `user_roles` and `expected_roles` are extracted from the keyword arguments and assigned to their respective attributes.
+    - `__init__(self, message, **kwargs)`: Initializes the exception with the given error message and optional keyword arguments. The `user_roles`, `expected_roles`, `user_name` and `role_collection` are extracted from the keyword arguments and assigned to their respective attributes.
     """
 
     def __init__(self, message, **kwargs):
@@ -40,6 +42,8 @@ class UnAuthorizedException(Exception):
         self.user_roles = kwargs.pop("user_roles", None)
         self.message = message
         self.expected_roles = kwargs.pop("expected_roles", None)
+        self.user_name = kwargs.pop("user_name", None)
+        self.role_collection = kwargs.pop("role_collection", None)
 
 
 class AuthInitializationException(Exception):
@@ -76,3 +80,63 @@ class InvalidRoleException(Exception):
 
     def __init__(self, message) -> None:
         super().__init__(message)
+
+
+class GroupMembershipResolutionException(Exception):
+    """This class represents an exception that is raised when the group membership of a user whose token has a group overage could not be fetched from Microsoft Graph. It is a subclass of the built-in `Exception` class.
+
+    #### Methods:
+
+    - `__init__(self, message)`: Initializes the exception with the given error message.
+    """
+
+    def __init__(self, message) -> None:
+        super().__init__(message)
+
+
+class CircuitOpenException(Exception):
+    """This class represents an exception that is raised when a call to an upstream endpoint is rejected because its circuit breaker is open. It is a subclass of the built-in `Exception` class.
+
+    Attributes:
+    - `endpoint` (str): The name of the endpoint whose circuit is open.
+    - `retry_after` (int): The number of seconds after which the endpoint will be probed again.
+    """
+
+    def __init__(self, message, **kwargs):
+        super().__init__(message)
+        self.endpoint = kwargs.pop("endpoint", None)
+        self.retry_after = kwargs.pop("retry_after", None)
+
+
+class OverloadedException(Exception):
+    """This class represents an exception that is raised when a request is shed because token verification is saturated, see `auth.admission.VerificationExecutor`. It is a subclass of the built-in `Exception` class.
+
+    Attributes:
+    - `reason` (str): `queue_full` if the request was rejected on arrival, `queue_timeout` if it waited too long for a verification thread.
+    - `retry_after` (int): The number of seconds after which the client should retry.
+    """
+
+    def __init__(self, message, **kwargs):
+        super().__init__(message)
+        self.reason = kwargs.pop("reason", None)
+        self.retry_after = kwargs.pop("retry_after", None)
+
+
+class InvalidTokenException(Exception):
+    """This class represents an exception that is raised when a token cannot be parsed or fails validation, whatever JWT backend is used. It is a subclass of the built-in `Exception` class.
+
+    #### Methods:
+
+    - `__init__(self, message)`: Initializes the exception with the given error message.
+    """
+
+    def __init__(self, message) -> None:
+        super().__init__(message)
+
+
+class InvalidSignatureException(InvalidTokenException):
+    """This class represents an exception that is raised when the signature of a token does not verify, e.g. because it was signed with a key that is no longer or not yet known. It is a subclass of `InvalidTokenException`."""
+
+
+class TokenExpiredException(InvalidTokenException):
+    """This class represents an exception that is raised when a token has expired. It is a subclass of `InvalidTokenException`."""
@@ -0,0 +1,180 @@
+import logging
+import time
+from typing import Optional
+
+from auth import get_role_hierarchy_snapshot
+from auth.admission import verification_executor
+from auth.audit import get_audit_log
+from auth.auth_config import compile_auth_config, get_auth_config
+from auth.decisions import decision_cache
+from auth.http.appservice import renewals
+from auth.http.graph import get_group_membership_resolver
+from auth.http.resilience import get_circuit_states
+from auth.jwttoken import token_service
+from auth.jwttoken.backends import generate_rsa_key, get_jwt_backend
+from auth.jwttoken.token import IdAndAccessToken, TokenProvider
+from auth.logs import get_logging_stats
+from auth.permissions import permission_set_cache
+from config import get_settings
+
+settings = get_settings()
+log = logging.getLogger(__name__)
+
+
+class WarmUpState:
+    """The outcome of the last `warm_up` run.
+
+    Attributes:
+    - `completed` (bool): `True` once a warm-up has run.
+    - `duration` (float): How many seconds the last warm-up took.
+    - `errors` (dict): The error of each warm-up step that failed, by step name.
+    """
+
+    def __init__(self):
+        self.completed = False
+        self.duration: Optional[float] = None
+        self.errors: dict[str, str] = {}
+
+
+warm_up_state = WarmUpState()
+
+
+def warm_up_signing_keys():
+    """Fetches the signing keys and builds the key objects of the JWT backend, so that the first requests do not pay for either."""
+    if not settings.WEBSITE_AUTH_ENABLED:
+        return
+    backend = get_jwt_backend()
+    for key in token_service.populate_signing_keys().values():
+        backend.get_key(key, "RS256")
+
+
+class SyntheticTokenProvider(TokenProvider):
+    """Hands out fixed tokens together with their already verified claims, so that the token service decodes them without looking up the real signing keys, see `warm_up_decode`."""
+
+    def __init__(self, tokens: IdAndAccessToken):
+        self.tokens = tokens
+
+    def get_id_and_access_token(self, **kwargs) -> IdAndAccessToken:
+        return self.tokens
+
+    def renew_token(self, **kwargs) -> IdAndAccessToken:
+        return self.tokens
+
+
+def warm_up_decode():
+    """Runs a synthetic token through the decode path: RS256 signing and verification by the JWT backend, group pattern matching, the role hierarchy, claims projection and the authorization check.
+
+    The token is signed with a throwaway key and verified against that key, so the step does not depend on the real signing keys and behaves the same whether or not `IS_ON_APP_SERVICE` and `WEBSITE_AUTH_ENABLED` are set. Its verified claims are then handed to the token service like claims App Service already validated.
+    """
+    pem, jwk = generate_rsa_key("warm-up")
+    backend = get_jwt_backend()
+    auth_config = get_auth_config()
+    group = f"{auth_config.app_name}-{auth_config.bypass_env}-{auth_config.reader_role_name}"
+    claims = {
+        "aud": "warm-up",
+        "exp": int(time.time()) + 60,
+        "name": "Warm-up",
+        auth_config.group_claim: [group],
+    }
+    token = backend.encode(claims, pem, "RS256", headers={"kid": jwk["kid"]})
+    claims = backend.verify(token, jwk, algorithms=["RS256"], audience="warm-up")
+    synthetic_service = token_service.DefaultTokenService(
+        SyntheticTokenProvider(IdAndAccessToken(token, token, claims=claims))
+    )
+    synthetic_service.decode_and_check_authorization([])
+
+
+WARM_UP_STEPS = {
+    "auth_config": compile_auth_config,
+    "role_hierarchy": get_role_hierarchy_snapshot,
+    "signing_keys": warm_up_signing_keys,
+    "synthetic_decode": warm_up_decode,
+}
+
+
+def warm_up() -> WarmUpState:
+    '''"""
+    This function primes the auth subsystem right after start-up, so that the first requests routed to a new instance are as fast as the following ones.
+
+    It compiles the auth configuration and the role hierarchy, fetches the signing keys and builds their key objects, and runs a synthetic decode. A failing step is logged and recorded in `warm_up_state.errors` but does not stop the others, so the application still starts; `get_readiness` reports it.
+
+    Returns:
+        WarmUpState: The outcome of the warm-up.
+    """'''
+    started = time.perf_counter()
+    errors = {}
+    for name, step in WARM_UP_STEPS.items():
+        try:
+            step()
+        except Exception as e:
+            log.warning("Auth warm-up step %s failed: %s", name, e)
+            errors[name] = str(e)
+    warm_up_state.errors = errors
+    warm_up_state.duration = time.perf_counter() - started
+    warm_up_state.completed = True
+    return warm_up_state
+
+
+def get_liveness() -> dict:
+    """Returns the liveness status. The process is alive as long as it can answer."""
+    return {"status": "ok"}
+
+
+def get_readiness() -> dict:
+    '''"""
+    This function reports whether the instance is ready to serve authenticated traffic, with the state of the auth subsystem.
+
+    The instance is ready once the warm-up has run and, if `WEBSITE_AUTH_ENABLED` is set, signing keys are available. Stale keys, open circuits and shed requests are reported but do not make the instance unready, since requests can still be served.
+
+    Returns:
+        dict: `ready` (bool) and the details: warm-up outcome, signing key count, age and staleness, pre-verification rejections, the signing keys of each tenant if `AZURE_TENANTS` is set, cache sizes, verification queue depth, wait times and shed requests, circuit breaker states, logging counters and audit log counters.
+    """'''
+    signing_key_cache = token_service.signing_key_cache
+    key_age = signing_key_cache.get_age()
+    group_resolver = get_group_membership_resolver()
+    has_keys = bool(signing_key_cache.keys)
+    audit_log = get_audit_log()
+    tenant_registry = token_service.tenant_registry
+    return {
+        "ready": warm_up_state.completed
+        and (has_keys or not settings.WEBSITE_AUTH_ENABLED),
+        "warm_up": {
+            "completed": warm_up_state.completed,
+            "duration_seconds": warm_up_state.duration,
+            "errors": warm_up_state.errors,
+        },
+        "signing_keys": {
+            "count": len(signing_key_cache.keys),
+            "age_seconds": None if key_age is None else round(key_age, 3),
+            "stale": signing_key_cache.stale,
+            "unknown_kids": len(signing_key_cache.unknown_kids),
+        },
+        "pre_verification": token_service.pre_verification.get_stats(),
+        "caches": {
+            "permission_sets": len(permission_set_cache),
+            "decisions": len(decision_cache),
+            "token_renewals": len(renewals),
+            "group_memberships": (
+                None if group_resolver is None else len(group_resolver)
+            ),
+        },
+        "tenants": (
+            None
+            if tenant_registry is None
+            else {
+                tenant_id: {
+                    "loaded": tenant.is_loaded(),
+                    "count": (
+                        len(tenant.signing_key_cache.keys) if tenant.is_loaded() else 0
+                    ),
+                    "stale": tenant.is_loaded() and tenant.signing_key_cache.stale,
+                }
+                for tenant_id, tenant in tenant_registry.tenants.items()
+            }
+        ),
+        "verification": verification_executor.get_stats(),
+        "circuits": get_circuit_states(),
+        "logging": get_logging_stats(),
+        "audit": None if audit_log is None else audit_log.get_stats(),
+        "role_hierarchy_version": get_role_hierarchy_snapshot().version,
+    }
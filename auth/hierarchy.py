@@ -0,0 +1,132 @@
+import json
+import logging
+import os
+import threading
+from typing import Optional
+
+from auth import RoleHierarchy, RoleHierarchySnapshot, swap_role_hierarchy
+from auth.exception import AuthInitializationException
+from config import get_settings
+
+settings = get_settings()
+log = logging.getLogger(__name__)
+
+
+def parse_role_hierarchy(document: dict) -> dict[str, RoleHierarchy]:
+    """Builds a new `role name -> RoleHierarchy` mapping from a declarative hierarchy document.
+
+    The document lists the roles each role directly grants implicitly:
+
+    ```json
+    {"roles": {"admin": ["contributor", "reader"], "contributor": ["reader"], "reader": []}}
+    ```
+
+    Raises:
+    - `AuthInitializationException`: If the document is malformed or refers to a role it does not declare.
+    """
+    graph = document.get("roles") if isinstance(document, dict) else None
+    if not isinstance(graph, dict) or not all(
+        isinstance(implied, list) for implied in graph.values()
+    ):
+        raise AuthInitializationException(
+            "Role hierarchy must be an object with a 'roles' mapping of role name to a list of role names"
+        )
+    roles = {name: RoleHierarchy(name) for name in graph}
+    for name, implied in graph.items():
+        unknown = [role_name for role_name in implied if role_name not in roles]
+        if unknown:
+            raise AuthInitializationException(
+                f"Role {name} refers to undeclared roles {unknown}"
+            )
+        roles[name].implicit_permissions.extend(
+            roles[role_name] for role_name in implied
+        )
+    return roles
+
+
+def load_role_hierarchy(path: str) -> RoleHierarchySnapshot:
+    '''"""
+    This function loads the role hierarchy from a JSON file and makes it the current hierarchy.
+
+    The new hierarchy is built and compiled completely before it is swapped in, so requests keep using the previous hierarchy until the swap and never see a partially loaded one. If the file is invalid, the current hierarchy is kept.
+
+    Parameters:
+    - path (str): The path of the hierarchy file, see `parse_role_hierarchy` for the format.
+
+    Returns:
+    - RoleHierarchySnapshot: The new snapshot.
+
+    Raises:
+    - AuthInitializationException: If the file cannot be read or is invalid.
+    """'''
+    try:
+        with open(path) as hierarchy_file:
+            document = json.load(hierarchy_file)
+    except (OSError, ValueError) as e:
+        raise AuthInitializationException(f"Could not load role hierarchy {path}: {e}")
+    return swap_role_hierarchy(parse_role_hierarchy(document))
+
+
+class RoleHierarchyReloader:
+    """The `RoleHierarchyReloader` class watches a role hierarchy file and reloads it when its modification time changes.
+
+    The file is polled every `interval` seconds on a daemon thread. Reload errors are logged and the current hierarchy is kept.
+    """
+
+    def __init__(self, path: str, interval: float):
+        self.path = path
+        self.interval = interval
+        self.__mtime = self.__get_mtime()
+        self.__stopped = threading.Event()
+        self.__thread: Optional[threading.Thread] = None
+
+    def __get_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def start(self):
+        self.__thread = threading.Thread(
+            target=self.__run, name="role-hierarchy-reloader", daemon=True
+        )
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        self.__stopped.set()
+
+    def check(self) -> bool:
+        """Reloads the file if it changed since the last check. Returns `True` if a new hierarchy was loaded."""
+        mtime = self.__get_mtime()
+        if mtime is None or mtime == self.__mtime:
+            return False
+        self.__mtime = mtime
+        try:
+            snapshot = load_role_hierarchy(self.path)
+        except AuthInitializationException as e:
+            log.error("Keeping the current role hierarchy: %s", e)
+            return False
+        log.info("Reloaded role hierarchy %s, version %s", self.path, snapshot.version)
+        return True
+
+    def __run(self):
+        while not self.__stopped.wait(self.interval):
+            self.check()
+
+
+role_hierarchy_reloader: Optional[RoleHierarchyReloader] = None
+
+
+def init_role_hierarchy_from_settings():
+    '''"""
+    This function loads the role hierarchy file configured in the `ROLE_HIERARCHY_FILE` setting, if any, and starts watching it for changes when `ROLE_HIERARCHY_RELOAD_SECONDS` is greater than 0.
+    """'''
+    global role_hierarchy_reloader
+    if not settings.ROLE_HIERARCHY_FILE:
+        return
+    load_role_hierarchy(settings.ROLE_HIERARCHY_FILE)
+    if settings.ROLE_HIERARCHY_RELOAD_SECONDS > 0 and role_hierarchy_reloader is None:
+        role_hierarchy_reloader = RoleHierarchyReloader(
+            settings.ROLE_HIERARCHY_FILE, settings.ROLE_HIERARCHY_RELOAD_SECONDS
+        ).start()
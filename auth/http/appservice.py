@@ -1,14 +1,142 @@
-from typing import List
+import hashlib
+import json
+import time
+from datetime import datetime
+from typing import Optional
 
 from fastapi import HTTPException
 from starlette.requests import Request
 
-from auth import retryable_requester
-from auth.exception import AccessTokenMissingException, IdTokenMissingException
+from auth import guarded_request
+from auth.auth_config import get_auth_config
+from auth.exception import (
+    AccessTokenMissingException,
+    CircuitOpenException,
+    IdTokenMissingException,
+)
 from auth.jwttoken.token import TokenProvider, IdAndAccessToken
+from auth.singleflight import SingleFlight
 from config import get_settings
 
 settings = get_settings()
+renewals = SingleFlight()
+
+AUTH_ME_PROVIDER = "aad"
+AUTH_ME_CLAIM_TYPES = {
+    "http://schemas.microsoft.com/identity/claims/objectidentifier": "oid",
+    "http://schemas.microsoft.com/identity/claims/tenantid": "tid",
+    "http://schemas.xmlsoap.org/ws/2005/05/identity/claims/emailaddress": "email",
+    "http://schemas.xmlsoap.org/ws/2005/05/identity/claims/nameidentifier": "sub",
+    "http://schemas.microsoft.com/ws/2008/06/identity/claims/groups": "groups",
+    "http://schemas.microsoft.com/ws/2008/06/identity/claims/role": "roles",
+}
+NUMERIC_CLAIMS = frozenset(["exp", "nbf", "iat", "auth_time"])
+JSON_CLAIMS = frozenset(["_claim_names", "_claim_sources"])
+
+
+def get_header(request: Request, name: str, raw_name: bytes) -> Optional[str]:
+    """Returns the value of the header `name` of `request`, or `None`.
+
+    For Starlette requests the header is looked up by its pre-encoded lowercase `raw_name` directly in the headers of the ASGI scope, which avoids building the `Headers` object on every request. Other request objects fall back to `request.headers`.
+    """
+    scope = getattr(request, "scope", None)
+    if not isinstance(scope, dict):
+        return request.headers.get(name)
+    for key, value in scope.get("headers", ()):
+        if key == raw_name:
+            return value.decode("latin-1")
+    return None
+
+
+def get_session_key(request: Request) -> Optional[str]:
+    """Returns a key identifying the browser session of `request`: a digest of the App Service session cookie, or of the access token if the cookie is missing. Only digests are used so that the raw credentials are never kept as cache keys.
+
+    Returns `None` if the request has neither, as unrelated anonymous requests must not share one session.
+    """
+    auth_config = get_auth_config()
+    session = request.cookies.get(auth_config.session_cookie)
+    if session is None:
+        session = get_header(
+            request,
+            auth_config.access_token_header,
+            auth_config.access_token_header_raw,
+        )
+    if not session:
+        return None
+    return hashlib.sha256(session.encode()).hexdigest()
+
+
+def parse_expires_on(expires_on: Optional[str]) -> Optional[float]:
+    """Parses the `expires_on` timestamp of `.auth/me` (e.g. `2024-01-01T00:00:00.0000000Z`) into seconds since the epoch, or returns `None` if it is missing or invalid."""
+    if not expires_on:
+        return None
+    try:
+        # .auth/me has 7 fractional digits, more than fromisoformat accepts
+        seconds, _, _ = expires_on.rstrip("Z").partition(".")
+        return datetime.fromisoformat(seconds + "+00:00").timestamp()
+    except ValueError:
+        return None
+
+
+def parse_auth_me(payload) -> IdAndAccessToken:
+    """Parses the response of the App Service `.auth/me` endpoint into an `IdAndAccessToken`.
+
+    The response is a list with one entry per identity provider. The entry of the `aad` provider (or the first one with an ID token) is used. Its `user_claims` array of `{"typ": ..., "val": ...}` pairs is turned into a claims dictionary directly, so the tokens do not need to be decoded again:
+
+    - Well known claim type URIs are mapped to their short names, e.g. `.../objectidentifier` to `oid`.
+    - Repeated claims and the group claim become lists, `exp`/`nbf`/`iat` become integers and `_claim_names`/`_claim_sources` are parsed from JSON.
+
+    Raises:
+    - `IdTokenMissingException`: If no entry has an ID token.
+    - `AccessTokenMissingException`: If the entry has no access token.
+    """
+    entries = [
+        entry
+        for entry in (payload if isinstance(payload, list) else [])
+        if entry.get("id_token")
+    ]
+    if not entries:
+        raise IdTokenMissingException("No id token found in .auth/me response")
+    entry = next(
+        (entry for entry in entries if entry.get("provider_name") == AUTH_ME_PROVIDER),
+        entries[0],
+    )
+    if not entry.get("access_token"):
+        raise AccessTokenMissingException("No access token found in .auth/me response")
+    group_claim = get_auth_config().group_claim
+    claims = {}
+    for user_claim in entry.get("user_claims", ()):
+        name = AUTH_ME_CLAIM_TYPES.get(user_claim["typ"], user_claim["typ"])
+        value = user_claim["val"]
+        if name in NUMERIC_CLAIMS:
+            value = int(value)
+        elif name in JSON_CLAIMS:
+            value = json.loads(value)
+        if name == group_claim or name == "roles":
+            claims.setdefault(name, []).append(value)
+        elif name in claims:
+            if not isinstance(claims[name], list):
+                claims[name] = [claims[name]]
+            claims[name].append(value)
+        else:
+            claims[name] = value
+    expires_at = parse_expires_on(entry.get("expires_on"))
+    if expires_at is None:
+        expires_at = claims.get("exp")
+    return IdAndAccessToken(
+        access_token=entry["access_token"],
+        id_token=entry["id_token"],
+        claims=claims,
+        expires_at=expires_at,
+    )
+
+
+def get_renewal_ttl(tokens) -> float:
+    """Returns how long renewed `tokens` are kept for the session: until they expire, or `TOKEN_RENEWAL_CACHE_SECONDS` if their expiry is unknown."""
+    expires_at = getattr(tokens, "expires_at", None)
+    if expires_at is None:
+        return settings.TOKEN_RENEWAL_CACHE_SECONDS
+    return max(0.0, expires_at - time.time())
 
 
 class AppServiceBasedTokenProvider(TokenProvider):
@@ -36,36 +164,55 @@ class AppServiceBasedTokenProvider(TokenProvider):
         :return: An instance of the `IdAndAccessToken` class containing the access and ID tokens.
         :rtype: IdAndAccessToken
         """
-        if kwargs["request"] is None:
+        request = kwargs["request"]
+        if request is None:
             raise ValueError("Request is required argument")
-        access_token = kwargs["request"].headers.get(
-            settings.APP_SERVICE_ACCESS_TOKEN_HEADER
+        auth_config = get_auth_config()
+        access_token = get_header(
+            request,
+            auth_config.access_token_header,
+            auth_config.access_token_header_raw,
         )
         if access_token is None:
             raise AccessTokenMissingException("Access Token is missing")
-        id_token = kwargs["request"].headers.get(settings.APP_SERVICE_ID_TOKEN_HEADER)
+        id_token = get_header(
+            request, auth_config.id_token_header, auth_config.id_token_header_raw
+        )
         if id_token is None:
             raise IdTokenMissingException("Id token is not found")
         return IdAndAccessToken(access_token=access_token, id_token=id_token)
 
-    def renew_token(self, **kwargs) -> List[dict]:
+    def renew_token(self, **kwargs) -> IdAndAccessToken:
         """
         Renews the access token by refreshing it with the Azure App Service authentication endpoint.
 
         This method is used to renew the access token by refreshing it with the Azure App Service authentication endpoint.
         It retrieves the request object from the keyword arguments, and uses it to refresh the access token.
 
+        Renewals are merged per session (see `get_session_key`): when many requests of the same browser find the token
+        expired at once, only one of them calls the App Service endpoints and the others share its result. The result is
+        kept for the requests that follow until the renewed tokens expire (see `get_renewal_ttl`). Requests without a session
+        cookie or access token are renewed on their own.
+
         :param request: The incoming request.
         :type request: Request
         :raises HTTPException: If the request is not authorized.
-        :return: A list of dictionaries containing the renewed access token.
-        :rtype: List[dict]
+        :return: The renewed tokens with their claims, see `parse_auth_me`.
+        :rtype: IdAndAccessToken
         """
-        if kwargs["request"] is None:
+        request = kwargs["request"]
+        if request is None:
             raise ValueError("Request is required argument")
-        return self.__get_new_token(kwargs["request"])
+        session_key = get_session_key(request)
+        if session_key is None:
+            return self.__get_new_token(request)
+        return renewals.do(
+            session_key,
+            lambda: self.__get_new_token(request),
+            ttl=get_renewal_ttl,
+        )
 
-    def __get_new_token(self, request: Request) -> List[dict]:
+    def __get_new_token(self, request: Request) -> IdAndAccessToken:
         """
         Retrieves a new access token by refreshing the current access token.
 
@@ -75,18 +222,35 @@ class AppServiceBasedTokenProvider(TokenProvider):
 
         :param request: The incoming request.
         :type request: Request
-        :raises HTTPException: If the request is not authorized.
-        :return: A list of dictionaries containing the new access token.
-        :rtype: List[dict]
+        :raises HTTPException: If the request is not authorized or the new tokens are already expired, or with status
+            code 503 if the App Service authentication endpoints are unavailable.
+        :return: The new tokens with their claims, see `parse_auth_me`.
+        :rtype: IdAndAccessToken
         """
-        self.__refresh_token(request)
-        s = retryable_requester()
-        new_token = s.get(
-            f"{request.base_url}.auth/me", timeout=5, cookies=request.cookies
-        )
-        if new_token.status_code == 200:
-            return new_token.json()
-        raise HTTPException(status_code=403, detail="Not authorized.")
+        try:
+            self.__refresh_token(request)
+            new_token = guarded_request(
+                "appservice",
+                "GET",
+                f"{request.base_url}.auth/me",
+                timeout=5,
+                cookies=request.cookies,
+            )
+        except CircuitOpenException as e:
+            raise HTTPException(
+                status_code=503,
+                detail="Authentication service is unavailable. Please try again later.",
+                headers={"Retry-After": str(e.retry_after)},
+            )
+        if new_token.status_code != 200:
+            raise HTTPException(status_code=403, detail="Not authorized.")
+        tokens = parse_auth_me(new_token.json())
+        if tokens.expires_at is not None and tokens.expires_at <= time.time():
+            raise HTTPException(
+                status_code=403,
+                detail="Not authorized. Please refresh the page to re-initiate login.",
+            )
+        return tokens
 
     @staticmethod
     def __refresh_token(request: Request) -> None:
@@ -101,8 +265,9 @@ class AppServiceBasedTokenProvider(TokenProvider):
         :raises HTTPException: If the request is not authorized.
         :return: None
         """
-        s = retryable_requester()
-        esp = s.get(
+        esp = guarded_request(
+            "appservice",
+            "GET",
             f"{request.base_url}.auth/refresh",
             timeout=5,
             cookies=request.cookies,
@@ -0,0 +1,260 @@
+import asyncio
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Optional
+
+import httpx
+
+from auth.auth_config import get_auth_config
+from auth.exception import GroupMembershipResolutionException
+from config import get_settings
+
+settings = get_settings()
+log = logging.getLogger(__name__)
+
+
+def has_group_overage(claims: dict) -> bool:
+    """Returns `True` if the token claims indicate a group overage.
+
+    When a user is a member of more groups than fit in a token (about 200 for JWTs), Entra ID omits the `groups` claim and instead adds `_claim_names`/`_claim_sources` entries that point at Microsoft Graph.
+    """
+    group_claim = get_auth_config().group_claim
+    return group_claim not in claims and group_claim in claims.get("_claim_names", {})
+
+
+def run_sync(coroutine):
+    """Runs `coroutine` to completion from synchronous code. If the calling thread already runs an event loop, the coroutine is run on a separate thread so the loop is not re-entered."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
+
+
+class GroupMembershipResolver(ABC):
+    """Class: GroupMembershipResolver
+
+    This class is an abstract base class (ABC) for resolving the group names of users whose token has a group overage.
+
+    Methods:
+    1. fetch_groups_batch(self, object_ids, access_token) -> dict[str, list[str]]:
+       - This abstract coroutine fetches the group names for several users at once.
+       - Parameters: object_ids (list[str]) - the `oid` claims of the users; access_token (str) - a token that is allowed to read their group membership.
+       - Returns: A dictionary mapping each object id to the list of its group names.
+    """
+
+    @abstractmethod
+    async def fetch_groups_batch(
+        self, object_ids: list[str], access_token: str
+    ) -> dict[str, list[str]]:
+        """Fetch the group names of the given users"""
+
+    async def fetch_groups(self, object_id: str, access_token: str) -> list[str]:
+        """Fetches the group names of a single user."""
+        return (await self.fetch_groups_batch([object_id], access_token))[object_id]
+
+
+class GraphGroupMembershipResolver(GroupMembershipResolver):
+    """Resolves group membership through Microsoft Graph.
+
+    The first page of every user is requested through the Graph JSON batching endpoint (`/$batch`, up to `GRAPH_BATCH_SIZE` users per call), and remaining pages are followed through `@odata.nextLink` concurrently. Groups are returned by display name, which is the format `GROUP_PATTERN` expects. The access token needs the `GroupMember.Read.All` permission.
+
+    Requests resolve the groups of their own user only, with the user's own access token, so `CachedGroupMembershipResolver` fetches one user per call; several users are only batched by callers holding a token that may read all of them, e.g. an application token.
+    """
+
+    def __init__(
+        self,
+        endpoint: str = None,
+        batch_size: int = None,
+        timeout: float = 5,
+    ):
+        self.endpoint = (endpoint or settings.GRAPH_API_ENDPOINT).rstrip("/")
+        self.batch_size = batch_size or settings.GRAPH_BATCH_SIZE
+        self.timeout = timeout
+
+    @staticmethod
+    def member_of_path(object_id: str) -> str:
+        return f"/users/{object_id}/transitiveMemberOf/microsoft.graph.group?$select=displayName&$top=999"
+
+    async def fetch_groups_batch(
+        self, object_ids: list[str], access_token: str
+    ) -> dict[str, list[str]]:
+        headers = {"Authorization": f"Bearer {access_token}"}
+        async with httpx.AsyncClient(headers=headers, timeout=self.timeout) as client:
+            chunks = [
+                object_ids[i : i + self.batch_size]
+                for i in range(0, len(object_ids), self.batch_size)
+            ]
+            results = await asyncio.gather(
+                *(self.__fetch_chunk(client, chunk) for chunk in chunks)
+            )
+        groups = {}
+        for result in results:
+            groups.update(result)
+        return groups
+
+    async def __fetch_chunk(self, client: httpx.AsyncClient, object_ids: list[str]):
+        body = {
+            "requests": [
+                {"id": str(i), "method": "GET", "url": self.member_of_path(object_id)}
+                for i, object_id in enumerate(object_ids)
+            ]
+        }
+        response = await client.post(f"{self.endpoint}/$batch", json=body)
+        if response.status_code != 200:
+            raise GroupMembershipResolutionException(
+                f"Graph batch request failed with status {response.status_code}"
+            )
+        pages = {}
+        for item in response.json()["responses"]:
+            object_id = object_ids[int(item["id"])]
+            if item["status"] != 200:
+                raise GroupMembershipResolutionException(
+                    f"Graph request for {object_id} failed with status {item['status']}"
+                )
+            pages[object_id] = item["body"]
+        remaining = await asyncio.gather(
+            *(self.__follow_next_links(client, page) for page in pages.values())
+        )
+        return {
+            object_id: self.__group_names(page) + more
+            for (object_id, page), more in zip(pages.items(), remaining)
+        }
+
+    async def __follow_next_links(self, client: httpx.AsyncClient, page: dict):
+        groups = []
+        next_link = page.get("@odata.nextLink")
+        while next_link:
+            response = await client.get(next_link)
+            if response.status_code != 200:
+                raise GroupMembershipResolutionException(
+                    f"Graph request {next_link} failed with status {response.status_code}"
+                )
+            page = response.json()
+            groups.extend(self.__group_names(page))
+            next_link = page.get("@odata.nextLink")
+        return groups
+
+    @staticmethod
+    def __group_names(page: dict) -> list[str]:
+        return [
+            group["displayName"]
+            for group in page.get("value", [])
+            if group.get("displayName")
+        ]
+
+
+class CachedGroupMembershipResolver:
+    """Caches the group membership fetched by a `GroupMembershipResolver` per object id, so only the first request of a user pays for the lookup.
+
+    Entries live for `ttl` seconds. Once an entry is older than `ttl - refresh_ahead`, the cached groups are still returned but a refresh is queued on a single background thread, so users that keep sending requests never block on Graph. If refreshing an expired entry fails, the expired groups are returned rather than failing the request. At most one fetch per object id runs or is queued at a time and the cache holds at most `maxsize` users, evicting the least recently used one.
+
+    Each user's groups are fetched with that user's access token, since a delegated token should not be used to read the membership of other users; concurrent misses of the same user share one fetch, misses of different users are not batched together.
+    """
+
+    def __init__(
+        self,
+        resolver: GroupMembershipResolver,
+        ttl: float = None,
+        refresh_ahead: float = None,
+        maxsize: int = None,
+    ):
+        self.resolver = resolver
+        self.ttl = settings.GROUP_MEMBERSHIP_CACHE_TTL_SECONDS if ttl is None else ttl
+        self.refresh_ahead = (
+            settings.GROUP_MEMBERSHIP_REFRESH_AHEAD_SECONDS
+            if refresh_ahead is None
+            else refresh_ahead
+        )
+        self.maxsize = maxsize or settings.GROUP_MEMBERSHIP_CACHE_SIZE
+        self.__entries: OrderedDict[str, tuple[list[str], float]] = OrderedDict()
+        self.__in_flight: dict[str, threading.Event] = {}
+        self.__lock = threading.Lock()
+        self.__refresh_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="group-membership-refresh"
+        )
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def get_groups(self, object_id: str, access_token: str) -> list[str]:
+        """Returns the group names of `object_id`, fetching them if they are not cached or have expired."""
+        now = time.monotonic()
+        with self.__lock:
+            entry = self.__entries.get(object_id)
+            if entry is not None:
+                self.__entries.move_to_end(object_id)
+                groups, fetched_at = entry
+                age = now - fetched_at
+                if age < self.ttl:
+                    if age >= self.ttl - self.refresh_ahead:
+                        self.__start_fetch(object_id, access_token, background=True)
+                    return groups
+        return self.__fetch(object_id, access_token)
+
+    def invalidate(self, object_id: str = None):
+        """Drops the cached groups of `object_id`, or of every user if no object id is given."""
+        with self.__lock:
+            if object_id is None:
+                self.__entries.clear()
+            else:
+                self.__entries.pop(object_id, None)
+
+    def __start_fetch(self, object_id, access_token, background):
+        """Starts a fetch unless one is already running for `object_id`. Must be called with the lock held. Returns the event that is set once the running fetch completes and whether this call started it."""
+        event = self.__in_flight.get(object_id)
+        if event is not None:
+            return event, False
+        event = threading.Event()
+        self.__in_flight[object_id] = event
+        if background:
+            self.__refresh_executor.submit(
+                self.__run_fetch, object_id, access_token, event
+            )
+        return event, True
+
+    def __fetch(self, object_id, access_token) -> list[str]:
+        with self.__lock:
+            event, started = self.__start_fetch(
+                object_id, access_token, background=False
+            )
+        if started:
+            self.__run_fetch(object_id, access_token, event)
+        else:
+            event.wait()
+        with self.__lock:
+            entry = self.__entries.get(object_id)
+        if entry is None:
+            raise GroupMembershipResolutionException(
+                f"Could not resolve group membership for {object_id}"
+            )
+        return entry[0]
+
+    def __run_fetch(self, object_id, access_token, event: threading.Event):
+        try:
+            groups = run_sync(self.resolver.fetch_groups(object_id, access_token))
+            with self.__lock:
+                self.__entries[object_id] = (groups, time.monotonic())
+                self.__entries.move_to_end(object_id)
+                while len(self.__entries) > self.maxsize:
+                    self.__entries.popitem(last=False)
+        except Exception as e:
+            log.warning("Failed to resolve group membership for %s: %s", object_id, e)
+        finally:
+            with self.__lock:
+                self.__in_flight.pop(object_id, None)
+            event.set()
+
+
+@lru_cache()
+def get_group_membership_resolver() -> Optional[CachedGroupMembershipResolver]:
+    """Returns the process wide group membership resolver, or `None` if the `GROUP_OVERAGE_RESOLUTION_ENABLED` setting is disabled."""
+    if not settings.GROUP_OVERAGE_RESOLUTION_ENABLED:
+        return None
+    return CachedGroupMembershipResolver(GraphGroupMembershipResolver())
@@ -0,0 +1,205 @@
+import logging
+import threading
+import time
+from typing import Callable
+
+from urllib3.exceptions import MaxRetryError, ResponseError
+from urllib3.util.retry import Retry
+
+from auth.exception import CircuitOpenException
+from config import get_settings
+
+settings = get_settings()
+log = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """The `CircuitBreaker` class stops calling an upstream endpoint that keeps failing.
+
+    The breaker starts `closed` and lets every call through. After `failure_threshold` consecutive failures it becomes `open` and rejects calls immediately with a `CircuitOpenException` instead of letting request threads wait on retries. Once `reset_timeout` seconds have passed it becomes `half_open` and lets a single probe call through: if the probe succeeds the breaker closes again, otherwise it re-opens for another `reset_timeout`.
+
+    Example usage:
+    ```python
+    breaker = CircuitBreaker("jwks")
+    response = breaker.call(lambda: requests.get(jwks_uri), is_failure=lambda r: r.status_code >= 500)
+    ```
+    """
+
+    def __init__(
+        self, name: str, failure_threshold: int = None, reset_timeout: float = None
+    ):
+        self.name = name
+        self.failure_threshold = (
+            failure_threshold or settings.CIRCUIT_BREAKER_FAILURE_THRESHOLD
+        )
+        self.reset_timeout = (
+            settings.CIRCUIT_BREAKER_RESET_SECONDS
+            if reset_timeout is None
+            else reset_timeout
+        )
+        self.failures = 0
+        self.opened_at = 0.0
+        self.__state = CLOSED
+        self.__probing = False
+        self.__lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """Returns `closed`, `open` or `half_open`."""
+        with self.__lock:
+            if self.__state == OPEN and self.__retry_after() <= 0:
+                return HALF_OPEN
+            return self.__state
+
+    def __retry_after(self) -> float:
+        return self.opened_at + self.reset_timeout - time.monotonic()
+
+    def __before_call(self):
+        with self.__lock:
+            if self.__state == CLOSED:
+                return
+            retry_after = self.__retry_after()
+            if retry_after > 0 or self.__probing:
+                raise CircuitOpenException(
+                    f"Circuit for {self.name} is open",
+                    endpoint=self.name,
+                    retry_after=max(1, int(retry_after + 0.999)),
+                )
+            self.__state = HALF_OPEN
+            self.__probing = True
+
+    def __record(self, failed: bool):
+        with self.__lock:
+            self.__probing = False
+            if not failed:
+                self.failures = 0
+                self.__state = CLOSED
+                return
+            self.failures += 1
+            if self.__state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.__state != OPEN:
+                    log.warning(
+                        "Circuit for %s opened after %s failures",
+                        self.name,
+                        self.failures,
+                    )
+                self.__state = OPEN
+                self.opened_at = time.monotonic()
+
+    def call(
+        self, fn: Callable[[], object], is_failure: Callable[[object], bool] = None
+    ):
+        """Calls `fn` through the breaker.
+
+        Parameters:
+        - `fn`: The call to the upstream endpoint.
+        - `is_failure`: Decides whether a returned result counts as a failure (e.g. a 5xx response). Raised exceptions always count as failures.
+
+        Returns:
+        - The result of `fn`.
+
+        Raises:
+        - `CircuitOpenException`: If the circuit is open, or half-open with a probe already running.
+        """
+        self.__before_call()
+        try:
+            result = fn()
+        except BaseException:
+            self.__record(failed=True)
+            raise
+        self.__record(failed=is_failure is not None and is_failure(result))
+        return result
+
+    def reset(self):
+        """Closes the breaker and forgets past failures."""
+        with self.__lock:
+            self.failures = 0
+            self.__state = CLOSED
+            self.__probing = False
+
+
+class RetryBudget:
+    """The `RetryBudget` class limits retries across all upstream calls of the process.
+
+    Every upstream request deposits `ratio` retry tokens and every retry spends one, so retries can add at most `ratio` extra load. `min_per_second` tokens are added over time so that low traffic can still retry. During an outage the budget runs dry and failing requests return after their first attempt instead of every worker thread sleeping through backoffs.
+    """
+
+    def __init__(
+        self, ratio: float = None, min_per_second: float = None, max_tokens: float = 10
+    ):
+        self.ratio = settings.RETRY_BUDGET_RATIO if ratio is None else ratio
+        self.min_per_second = (
+            settings.RETRY_BUDGET_MIN_PER_SECOND
+            if min_per_second is None
+            else min_per_second
+        )
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.exhausted = 0
+        self.__updated_at = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def deposit(self):
+        """Records an upstream request."""
+        with self.__lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        """Takes one retry token. Returns `False` if the budget is exhausted."""
+        with self.__lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.max_tokens,
+                self.tokens + (now - self.__updated_at) * self.min_per_second,
+            )
+            self.__updated_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            self.exhausted += 1
+            return False
+
+
+retry_budget = RetryBudget()
+
+
+class BudgetedRetry(Retry):
+    """A urllib3 `Retry` that only retries while the process wide `retry_budget` has tokens left."""
+
+    def increment(
+        self,
+        method=None,
+        url=None,
+        response=None,
+        error=None,
+        _pool=None,
+        _stacktrace=None,
+    ):
+        new_retry = super().increment(method, url, response, error, _pool, _stacktrace)
+        if not retry_budget.try_spend():
+            raise MaxRetryError(
+                _pool, url, error or ResponseError("retry budget exhausted")
+            )
+        return new_retry
+
+
+circuit_breakers: dict[str, CircuitBreaker] = {}
+circuit_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(name: str) -> CircuitBreaker:
+    """Returns the circuit breaker of the upstream endpoint `name`, creating it on first use."""
+    breaker = circuit_breakers.get(name)
+    if breaker is None:
+        with circuit_breakers_lock:
+            breaker = circuit_breakers.setdefault(name, CircuitBreaker(name))
+    return breaker
+
+
+def get_circuit_states() -> dict[str, str]:
+    """Returns the state of every circuit breaker by endpoint name."""
+    return {name: breaker.state for name, breaker in list(circuit_breakers.items())}
@@ -0,0 +1,344 @@
+import base64
+import hashlib
+import hmac
+import json
+import time
+from abc import ABC, abstractmethod
+from typing import Optional, Union
+
+import jwt as pyjwt
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+from cryptography.hazmat.primitives.asymmetric.rsa import (
+    RSAPrivateKey,
+    RSAPublicNumbers,
+)
+from jose import exceptions as jose_exceptions
+from jose import jwk as jose_jwk
+from jose import jwt as jose_jwt
+
+from auth.auth_config import get_auth_config
+from auth.exception import (
+    AuthInitializationException,
+    InvalidSignatureException,
+    InvalidTokenException,
+    TokenExpiredException,
+)
+
+Key = Union[str, bytes, dict]
+
+
+class JwtBackend(ABC):
+    """The `JwtBackend` class is the interface of the libraries used to parse, verify and encode JWTs.
+
+    Every backend raises the same exceptions, so callers do not depend on the library in use:
+    - `TokenExpiredException` if the `exp` claim is in the past,
+    - `InvalidSignatureException` if the signature does not verify with the key,
+    - `InvalidTokenException` for any other malformed or invalid token, e.g. a wrong audience.
+
+    Keys are JWK dictionaries (as served by the JWKS endpoint) for RS256 and secrets for HS256. Backends keep the key objects they build from JWKs, so that the key is only constructed once.
+    """
+
+    name: str = None
+
+    def __init__(self, max_keys: int = 64):
+        self.max_keys = max_keys
+        self.__keys: dict = {}
+
+    def get_key(self, key: Key, algorithm: str):
+        """Returns the key object of the backend for `key`, building it on first use."""
+        if not isinstance(key, dict):
+            return key
+        cache_key = (algorithm, key.get("kid"), key.get("n"), key.get("e"))
+        key_object = self.__keys.get(cache_key)
+        if key_object is None:
+            if len(self.__keys) >= self.max_keys:
+                self.__keys.clear()
+            key_object = self.__keys[cache_key] = self.build_key(key, algorithm)
+        return key_object
+
+    @abstractmethod
+    def build_key(self, key: dict, algorithm: str):
+        """Builds the key object of the backend from a JWK."""
+
+    @abstractmethod
+    def get_unverified_header(self, token: str) -> dict:
+        """Returns the header of `token` without verifying it."""
+
+    @abstractmethod
+    def get_unverified_claims(self, token: str) -> dict:
+        """Returns the claims of `token` without verifying it."""
+
+    @abstractmethod
+    def verify(
+        self, token: str, key: Key, algorithms: list, audience: Optional[str] = None
+    ) -> dict:
+        """Verifies the signature, expiry and audience of `token` and returns its claims."""
+
+    @abstractmethod
+    def encode(
+        self, claims: dict, key: Key, algorithm: str, headers: Optional[dict] = None
+    ) -> str:
+        """Signs `claims` into a token. `key` is a secret for HS256 or a PEM encoded private key for RS256."""
+
+
+class JoseBackend(JwtBackend):
+    """JWT backend using `python-jose`."""
+
+    name = "jose"
+
+    def build_key(self, key: dict, algorithm: str):
+        return jose_jwk.construct(key, algorithm)
+
+    def get_unverified_header(self, token: str) -> dict:
+        try:
+            return jose_jwt.get_unverified_header(token)
+        except jose_exceptions.JOSEError as e:
+            raise InvalidTokenException(str(e))
+
+    def get_unverified_claims(self, token: str) -> dict:
+        try:
+            return jose_jwt.get_unverified_claims(token)
+        except jose_exceptions.JOSEError as e:
+            raise InvalidTokenException(str(e))
+
+    def verify(
+        self, token: str, key: Key, algorithms: list, audience: Optional[str] = None
+    ) -> dict:
+        try:
+            return jose_jwt.decode(
+                token,
+                self.get_key(key, algorithms[0]),
+                algorithms=algorithms,
+                audience=audience,
+            )
+        except jose_exceptions.ExpiredSignatureError as e:
+            raise TokenExpiredException(str(e))
+        except jose_exceptions.JOSEError as e:
+            # jose.jwt re-raises signature errors as a generic JWTError
+            cause = e
+            while cause is not None:
+                if isinstance(cause, jose_exceptions.JWSSignatureError):
+                    raise InvalidSignatureException(str(e))
+                cause = cause.__context__
+            raise InvalidTokenException(str(e))
+
+    def encode(
+        self, claims: dict, key: Key, algorithm: str, headers: Optional[dict] = None
+    ) -> str:
+        return jose_jwt.encode(claims, key, algorithm=algorithm, headers=headers)
+
+
+class PyJWTBackend(JwtBackend):
+    """JWT backend using `PyJWT`."""
+
+    name = "pyjwt"
+
+    def build_key(self, key: dict, algorithm: str):
+        return pyjwt.PyJWK(key, algorithm).key
+
+    def get_unverified_header(self, token: str) -> dict:
+        try:
+            return pyjwt.get_unverified_header(token)
+        except pyjwt.PyJWTError as e:
+            raise InvalidTokenException(str(e))
+
+    def get_unverified_claims(self, token: str) -> dict:
+        try:
+            return pyjwt.decode(token, options={"verify_signature": False})
+        except pyjwt.PyJWTError as e:
+            raise InvalidTokenException(str(e))
+
+    def verify(
+        self, token: str, key: Key, algorithms: list, audience: Optional[str] = None
+    ) -> dict:
+        try:
+            return pyjwt.decode(
+                token,
+                self.get_key(key, algorithms[0]),
+                algorithms=algorithms,
+                audience=audience,
+            )
+        except pyjwt.ExpiredSignatureError as e:
+            raise TokenExpiredException(str(e))
+        except pyjwt.InvalidSignatureError as e:
+            raise InvalidSignatureException(str(e))
+        except (pyjwt.PyJWTError, TypeError) as e:
+            # PyJWT raises a TypeError for HS256 keys that are not secrets
+            raise InvalidTokenException(str(e))
+
+    def encode(
+        self, claims: dict, key: Key, algorithm: str, headers: Optional[dict] = None
+    ) -> str:
+        return pyjwt.encode(claims, key, algorithm=algorithm, headers=headers)
+
+
+def base64url_decode(segment: str) -> bytes:
+    return base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4))
+
+
+def base64url_encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def get_hmac_secret(key: Key) -> bytes:
+    """Returns the HS256 secret `key` as bytes.
+
+    Raises:
+    - `InvalidTokenException`: If `key` is not a `str` or `bytes` secret, e.g. a JWK of an RS256 key.
+    """
+    if isinstance(key, str):
+        return key.encode()
+    if isinstance(key, bytes):
+        return key
+    raise InvalidTokenException(f"Expected an HS256 secret, got {type(key).__name__}")
+
+
+def generate_rsa_key(kid: str) -> tuple[bytes, dict]:
+    """Generates a 2048 bit RSA key pair for signing synthetic RS256 tokens, e.g. for the warm-up, the replay tool and tests.
+
+    Returns:
+    - The PEM encoded private key, accepted by `JwtBackend.encode` of every backend.
+    - The public key as a JWK with key id `kid`, as served by a JWKS endpoint."""
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    numbers = private_key.public_key().public_numbers()
+    jwk = {
+        "kid": kid,
+        "kty": "RSA",
+        "use": "sig",
+        "n": base64url_encode(
+            numbers.n.to_bytes((numbers.n.bit_length() + 7) // 8, "big")
+        ),
+        "e": base64url_encode(
+            numbers.e.to_bytes((numbers.e.bit_length() + 7) // 8, "big")
+        ),
+    }
+    pem = private_key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    )
+    return pem, jwk
+
+
+class CryptographyBackend(JwtBackend):
+    """JWT backend using `cryptography` directly, without a JWT library. It only supports the RS256 and HS256 algorithms and the `exp`, `nbf` and `aud` claims, which is all the token service needs."""
+
+    name = "cryptography"
+    ALGORITHMS = frozenset(["RS256", "HS256"])
+
+    def build_key(self, key: dict, algorithm: str):
+        try:
+            return RSAPublicNumbers(
+                int.from_bytes(base64url_decode(key["e"]), "big"),
+                int.from_bytes(base64url_decode(key["n"]), "big"),
+            ).public_key()
+        except (KeyError, ValueError) as e:
+            raise InvalidTokenException(f"Invalid RSA key: {e}")
+
+    def split(self, token: str):
+        try:
+            header_segment, claims_segment, signature_segment = token.split(".")
+            header = json.loads(base64url_decode(header_segment))
+            claims = json.loads(base64url_decode(claims_segment))
+            signature = base64url_decode(signature_segment)
+        except (AttributeError, ValueError) as e:
+            raise InvalidTokenException(f"Malformed token: {e}")
+        if not isinstance(header, dict) or not isinstance(claims, dict):
+            raise InvalidTokenException("Malformed token")
+        return header, claims, signature, f"{header_segment}.{claims_segment}".encode()
+
+    def get_unverified_header(self, token: str) -> dict:
+        return self.split(token)[0]
+
+    def get_unverified_claims(self, token: str) -> dict:
+        return self.split(token)[1]
+
+    def verify(
+        self, token: str, key: Key, algorithms: list, audience: Optional[str] = None
+    ) -> dict:
+        header, claims, signature, signing_input = self.split(token)
+        algorithm = header.get("alg")
+        if algorithm not in algorithms or algorithm not in self.ALGORITHMS:
+            raise InvalidTokenException(f"Algorithm {algorithm} is not allowed")
+        if algorithm == "HS256":
+            secret = get_hmac_secret(key)
+            expected = hmac.new(secret, signing_input, hashlib.sha256).digest()
+            if not hmac.compare_digest(expected, signature):
+                raise InvalidSignatureException("Signature verification failed.")
+        else:
+            try:
+                self.get_key(key, algorithm).verify(
+                    signature, signing_input, padding.PKCS1v15(), hashes.SHA256()
+                )
+            except (InvalidSignature, AttributeError, TypeError):
+                raise InvalidSignatureException("Signature verification failed.")
+        now = time.time()
+        try:
+            if "exp" in claims and int(claims["exp"]) < now:
+                raise TokenExpiredException("Signature has expired.")
+            if "nbf" in claims and int(claims["nbf"]) > now:
+                raise InvalidTokenException("The token is not yet valid (nbf)")
+        except (TypeError, ValueError):
+            raise InvalidTokenException("Invalid exp or nbf claim")
+        if "aud" in claims or audience is not None:
+            audiences = claims.get("aud")
+            audiences = [audiences] if isinstance(audiences, str) else audiences or []
+            if audience not in audiences:
+                raise InvalidTokenException("Invalid audience")
+        return claims
+
+    def encode(
+        self, claims: dict, key: Key, algorithm: str, headers: Optional[dict] = None
+    ) -> str:
+        """Like `JwtBackend.encode`, but an already loaded `RSAPrivateKey` is also accepted for RS256, which saves parsing the PEM for every token."""
+        header = {"alg": algorithm, "typ": "JWT", **(headers or {})}
+        signing_input = ".".join(
+            base64url_encode(json.dumps(part, separators=(",", ":")).encode())
+            for part in (header, claims)
+        ).encode()
+        if algorithm == "HS256":
+            signature = hmac.new(
+                get_hmac_secret(key), signing_input, hashlib.sha256
+            ).digest()
+        elif algorithm == "RS256":
+            private_key = key
+            if not isinstance(key, RSAPrivateKey):
+                private_key = serialization.load_pem_private_key(
+                    key.encode() if isinstance(key, str) else key, password=None
+                )
+            signature = private_key.sign(
+                signing_input, padding.PKCS1v15(), hashes.SHA256()
+            )
+        else:
+            raise InvalidTokenException(f"Algorithm {algorithm} is not supported")
+        return f"{signing_input.decode()}.{base64url_encode(signature)}"
+
+
+JWT_BACKENDS = {
+    backend.name: backend
+    for backend in (JoseBackend, PyJWTBackend, CryptographyBackend)
+}
+jwt_backends: dict[str, JwtBackend] = {}
+
+
+def get_jwt_backend(name: Optional[str] = None) -> JwtBackend:
+    '''"""
+    This function returns the shared instance of a JWT backend.
+
+    Parameters:
+        name (str, optional): The name of the backend, one of `jose`, `pyjwt` and `cryptography`. Defaults to the `JWT_BACKEND` setting.
+
+    Raises:
+        AuthInitializationException: If there is no backend with that name.
+    """'''
+    name = name or get_auth_config().jwt_backend
+    backend = jwt_backends.get(name)
+    if backend is None:
+        if name not in JWT_BACKENDS:
+            raise AuthInitializationException(
+                f"Unknown JWT backend {name}, expected one of {sorted(JWT_BACKENDS)}"
+            )
+        backend = jwt_backends.setdefault(name, JWT_BACKENDS[name]())
+    return backend
@@ -0,0 +1,68 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from auth.jwttoken.keys import SigningKeyCache
+
+
+def get_token_digest(token: str) -> bytes:
+    """Returns the SHA-256 digest of a token. Only digests are kept, never the tokens themselves."""
+    return hashlib.sha256(token.encode()).digest()
+
+
+class FailedTokenCache:
+    """The `FailedTokenCache` class remembers the digests of tokens that failed signature or claim validation, so that clients retrying a broken or tampered token are rejected without verifying it again.
+
+    An entry is only valid for the signing keys it failed against: it records the `SigningKeyCache` of the tenant and its `generation` read before the verification, and is ignored once the keys have changed. A token that failed because its key had not been fetched yet is therefore verified again after the refresh, and a refresh racing with a failing verification can only make the entry stale, never pin a valid token as bad.
+
+    At most `maxsize` entries are kept, forgetting the least recently failed one, and entries expire after `ttl` seconds. An entry holds a 32 byte digest and a small tuple, so the cache needs roughly 200 bytes per entry.
+
+    Attributes:
+    - `hits` (int): The number of tokens rejected because they failed before.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.__entries: OrderedDict[bytes, tuple] = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __bool__(self):
+        return bool(self.__entries)
+
+    def has_failed(self, digest: bytes) -> bool:
+        """Returns `True` if the token with `digest` failed validation against the current signing keys of its tenant within the last `ttl` seconds."""
+        entry = self.__entries.get(digest)
+        if entry is None:
+            return False
+        expires_at, key_cache, generation = entry
+        if expires_at <= time.monotonic() or key_cache.generation != generation:
+            with self.__lock:
+                self.__entries.pop(digest, None)
+            return False
+        with self.__lock:
+            self.hits += 1
+        return True
+
+    def add(self, digest: bytes, key_cache: SigningKeyCache, generation: int):
+        """Remembers that the token with `digest` failed validation against the keys of `key_cache` at `generation`."""
+        if self.maxsize <= 0:
+            return
+        with self.__lock:
+            self.__entries[digest] = (
+                time.monotonic() + self.ttl,
+                key_cache,
+                generation,
+            )
+            self.__entries.move_to_end(digest)
+            while len(self.__entries) > self.maxsize:
+                self.__entries.popitem(last=False)
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
@@ -0,0 +1,136 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from requests import RequestException
+
+from auth import guarded_request
+from auth.exception import CircuitOpenException
+from config import get_settings
+
+settings = get_settings()
+log = logging.getLogger(__name__)
+
+
+def get_jwks_uri(tenant_id: str) -> str:
+    """Returns the JSON Web Key Set (JWKS) URI of an Entra ID tenant."""
+    return f"{settings.AZURE_AUTHORITY_HOST}/{tenant_id}/discovery/v2.0/keys"
+
+
+class SigningKeyCache:
+    """The `SigningKeyCache` class holds the signing keys of a JWKS endpoint by key id (`kid`).
+
+    Keys are fetched through the `jwks` circuit breaker. If a refresh fails, either because the endpoint errors or because its circuit is open, the previously fetched keys are kept and served (stale-while-error) so that tokens signed with known keys keep validating during an outage. Only when there are no keys at all is the error raised.
+
+    Attributes:
+    - `jwks_uri` (str): The JWKS endpoint.
+    - `keys` (dict): The RSA signing keys by key id.
+    - `fetched_at` (float): The `time.monotonic()` of the last successful fetch, or `None`.
+    - `stale` (bool): `True` if the last refresh failed and older keys are being served.
+    - `refreshes` (int): The number of completed refresh attempts, successful or not.
+    - `attempted_at` (float): The `time.monotonic()` of the last refresh attempt, or `None`.
+    - `generation` (int): Incremented each time a refresh changes the keys, so that anything derived from them can be invalidated.
+
+    Key ids that were still unknown after a refresh are remembered for `UNKNOWN_KID_CACHE_SECONDS` (negative caching), so that tokens with made-up key ids are rejected without fetching the keys again. At most `UNKNOWN_KID_CACHE_SIZE` are remembered, and they are forgotten whenever a refresh changes the keys. Refreshes caused by unknown key ids are at least `KEY_REFRESH_MIN_INTERVAL_SECONDS` apart, see `refresh_for_kid`, so a stream of distinct made-up key ids causes at most one fetch per interval.
+    """
+
+    def __init__(self, jwks_uri: str):
+        self.jwks_uri = jwks_uri
+        self.keys: dict[str, dict] = {}
+        self.fetched_at: Optional[float] = None
+        self.stale = False
+        self.refreshes = 0
+        self.attempted_at: Optional[float] = None
+        self.generation = 0
+        self.unknown_kids: OrderedDict[str, float] = OrderedDict()
+        self.__lock = threading.Lock()
+        self.__unknown_kids_lock = threading.Lock()
+
+    def get(self, kid: str) -> Optional[dict]:
+        """Returns the key with the given key id, or `None` if it is unknown."""
+        return self.keys.get(kid)
+
+    def is_unknown(self, kid: str) -> bool:
+        """Returns `True` if `kid` was still unknown after a recent refresh, see `add_unknown`."""
+        expires_at = self.unknown_kids.get(kid)
+        return expires_at is not None and expires_at > time.monotonic()
+
+    def add_unknown(self, kid: str, ttl: Optional[float] = None):
+        """Remembers that `kid` is unknown for `ttl` seconds, by default `UNKNOWN_KID_CACHE_SECONDS`."""
+        ttl = settings.UNKNOWN_KID_CACHE_SECONDS if ttl is None else ttl
+        with self.__unknown_kids_lock:
+            self.unknown_kids[kid] = time.monotonic() + ttl
+            self.unknown_kids.move_to_end(kid)
+            while len(self.unknown_kids) > settings.UNKNOWN_KID_CACHE_SIZE:
+                self.unknown_kids.popitem(last=False)
+
+    def get_age(self) -> Optional[float]:
+        """Returns the number of seconds since the keys were last fetched, or `None` if they never were."""
+        if self.fetched_at is None:
+            return None
+        return time.monotonic() - self.fetched_at
+
+    def fetch(self) -> dict[str, dict]:
+        """Fetches the keys from the JWKS endpoint without updating the cache. The keys are filtered on the 'kty' (key type) being 'RSA' and the 'alg' (algorithm) being 'RS256' or absent."""
+        response = guarded_request("jwks", "GET", self.jwks_uri, timeout=5)
+        response.raise_for_status()
+        return {
+            key["kid"]: key
+            for key in response.json()["keys"]
+            if key["kty"] == "RSA" and key.get("alg", "RS256") == "RS256"
+        }
+
+    def refresh(self, after: Optional[int] = None) -> dict[str, dict]:
+        """Re-fetches the keys and returns them, or returns the cached keys if the fetch fails and keys are cached.
+
+        Refreshes are serialized. A caller that read `refreshes` before finding a key unknown passes it as `after`: if another refresh completed in the meantime, its keys are returned without fetching again. This way all requests that see a rotated key at once cause a single JWKS fetch.
+
+        Raises:
+        - `CircuitOpenException` or `requests.RequestException`: If the fetch fails and no keys are cached.
+        """
+        with self.__lock:
+            if after is not None and self.refreshes != after:
+                return self.keys
+            try:
+                keys = self.fetch()
+            except (CircuitOpenException, RequestException, ValueError) as e:
+                if not self.keys:
+                    raise
+                log.warning("Failed to refresh signing keys, serving stale keys: %s", e)
+                self.stale = True
+                return self.keys
+            finally:
+                self.refreshes += 1
+                self.attempted_at = time.monotonic()
+            if keys != self.keys:
+                self.generation += 1
+                self.unknown_kids = OrderedDict()
+            self.keys = keys
+            self.fetched_at = time.monotonic()
+            self.stale = False
+            return keys
+
+    def refresh_for_kid(self, kid: str, after: Optional[int] = None) -> dict[str, dict]:
+        """Refreshes the keys because a token has the key id `kid`, which is not among them, and returns them. `after` is passed to `refresh`.
+
+        If the keys were refreshed less than `KEY_REFRESH_MIN_INTERVAL_SECONDS` ago, they are not fetched again and `kid` is remembered as unknown until the next refresh is allowed. Otherwise `kid` is remembered as unknown if the refreshed keys do not have it either.
+
+        Raises:
+        - `CircuitOpenException` or `requests.RequestException`: If the fetch fails and no keys are cached.
+        """
+        attempted_at = self.attempted_at
+        if attempted_at is not None:
+            wait = (
+                attempted_at
+                + settings.KEY_REFRESH_MIN_INTERVAL_SECONDS
+                - time.monotonic()
+            )
+            if wait > 0:
+                self.add_unknown(kid, ttl=wait)
+                return self.keys
+        keys = self.refresh(after)
+        if kid not in keys:
+            self.add_unknown(kid)
+        return keys
@@ -0,0 +1,196 @@
+import threading
+import time
+from typing import Callable, Optional
+
+from auth.auth_config import get_auth_config
+from auth.exception import InvalidTokenException
+from auth.jwttoken.backends import get_jwt_backend
+from auth.jwttoken.failed_tokens import FailedTokenCache, get_token_digest
+from auth.jwttoken.keys import SigningKeyCache
+from config import get_settings
+
+settings = get_settings()
+
+
+class TokenCandidate:
+    """What the pre-verification checks learned about a token, so that verification does not parse it again.
+
+    Attributes:
+    - `token` (str): The token.
+    - `header` (dict): Its unverified header.
+    - `claims` (dict): Its unverified claims.
+    - `key_cache` (SigningKeyCache): The signing keys of the tenant that issued it.
+    - `audience` (str): The audience to verify it with.
+    - `key` (dict): Its signing key, or `None` if the key id is not known yet and the keys need a refresh.
+    - `digest` (bytes): Its SHA-256 digest, computed on first access, see `auth.jwttoken.failed_tokens`.
+    """
+
+    __slots__ = ("token", "header", "claims", "key_cache", "audience", "key", "_digest")
+
+    def __init__(self, token: str):
+        self.token = token
+        self.header: Optional[dict] = None
+        self.claims: Optional[dict] = None
+        self.key_cache: Optional[SigningKeyCache] = None
+        self.audience: Optional[str] = None
+        self.key: Optional[dict] = None
+        self._digest: Optional[bytes] = None
+
+    @property
+    def digest(self) -> bytes:
+        if self._digest is None:
+            self._digest = get_token_digest(self.token)
+        return self._digest
+
+
+def check_size(candidate: TokenCandidate, pipeline: "PreVerificationPipeline"):
+    """Rejects tokens longer than `MAX_TOKEN_SIZE`, before anything is parsed."""
+    if len(candidate.token) > get_auth_config().max_token_size:
+        raise InvalidTokenException(
+            f"Token of {len(candidate.token)} characters is too large"
+        )
+
+
+def check_failed_before(candidate: TokenCandidate, pipeline: "PreVerificationPipeline"):
+    """Rejects tokens that already failed validation against the current signing keys, see `FailedTokenCache`. The token is only hashed if some token failed recently."""
+    if pipeline.failed_tokens and pipeline.failed_tokens.has_failed(candidate.digest):
+        raise InvalidTokenException("Token failed validation before")
+
+
+def check_segments(candidate: TokenCandidate, pipeline: "PreVerificationPipeline"):
+    """Rejects tokens that are not made of three non-empty segments (header, claims and signature)."""
+    token = candidate.token
+    if (
+        token.count(".") != 2
+        or ".." in token
+        or token.startswith(".")
+        or token.endswith(".")
+    ):
+        raise InvalidTokenException("Token is not a signed JWT")
+
+
+def check_algorithm(candidate: TokenCandidate, pipeline: "PreVerificationPipeline"):
+    """Parses the header and rejects algorithms outside of `JWT_ALLOWED_ALGORITHMS`, e.g. `none` or HS256 signed with a public key."""
+    candidate.header = get_jwt_backend().get_unverified_header(candidate.token) or {}
+    if candidate.header.get("alg") not in get_auth_config().allowed_algorithms:
+        raise InvalidTokenException(
+            f"Algorithm {candidate.header.get('alg')} is not allowed"
+        )
+
+
+def check_key_id(candidate: TokenCandidate, pipeline: "PreVerificationPipeline"):
+    """Parses the claims, finds the tenant of the token and rejects key ids that are missing or were still unknown after a recent refresh of the keys of the tenant. Key ids that are simply not cached yet pass, and the keys are refreshed after the other checks."""
+    candidate.claims = get_jwt_backend().get_unverified_claims(candidate.token)
+    candidate.key_cache, candidate.audience = pipeline.resolve_tenant(candidate.claims)
+    kid = candidate.header.get("kid")
+    if kid is None:
+        raise InvalidTokenException("Token has no key id")
+    candidate.key = candidate.key_cache.get(kid)
+    if candidate.key is None and candidate.key_cache.is_unknown(kid):
+        raise InvalidTokenException(f"Unknown signing key {kid}")
+
+
+def check_lifetime(candidate: TokenCandidate, pipeline: "PreVerificationPipeline"):
+    """Rejects tokens with a malformed `exp` or `nbf`, or whose `nbf` has not been reached yet.
+
+    Expired tokens are not rejected here: an expired token is renewed through the token provider, which costs a call to App Service, so expiry is only reported once the signature has been verified. A forged expired token fails verification instead and is remembered as failed.
+    """
+    try:
+        if "exp" in candidate.claims:
+            int(candidate.claims["exp"])
+        if "nbf" in candidate.claims and int(candidate.claims["nbf"]) > time.time():
+            raise InvalidTokenException("The token is not yet valid (nbf)")
+    except (TypeError, ValueError):
+        raise InvalidTokenException("Invalid exp or nbf claim")
+
+
+def check_audience(candidate: TokenCandidate, pipeline: "PreVerificationPipeline"):
+    """Rejects tokens that were not issued for the audience of their tenant."""
+    if candidate.audience is None:
+        return
+    aud = candidate.claims.get("aud")
+    audiences = [aud] if isinstance(aud, str) else aud or []
+    if candidate.audience not in audiences:
+        raise InvalidTokenException("Invalid audience")
+
+
+PRE_VERIFICATION_CHECKS = {
+    "size": check_size,
+    "failed_before": check_failed_before,
+    "segments": check_segments,
+    "algorithm": check_algorithm,
+    "key_id": check_key_id,
+    "lifetime": check_lifetime,
+    "audience": check_audience,
+}
+
+
+class PreVerificationPipeline:
+    """The `PreVerificationPipeline` class rejects tokens that cannot be valid before any signature is checked or any signing key is fetched.
+
+    The checks of `PRE_VERIFICATION_CHECKS` run in order, cheapest first: size, tokens that failed validation before (see `record_failure`), segment count, algorithm allow-list, key id, `exp`/`nbf` and audience of the unverified claims. A check raises `InvalidTokenException` to reject the token, which is counted per check. Expiry is left to verification, since only a verified expired token may trigger a renewal, see `check_lifetime`. Tokens that pass all checks may still have an invalid signature; the pipeline only makes junk traffic cheaper than real traffic.
+
+    Example usage:
+    ```python
+    pipeline = PreVerificationPipeline(resolve_tenant)
+    candidate = pipeline.run(id_token)
+    ```
+    """
+
+    def __init__(
+        self,
+        resolve_tenant: Callable,
+        checks: Optional[dict] = None,
+        failed_tokens: Optional[FailedTokenCache] = None,
+    ):
+        """Parameters:
+        - `resolve_tenant` (Callable): Returns the signing key cache and audience of a token given its unverified claims, see `auth.jwttoken.token_service.resolve_tenant`.
+        - `checks` (dict, optional): The checks by name, in order. Defaults to `PRE_VERIFICATION_CHECKS`.
+        - `failed_tokens` (FailedTokenCache, optional): The tokens that failed validation. Defaults to a cache sized by `FAILED_TOKEN_CACHE_SIZE` and `FAILED_TOKEN_CACHE_SECONDS`.
+        """
+        self.resolve_tenant = resolve_tenant
+        self.checks = PRE_VERIFICATION_CHECKS if checks is None else checks
+        self.failed_tokens = (
+            FailedTokenCache(
+                settings.FAILED_TOKEN_CACHE_SIZE, settings.FAILED_TOKEN_CACHE_SECONDS
+            )
+            if failed_tokens is None
+            else failed_tokens
+        )
+        self.passed = 0
+        self.rejected = {name: 0 for name in self.checks}
+        self.__lock = threading.Lock()
+
+    def run(self, token: str) -> TokenCandidate:
+        """Runs the checks on `token` and returns what they learned about it.
+
+        Raises:
+        - `InvalidTokenException`: Raised by the first check rejecting the token."""
+        candidate = TokenCandidate(token)
+        for name, check in self.checks.items():
+            try:
+                check(candidate, self)
+            except InvalidTokenException:
+                with self.__lock:
+                    self.rejected[name] += 1
+                raise
+        with self.__lock:
+            self.passed += 1
+        return candidate
+
+    def record_failure(self, candidate: TokenCandidate, generation: int):
+        """Remembers that `candidate` failed signature or claim validation against the keys of its tenant at `generation`, so that it is rejected by the `failed_before` check until the keys change."""
+        self.failed_tokens.add(candidate.digest, candidate.key_cache, generation)
+
+    def get_stats(self) -> dict:
+        """Returns the number of tokens that passed, the number rejected by each check and the size and hits of the failed token cache."""
+        with self.__lock:
+            passed, rejected = self.passed, dict(self.rejected)
+        return {
+            "passed": passed,
+            "rejected": rejected,
+            "failed_tokens": {
+                "size": len(self.failed_tokens),
+                "hits": self.failed_tokens.hits,
+            },
+        }
@@ -0,0 +1,145 @@
+import threading
+from typing import Iterable, Optional
+
+from auth.exception import InvalidTokenException
+from auth.jwttoken.keys import SigningKeyCache, get_jwks_uri
+from config import get_settings
+
+settings = get_settings()
+
+
+def get_issuers(tenant_id: str) -> tuple[str, ...]:
+    """Returns the issuers (`iss` claim) of the v2.0 and v1.0 tokens of an Entra ID tenant."""
+    return (
+        f"{settings.AZURE_AUTHORITY_HOST}/{tenant_id}/v2.0",
+        f"https://sts.windows.net/{tenant_id}/",
+    )
+
+
+class Tenant:
+    """An Entra ID tenant whose tokens are accepted.
+
+    Attributes:
+    - `tenant_id` (str): The tenant id (`tid` claim).
+    - `audiences` (tuple): The client ids tokens of the tenant may be issued for (`aud` claim).
+    - `issuers` (tuple): The issuers of the tokens of the tenant, see `get_issuers`.
+
+    The signing keys of the tenant are held in a `SigningKeyCache` of its own, created on first use, so each tenant's keys are loaded and refreshed independently and a tenant that never sends traffic costs nothing.
+    """
+
+    def __init__(
+        self,
+        tenant_id: str,
+        audiences: Iterable[str],
+        signing_key_cache: Optional[SigningKeyCache] = None,
+    ):
+        self.tenant_id = tenant_id
+        self.audiences = tuple(dict.fromkeys(audiences))
+        self.audience_set = frozenset(self.audiences)
+        self.issuers = get_issuers(tenant_id)
+        self.__signing_key_cache = signing_key_cache
+        self.__lock = threading.Lock()
+
+    @property
+    def signing_key_cache(self) -> SigningKeyCache:
+        if self.__signing_key_cache is None:
+            with self.__lock:
+                if self.__signing_key_cache is None:
+                    self.__signing_key_cache = SigningKeyCache(
+                        get_jwks_uri(self.tenant_id)
+                    )
+        return self.__signing_key_cache
+
+    def is_loaded(self) -> bool:
+        """Returns `True` once the key cache of the tenant has been created."""
+        return self.__signing_key_cache is not None
+
+    def get_audience(self, claims: dict) -> Optional[str]:
+        """Returns the audience to verify the token with: its `aud` claim if it is one of the audiences of the tenant, otherwise the first audience of the tenant, which will fail verification."""
+        aud = claims.get("aud")
+        if isinstance(aud, str):
+            if aud in self.audience_set:
+                return aud
+        elif isinstance(aud, list):
+            for audience in aud:
+                if audience in self.audience_set:
+                    return audience
+        return self.audiences[0] if self.audiences else None
+
+
+class TenantRegistry:
+    """The `TenantRegistry` class routes tokens to the tenant that issued them.
+
+    The issuers of all tenants are precomputed into a dictionary, so a token is routed by its `iss` claim with a single lookup. Tokens without an `iss` claim are routed by their `tid` claim. Routing uses the unverified claims; since the token is then verified with the keys and audiences of that tenant only, a token cannot be routed to a tenant that did not issue it.
+
+    Example usage:
+    ```python
+    registry = TenantRegistry([Tenant("contoso-tenant-id", ["client-id"]), Tenant("fabrikam-tenant-id", ["client-id"])])
+    tenant = registry.resolve(unverified_claims)
+    ```
+    """
+
+    def __init__(self, tenants: Iterable[Tenant]):
+        self.tenants: dict[str, Tenant] = {
+            tenant.tenant_id: tenant for tenant in tenants
+        }
+        self.by_issuer: dict[str, Tenant] = {
+            issuer: tenant
+            for tenant in self.tenants.values()
+            for issuer in tenant.issuers
+        }
+
+    def __len__(self):
+        return len(self.tenants)
+
+    def resolve(self, claims: dict) -> Tenant:
+        """Returns the tenant that issued a token.
+
+        Raises:
+        - `InvalidTokenException`: If the issuer or tenant of the token is not registered.
+        """
+        issuer = claims.get("iss")
+        if issuer is not None:
+            tenant = self.by_issuer.get(issuer)
+        else:
+            tenant = self.tenants.get(claims.get("tid"))
+        if tenant is None:
+            raise InvalidTokenException(
+                f"Unknown token issuer {issuer or claims.get('tid')}"
+            )
+        return tenant
+
+    @classmethod
+    def from_settings(
+        cls, settings, home_signing_key_cache: Optional[SigningKeyCache] = None
+    ) -> Optional["TenantRegistry"]:
+        '''"""
+        This function builds the registry from the `AZURE_TENANTS` setting, which maps tenant ids to their client ids, e.g. `{"<tenant id>": ["<client id>"]}`. The tenant of `AZURE_TENANT_ID` and `AZURE_CLIENT_ID`, if set, is included and keeps using `home_signing_key_cache`.
+
+        Returns:
+            TenantRegistry: The registry, or `None` if `AZURE_TENANTS` is empty, i.e. for single-tenant deployments.
+        """'''
+        if not settings.AZURE_TENANTS:
+            return None
+        audiences: dict[str, list] = {}
+        if settings.AZURE_TENANT_ID is not None:
+            audiences[settings.AZURE_TENANT_ID] = (
+                [settings.AZURE_CLIENT_ID] if settings.AZURE_CLIENT_ID else []
+            )
+        for tenant_id, client_ids in settings.AZURE_TENANTS.items():
+            client_ids = (
+                [client_ids] if isinstance(client_ids, str) else list(client_ids)
+            )
+            audiences.setdefault(tenant_id, []).extend(client_ids)
+        return cls(
+            Tenant(
+                tenant_id,
+                client_ids,
+                (
+                    home_signing_key_cache
+                    if tenant_id == settings.AZURE_TENANT_ID
+                    else None
+                ),
+            )
+            for tenant_id, client_ids in audiences.items()
+        )
@@ -22,11 +22,15 @@ class IdAndAccessToken:
     print(token.id_token)  # Output: "id_token_value"
     ```
 
+    Tokens obtained from the App Service `.auth/me` endpoint also carry the `claims` App Service already validated and the time they expire at (`expires_at`, seconds since the epoch), so they do not need to be decoded again.
+
     Note: This class does not have any additional methods or functionality."""
 
-    def __init__(self, access_token, id_token):
+    def __init__(self, access_token, id_token, claims=None, expires_at=None):
         self.access_token = access_token
         self.id_token = id_token
+        self.claims = claims
+        self.expires_at = expires_at
 
 
 class TokenProvider(ABC):
@@ -61,7 +65,7 @@ class TokenService(ABC):
     Methods:
     - `get_token_provider(self) -> TokenProvider`: This method is abstract and must be implemented by subclasses. It returns an instance of the `TokenProvider` class, which is responsible for generating and managing tokens.
 
-    - `decode_and_check_authorization(self, expected_roles, **kwargs) -> User`: This method is abstract and must be implemented by subclasses. It takes in a list of expected roles and additional keyword arguments, and returns a `User` object if the token is valid and the user has the required roles. It decodes the token and checks the authorization based on the expected roles.
+    - `decode_and_check_authorization(self, expected_roles, **kwargs) -> User`: This method is abstract and must be implemented by subclasses. It takes in a list of expected roles and additional keyword arguments, and returns a `User` object if the token is valid and the user has the required roles. It decodes the token and checks the authorization based on the expected roles. An `env` keyword argument is passed only when the check is scoped to an environment.
 
     Note: Subclasses of `TokenService` should implement these abstract methods to provide the necessary functionality for working with tokens and authorization.
     """
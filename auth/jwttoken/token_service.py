@@ -1,57 +1,102 @@
+import hashlib
 import logging
-import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 
-from jose import ExpiredSignatureError, jwt
-from jose.exceptions import JWSSignatureError
-
-from auth import retryable_requester, add_additional_permissions_based_on_hierarchy
-from auth.exception import UnAuthorizedException
+from auth.auth_config import get_auth_config
+from auth.exception import (
+    InvalidSignatureException,
+    InvalidTokenException,
+    TokenExpiredException,
+    UnAuthorizedException,
+)
 from auth.http.appservice import AppServiceBasedTokenProvider
+from auth.http.graph import (
+    CachedGroupMembershipResolver,
+    get_group_membership_resolver,
+    has_group_overage,
+)
+from auth.jwttoken.backends import get_jwt_backend
+from auth.jwttoken.keys import SigningKeyCache, get_jwks_uri
+from auth.jwttoken.precheck import PreVerificationPipeline
+from auth.jwttoken.tenants import TenantRegistry
 from auth.jwttoken.token import TokenService, TokenProvider, IdAndAccessToken
-from auth.jwttoken.token_stub import DummyTokenProvider
-from auth.model.roles import RoleCollection, Role, is_valid_role
+from auth.jwttoken.token_stub import DummyTokenProvider, get_bypass_token_provider
+from auth.permissions import permission_set_cache
+from auth.profiling import allocation_profiler
+from auth.model.claims import project_claims
 from auth.model.user import User
 from config import get_settings
 
 settings = get_settings()
-signing_keys = {}
 tenant_id = settings.AZURE_TENANT_ID
 client_id = settings.AZURE_CLIENT_ID
 log = logging.getLogger(__name__)
 
 
-def populate_signing_keys():
+signing_key_cache = SigningKeyCache(get_jwks_uri(tenant_id))
+
+
+def populate_signing_keys(after: Optional[int] = None, kid: Optional[str] = None):
     """The `populate_signing_keys` function is used to retrieve and populate signing keys for authentication in a service. It requires the `tenant_id` and `client_id` parameters to be provided. If either of these parameters is `None`, an exception is raised with the message "Authentication enabled service needs tenant_id and client_id".
 
-    The function then constructs the JSON Web Key Set (JWKS) URI using the `tenant_id` and sends a GET request to retrieve the JWKS response. The response is converted to JSON format.
+    The function then refreshes the shared `SigningKeyCache` from the JSON Web Key Set (JWKS) URI of the tenant. If the JWKS endpoint fails or its circuit breaker is open, the previously fetched keys are returned (stale-while-error).
+
+    If `after` is given, the keys are only fetched if no refresh completed since `signing_key_cache.refreshes` was `after`, see `SigningKeyCache.refresh`. If `kid` is given, the refresh is caused by a token with that unknown key id and is rate limited, see `SigningKeyCache.refresh_for_kid`.
 
     The function returns a dictionary of signing keys, where the key is the 'kid' (key ID) and the value is the key itself. The keys are filtered based on the 'kty' (key type) being 'RSA' and the 'alg' (algorithm) being 'RS256' or the default value 'RS256' if 'alg' is not present.
 
     """
     if tenant_id is None or client_id is None:
         raise Exception("Authentication enabled service needs tenant_id and client_id")
-    jwks_uri = f"https://login.microsoftonline.com/{tenant_id}/discovery/v2.0/keys"
-    jwks_response = retryable_requester().get(jwks_uri).json()
-    return {
-        key["kid"]: key
-        for key in jwks_response["keys"]
-        if key["kty"] == "RSA" and key.get("alg", "RS256") == "RS256"
-    }
+    if kid is not None:
+        return signing_key_cache.refresh_for_kid(kid, after)
+    return signing_key_cache.refresh(after)
+
+
+tenant_registry = TenantRegistry.from_settings(settings, signing_key_cache)
+
+
+def resolve_tenant(claims: dict) -> tuple[SigningKeyCache, Optional[str]]:
+    """Returns the signing key cache and the audience to verify a token with, given its unverified claims.
 
+    Single-tenant deployments use the shared `signing_key_cache` and `client_id` without any lookup. If `AZURE_TENANTS` is set, the token is routed to its tenant by the `TenantRegistry`.
+
+    Raises:
+    - `InvalidTokenException`: If the issuer of the token is not a registered tenant."""
+    if tenant_registry is None:
+        return signing_key_cache, client_id
+    tenant = tenant_registry.resolve(claims)
+    return tenant.signing_key_cache, tenant.get_audience(claims)
+
+
+pre_verification = PreVerificationPipeline(resolve_tenant)
 
 if settings.WEBSITE_AUTH_ENABLED:
-    signing_keys = populate_signing_keys()
+    populate_signing_keys()
+
+refresh_ahead_executor = ThreadPoolExecutor(
+    max_workers=1, thread_name_prefix="token-refresh-ahead"
+)
+pending_refreshes = set()
+pending_refreshes_lock = threading.Lock()
 
 
 class DefaultTokenService(TokenService):
     """The `DefaultTokenService` class is an implementation of the `TokenService` interface. It provides methods for decoding tokens and checking authorization."""
-    def __init__(self, token_provider: TokenProvider):
+    def __init__(
+        self,
+        token_provider: TokenProvider,
+        group_resolver: Optional[CachedGroupMembershipResolver] = None,
+    ):
         """
 
         Parameters:
         - `self`: The instance of the class itself.
         - `token_provider`: An instance of the `TokenProvider` class that provides tokens.
+        - `group_resolver`: Resolves the groups of users whose token has a group overage. If `None`, such users are treated as having no groups.
 
         Returns:
         - None
@@ -65,6 +110,7 @@ class DefaultTokenService(TokenService):
         Note: The `token_provider` parameter is required and must be an instance of the `TokenProvider` class.
         """
         self.token_provider = token_provider
+        self.group_resolver = group_resolver
 
     def get_token_provider(self) -> TokenProvider:
         '''This method returns the token provider associated with the current object.
@@ -84,20 +130,52 @@ class DefaultTokenService(TokenService):
         - An optional `User` object if the token is successfully decoded, or `None` if the token is invalid or expired.
 
         Raises:
-        - `ExpiredSignatureError`: If the access token has expired.
+        - `TokenExpiredException`: If the renewed token has expired too.
 
         Note:
         - This method internally calls the `__decode_token` method to decode the token obtained from the `TokenProvider`.
         - If the access token has expired, the method will log a warning message and attempt to renew the token using the `renew_token` method of the `TokenProvider` before decoding it again.
+        - With the `DummyTokenProvider` (auth bypass mode) the provider hands out a pre-built `User` and the tokens are only decoded when they are re-minted.
+        - If the token is valid but expires within `TOKEN_REFRESH_AHEAD_SECONDS`, a renewal is scheduled in the background and the current request proceeds with the current token.
         """
         token_provider: TokenProvider = self.get_token_provider()
+        if isinstance(token_provider, DummyTokenProvider):
+            return token_provider.get_user(self.__decode_token, **kwargs)
         try:
-            return self.__decode_token(token_provider.get_id_and_access_token(**kwargs))
-        except ExpiredSignatureError:
+            tokens = token_provider.get_id_and_access_token(**kwargs)
+            user = self.__decode_token(tokens)
+        except TokenExpiredException:
             log.warning(
                 "Access token expired, trying to get a new one using the refresh token"
             )
             return self.__decode_token(token_provider.renew_token(**kwargs))
+        self.__refresh_ahead(user, tokens, **kwargs)
+        return user
+
+    def __refresh_ahead(self, user: User, tokens: IdAndAccessToken, **kwargs):
+        """Schedules a background renewal through the token provider if the token of `user` expires within `TOKEN_REFRESH_AHEAD_SECONDS`. At most one renewal per access token is queued at a time, and renewal errors are only logged since the current token is still valid. Does nothing if the setting is `0` or the `exp` claim is not retained."""
+        refresh_ahead_seconds = get_auth_config().token_refresh_ahead_seconds
+        if refresh_ahead_seconds <= 0 or not user.claims:
+            return
+        exp = user.claims.get("exp")
+        if exp is None or exp - time.time() > refresh_ahead_seconds:
+            return
+        key = hashlib.sha256(str(tokens.access_token).encode()).digest()
+        with pending_refreshes_lock:
+            if key in pending_refreshes:
+                return
+            pending_refreshes.add(key)
+
+        def renew():
+            try:
+                self.get_token_provider().renew_token(**kwargs)
+            except Exception as e:
+                log.warning("Refresh-ahead of a soon to expire token failed: %s", e)
+            finally:
+                with pending_refreshes_lock:
+                    pending_refreshes.discard(key)
+
+        refresh_ahead_executor.submit(renew)
 
     def __decode_token(self, tokens: IdAndAccessToken) -> Optional[User]:
         """This method decodes a token using the provided `tokens` which contain an ID token and an access token. It returns an optional `User` object.
@@ -109,81 +187,111 @@ class DefaultTokenService(TokenService):
         - `Optional[User]`: An optional `User` object representing the decoded token.
 
         ### Steps:
-        1. Get the unverified header from the ID token using `jwt.get_unverified_header()`.
-        2. Get the unverified claims from the ID token using `jwt.get_unverified_claims()`.
-        3. If the app is running on an app service and website authentication is enabled, try to validate and decode the token.
-        4. If the signature verification fails, refresh the signing keys and try to validate and decode the token again.
-        5. Get the groups from the decoded token.
-        6. Create an empty `RoleCollection` object.
-        7. Iterate over each group and extract the role using a regular expression pattern.
-        8. If the role is valid, create a `Role` object and add it to the `RoleCollection`.
-        9. If the role is invalid, log a warning message.
-        10. If the RBAC feature is not enabled, add a stub admin role to the `RoleCollection`.
-        11. Create a `User` object with the decoded token, ID token, access token, role collection, and name.
-        12. Return the `User` object."""
-        header: dict[str, str] = jwt.get_unverified_header(token=tokens.id_token) or {}
-        token = jwt.get_unverified_claims(token=tokens.id_token)
-        if settings.IS_ON_APP_SERVICE and settings.WEBSITE_AUTH_ENABLED:
-            try:
-                token = self.__validate_and_decode(header, tokens.id_token)
-            except JWSSignatureError as e:
-                global signing_keys
-                signing_keys = populate_signing_keys()
-                token = self.__validate_and_decode(header, tokens.id_token)
-        groups = token.get(settings.GROUP_NODE_IN_DECODED_TOKEN, [])
-        role_collection = RoleCollection()
-        for group in groups:
-            match = re.match(settings.GROUP_PATTERN, group)
-            if match:
-                role = match.group(3)
-                if is_valid_role(role):
-                    role_obj = Role(match.group(1), match.group(2), role)
-                    role_collection.add_roles(
-                        add_additional_permissions_based_on_hierarchy(role_obj)
+        1. Use the claims carried by `tokens` if App Service already provided them (tokens renewed through `.auth/me`), otherwise get the claims of the ID token with `__get_verified_claims`.
+        2. Get the groups from the decoded token, or from the group resolver if the token has a group overage.
+        3. Get the effective `RoleCollection` of the groups from the permission set cache. It is shared by every user with the same groups and only built on a cache miss, see `auth.permissions.build_role_collection`.
+        4. Create a `User` object with the claims declared in `RETAINED_CLAIMS`, ID token, access token, role collection, and name.
+        5. Return the `User` object.
+
+        The allocations of the steps are recorded as the `claims`, `groups`, `permissions` and `user` stages when the allocation profiler is enabled, see `auth.profiling`.
+        """
+        auth_config = get_auth_config()
+        with allocation_profiler.stage("claims"):
+            token = tokens.claims
+            if token is None:
+                token = self.__get_verified_claims(tokens)
+        with allocation_profiler.stage("groups"):
+            groups = token.get(auth_config.group_claim, [])
+            if has_group_overage(token):
+                if self.group_resolver is not None:
+                    object_id = token.get("oid")
+                    if object_id is None:
+                        raise InvalidTokenException(
+                            "Token has a group overage but no oid claim"
+                        )
+                    groups = self.group_resolver.get_groups(
+                        object_id, tokens.access_token
                     )
                 else:
                     log.warning(
-                        "Invalid group %s found for user that will be ignored", group
+                        "Token has a group overage but group overage resolution is disabled, user will have no groups"
                     )
-        if not settings.FEATURE_RBAC_ENABLED:
-            admin_role = Role(
-                app_name=settings.CP_APP_NAME,
-                env=settings.CP_AUTH_BYPASS_ENV,
-                role=settings.ADMIN_ROLE_NAME,
+        with allocation_profiler.stage("permissions"):
+            role_collection = permission_set_cache.get_role_collection(groups)
+        with allocation_profiler.stage("user"):
+            user = User(
+                claims=project_claims(token, auth_config.retained_claims),
+                id_token=tokens.id_token,
+                access_token=tokens.access_token,
+                role_collection=role_collection,
+                name=token.get("name", "unknown"),
             )
-            role_collection.add_role(admin_role)
-        user = User(
-            claims=token,
-            id_token=tokens.id_token,
-            access_token=tokens.access_token,
-            role_collection=role_collection,
-            name=token.get("name", "unknown"),
-        )
         return user
 
-    def __validate_and_decode(self, header, token):
-        """This method is used to validate and decode a JWT token. It takes two parameters: `header` and `token`.
+    def __get_verified_claims(self, tokens: IdAndAccessToken) -> dict:
+        """Returns the claims of the ID token of `tokens`.
+
+        If the app is not running on an app service or website authentication is disabled, the claims are returned without verification. Otherwise:
+        1. Run the cheap pre-verification checks (size, tokens that failed before, segments, algorithm, key id, `nbf`, audience), see `auth.jwttoken.precheck`. Expired tokens pass them, so that expiry is only reported, and the token renewed, once the signature has been verified. They find the signing keys and audience of the tenant that issued the token, see `resolve_tenant`.
+        2. If the key id of the token is not among the cached signing keys of the tenant, e.g. because the keys were rotated, refresh the signing keys before validating. Concurrent requests seeing the same new key share one refresh, and refreshes are at least `KEY_REFRESH_MIN_INTERVAL_SECONDS` apart. A key id that is still unknown after the refresh, or that arrived before the next refresh was allowed, is remembered, so that further tokens with it are rejected by the checks without another refresh.
+        3. Validate the signature and claims with the JWT backend (see `auth.jwttoken.backends`). A signature that does not verify with a known key is rejected without a refresh, since refreshing cannot fix it. A token failing validation against a known key for any reason other than expiry is remembered until the keys change, so that retries of it are rejected by the checks, see `auth.jwttoken.failed_tokens`.
+
+        Raises:
+        - `InvalidTokenException`: If the token is malformed or invalid, see `JwtBackend`.
+        """
+        backend = get_jwt_backend()
+        if not (settings.IS_ON_APP_SERVICE and settings.WEBSITE_AUTH_ENABLED):
+            return backend.get_unverified_claims(tokens.id_token)
+        candidate = pre_verification.run(tokens.id_token)
+        key_cache = candidate.key_cache
+        if candidate.key is None:
+            refreshes = key_cache.refreshes
+            kid = candidate.header.get("kid")
+            if tenant_registry is None:
+                populate_signing_keys(after=refreshes, kid=kid)
+            else:
+                key_cache.refresh_for_kid(kid, after=refreshes)
+        generation = key_cache.generation
+        try:
+            return self.__validate_and_decode(
+                candidate.header, tokens.id_token, key_cache, candidate.audience
+            )
+        except TokenExpiredException:
+            raise
+        except InvalidTokenException:
+            if key_cache.get(candidate.header.get("kid")) is not None:
+                pre_verification.record_failure(candidate, generation)
+            raise
+
+    def __validate_and_decode(self, header, token, key_cache, audience):
+        """This method is used to validate and decode a JWT token. It takes four parameters: `header`, `token`, `key_cache` and `audience`.
 
         The `header` parameter is a dictionary containing the header information of the JWT token.
 
         The `token` parameter is the JWT token that needs to be validated and decoded.
 
-        The method first retrieves the signing key from a dictionary called `signing_keys` using the value of the `kid` key from the `header` dictionary.
+        The `key_cache` and `audience` parameters are the signing keys and the audience of the tenant that issued the token, see `resolve_tenant`.
+
+        The method first retrieves the signing key from the `key_cache` using the value of the `kid` key from the `header` dictionary.
 
-        Then, it uses the `jwt.decode()` function to decode the `token` using the retrieved signing key. The decoding is done using the RS256 algorithm and the `client_id` is specified as the audience.
+        Then, it uses the `verify()` method of the JWT backend to decode the `token` using the retrieved signing key. The decoding is done using the RS256 algorithm and the `audience` of the tenant. A key id that is not in the cache is reported as an `InvalidSignatureException`; it was remembered as unknown by `SigningKeyCache.refresh_for_kid`.
 
         Finally, the decoded token is returned."""
-        signing_key = signing_keys.get(header["kid"])
-        token = jwt.decode(
-            token=token, key=signing_key, algorithms=["RS256"], audience=client_id
+        signing_key = key_cache.get(header.get("kid"))
+        if signing_key is None:
+            raise InvalidSignatureException(f"Unknown signing key {header.get('kid')}")
+        return get_jwt_backend().verify(
+            token, signing_key, algorithms=["RS256"], audience=audience
         )
-        return token
 
-    def decode_and_check_authorization(self, expected_roles, **kwargs) -> User:
+    def decode_and_check_authorization(
+        self, expected_roles, env: Optional[str] = None, **kwargs
+    ) -> User:
         """This method decodes the authorization token and checks if the user is authorized based on the expected roles.
 
         Parameters:
         - expected_roles (list): A list of roles that the user is expected to have.
+        - env (str, optional): The environment the roles are needed in. If provided, the roles must be held in that environment.
 
         Returns:
         - User: The user object if the user is authorized.
@@ -192,31 +300,36 @@ class DefaultTokenService(TokenService):
         - UnAuthorizedException: If the user is not authorized. The exception message will indicate the expected roles and the user's current roles.
         """
         user = self.__decode(**kwargs)
-        if user.is_authorized(expected_roles):
+        if user.is_authorized(expected_roles, env=env):
             return user
+        scope = f" in the {env} environment" if env is not None else ""
         raise UnAuthorizedException(
-            message=f"Not authorized. You need to be a member of the {expected_roles} roles. Your current roles are {user.role_collection}.",
+            message=f"Not authorized. You need to be a member of the {expected_roles} roles{scope}. Your current roles are {user.role_collection}.",
             expected_roles=expected_roles,
             user_roles=user.role_collection.roles,
+            user_name=user.name,
+            role_collection=user.role_collection,
         )
 
 
 def get_token_service() -> TokenService:
     """
-        This function returns an instance of the TokenService class.
-        This function checks if the WEBSITE_AUTH_ENABLED setting is True. If it is True, it creates an instance of the
-        AppServiceBasedTokenProvider class and assigns it to the token_provider variable. If WEBSITE_AUTH_ENABLED is False,
-        it creates an instance of the DummyTokenProvider class and assigns it to the token_provider variable.
+    This function returns an instance of the TokenService class.
+    This function checks if the WEBSITE_AUTH_ENABLED setting is True. If it is True, it creates an instance of the
+    AppServiceBasedTokenProvider class and assigns it to the token_provider variable. If WEBSITE_AUTH_ENABLED is False,
+    it assigns the shared DummyTokenProvider instance to the token_provider variable.
 
-        It then creates an instance of the DefaultTokenService class, passing the token_provider as an argument, and assigns
-        it to the token_service variable.
+    It then creates an instance of the DefaultTokenService class, passing the token_provider and the shared group
+    membership resolver as arguments, and assigns it to the token_service variable.
 
-        Finally, it returns the token_service instance.
+    Finally, it returns the token_service instance.
     """
     token_provider = (
         AppServiceBasedTokenProvider()
         if settings.WEBSITE_AUTH_ENABLED
-        else DummyTokenProvider()
+        else get_bypass_token_provider()
+    )
+    token_service = DefaultTokenService(
+        token_provider, group_resolver=get_group_membership_resolver()
     )
-    token_service = DefaultTokenService(token_provider)
     return token_service
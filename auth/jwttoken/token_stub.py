@@ -1,50 +1,141 @@
-import datetime
 import logging
+import threading
+import time
+from functools import lru_cache
+from typing import Callable, Optional
 
-from jose import jwt
-
+from auth import get_hierarchy_version
+from auth.auth_config import get_auth_config
+from auth.exception import IdTokenMissingException
+from auth.jwttoken.backends import get_jwt_backend
 from auth.jwttoken.token import IdAndAccessToken, TokenProvider
+from auth.model.user import User
 from config import get_settings
 
 log = logging.getLogger(__name__)
 settings = get_settings()
 
+DEFAULT_IDENTITY = "default"
+
 
 class DummyTokenProvider(TokenProvider):
     """Provides token when the application is not backed by any auth. This primarily created to that rest of
     application code is abstracted out from knowing if they are behind auth or no. It will give Admin role for
     CP_AUTH_BYPASS_ENV. This should never be initialized in production as prod is expected to always have auth
+
+    Tokens are minted once per identity and reused until they get close to expiry, and `get_user` hands out the
+    `User` decoded from them, so that requests in bypass mode do not pay for JWT encoding and decoding. Besides the
+    default admin identity, synthetic identities with their own groups and claims can be configured in the
+    `BYPASS_AUTH_IDENTITIES` setting and selected per request with the `BYPASS_AUTH_IDENTITY_HEADER` header, which
+    lets load tests model realistic role sets.
     """
 
-    def get_id_and_access_token(self, **kwargs) -> IdAndAccessToken:
-        """This method generates an ID token and an access token using the provided payload and secret key. The payload includes the user ID, expiration time, Azure tenant ID,
-        Azure client ID, key ID, and user name. The access token is encoded using the JWT algorithm 'HS256' and the provided secret key. The ID token is also encoded using the
-        same algorithm and secret key. The ID token payload includes the groups and email fields. The method returns an instance of the IdAndAccessToken class,
-        which contains the generated access token and ID token."""
+    def __init__(self, identities: Optional[dict] = None):
+        """
+        Parameters:
+        - `identities` (dict, optional): Synthetic identities by name, each a dictionary with optional `groups` (list) and `claims` (dict). Defaults to the `BYPASS_AUTH_IDENTITIES` setting. A `default` identity is always available.
+        """
+        auth_config = get_auth_config()
+        self.identities = {
+            DEFAULT_IDENTITY: {
+                "groups": [
+                    f"{auth_config.app_name}-{auth_config.bypass_env}-{auth_config.admin_role_name}"
+                ],
+                "claims": {
+                    "name": "Dummy User",
+                    "email": "no-mail-id@invaliddomain.com",
+                },
+            }
+        }
+        self.identities.update(
+            settings.BYPASS_AUTH_IDENTITIES if identities is None else identities
+        )
+        self.__tokens: dict[str, tuple[IdAndAccessToken, float]] = {}
+        self.__users: dict[str, tuple[tuple, User]] = {}
+        self.__lock = threading.Lock()
+
+    def get_identity_name(self, **kwargs) -> str:
+        """Returns the name of the synthetic identity requested by the `BYPASS_AUTH_IDENTITY_HEADER` header, or `default`.
+
+        Raises:
+        - `IdTokenMissingException`: If the requested identity is not configured."""
+        request = kwargs.get("request")
+        name = DEFAULT_IDENTITY
+        if request is not None:
+            name = (
+                request.headers.get(get_auth_config().bypass_auth_identity_header)
+                or name
+            )
+        if name not in self.identities:
+            raise IdTokenMissingException(f"Unknown synthetic identity {name}")
+        return name
+
+    def mint_tokens(self, name: str) -> IdAndAccessToken:
+        """This method generates an ID token and an access token for the identity `name`. The payload includes the user ID, expiration time, Azure tenant ID,
+        Azure client ID, key ID, user name and the claims of the identity. The access token is encoded by the JWT backend using the algorithm 'HS256' and a fixed secret key. The ID token is also encoded using the
+        same algorithm and secret key. The ID token payload additionally includes the groups of the identity.
+        """
+        identity = self.identities[name]
         payload_for_access_token = {
             "user_id": "Dummy",
-            "exp": datetime.datetime.utcnow() + datetime.timedelta(days=1),
+            "exp": int(time.time()) + settings.BYPASS_AUTH_TOKEN_LIFETIME_SECONDS,
             "iss": settings.AZURE_TENANT_ID,
             "audience": settings.AZURE_CLIENT_ID,
             "kid": "my_key_id",
-            "name": "Dummy User",
         }
+        payload_for_access_token.update(identity.get("claims", {}))
         secret_key = "my_secret_key"
         headers = {"kid": secret_key}
-        access_token = jwt.encode(
+        backend = get_jwt_backend()
+        access_token = backend.encode(
             payload_for_access_token, secret_key, algorithm="HS256", headers=headers
         )
-        payload_for_id_token = payload_for_access_token
-        groups = [
-            f"{settings.CP_APP_NAME}-{settings.CP_AUTH_BYPASS_ENV}-{settings.ADMIN_ROLE_NAME}"
-        ]
-        payload_for_id_token["groups"] = groups
-        payload_for_id_token["email"] = "no-mail-id@invaliddomain.com"
-        id_token = jwt.encode(
-            payload_for_access_token, secret_key, algorithm="HS256", headers=headers
+        payload_for_id_token = dict(payload_for_access_token)
+        payload_for_id_token["groups"] = list(identity.get("groups", []))
+        id_token = backend.encode(
+            payload_for_id_token, secret_key, algorithm="HS256", headers=headers
         )
         return IdAndAccessToken(access_token=access_token, id_token=id_token)
 
+    def get_id_and_access_token(self, **kwargs) -> IdAndAccessToken:
+        """This method returns the ID token and access token of the requested identity (see `get_identity_name`). The tokens are minted once and
+        reused until less than a tenth of their lifetime is left, which avoids encoding two JWTs per request.
+        """
+        name = self.get_identity_name(**kwargs)
+        now = time.time()
+        with self.__lock:
+            minted = self.__tokens.get(name)
+            if minted is None or minted[1] <= now:
+                tokens = self.mint_tokens(name)
+                renew_at = now + settings.BYPASS_AUTH_TOKEN_LIFETIME_SECONDS * 0.9
+                minted = self.__tokens[name] = (tokens, renew_at)
+        return minted[0]
+
+    def get_user(self, decode: Callable[[IdAndAccessToken], User], **kwargs) -> User:
+        """Returns the `User` of the requested identity, calling `decode` only when the tokens were re-minted or the role hierarchy or
+        RBAC settings changed. The same `User` object is shared by all requests of the identity and must not be modified.
+        """
+        name = self.get_identity_name(**kwargs)
+        tokens = self.get_id_and_access_token(**kwargs)
+        key = (
+            tokens.id_token,
+            get_hierarchy_version(),
+            settings.FEATURE_RBAC_ENABLED,
+            get_auth_config().bypass_env,
+        )
+        cached = self.__users.get(name)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        user = decode(tokens)
+        self.__users[name] = (key, user)
+        return user
+
     def renew_token(self, **kwargs) -> IdAndAccessToken:
         """This method is supposed to renew the token, but in case of dummy token provider, it does nothing"""
         pass
+
+
+@lru_cache()
+def get_bypass_token_provider() -> DummyTokenProvider:
+    """Returns the process wide `DummyTokenProvider`, so that minted tokens and decoded users are shared across requests."""
+    return DummyTokenProvider()
@@ -0,0 +1,202 @@
+import atexit
+import json
+import logging
+import sys
+import queue
+import threading
+import time
+from collections import OrderedDict
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+from config import get_settings
+
+settings = get_settings()
+
+AUTH_LOGGER_NAME = "auth"
+
+STRUCTURED_FIELDS = ("template", "suppressed", "dedup_key")
+
+
+def get_message_key(record: logging.LogRecord):
+    """Returns the key records are rate limited by: the logger and the message template, so that `"Invalid group %s"` counts as one message whatever the group. Exceptions logged directly are keyed by their type."""
+    msg = record.msg if isinstance(record.msg, str) else type(record.msg).__name__
+    return record.name, msg
+
+
+class RateLimitFilter(logging.Filter):
+    """The `RateLimitFilter` class lets at most `rate` records of each message through per `interval` seconds and counts the others.
+
+    When a message is let through again after records were suppressed, the number of suppressed records is attached to it as the `suppressed` attribute so structured log handlers can report it.
+    """
+
+    def __init__(self, rate: int = None, interval: float = None):
+        super().__init__()
+        self.rate = settings.AUTH_LOG_RATE_LIMIT if rate is None else rate
+        self.interval = (
+            settings.AUTH_LOG_RATE_LIMIT_INTERVAL_SECONDS
+            if interval is None
+            else interval
+        )
+        self.suppressed: dict[tuple, int] = {}
+        self.__windows: dict[tuple, list] = {}
+        self.__pending: dict[tuple, int] = {}
+        self.__lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = get_message_key(record)
+        now = time.monotonic()
+        with self.__lock:
+            window = self.__windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                window = self.__windows[key] = [now, 0]
+            if window[1] >= self.rate:
+                self.suppressed[key] = self.suppressed.get(key, 0) + 1
+                self.__pending[key] = self.__pending.get(key, 0) + 1
+                return False
+            window[1] += 1
+            pending = self.__pending.pop(key, 0)
+        if pending:
+            record.suppressed = pending
+        return True
+
+
+class DeduplicateFilter(logging.Filter):
+    """The `DeduplicateFilter` class lets only the first record of each `dedup_key` through.
+
+    Records opt in by passing `extra={"dedup_key": ...}`, e.g. the group name of an invalid group warning, so each distinct group is logged once instead of on every request. Records without a `dedup_key` are not affected. At most `maxsize` keys are remembered, forgetting the least recently seen one.
+    """
+
+    def __init__(self, maxsize: int = 10000):
+        super().__init__()
+        self.maxsize = maxsize
+        self.duplicates = 0
+        self.__seen: OrderedDict = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = getattr(record, "dedup_key", None)
+        if key is None:
+            return True
+        key = (get_message_key(record), key)
+        with self.__lock:
+            if key in self.__seen:
+                self.__seen.move_to_end(key)
+                self.duplicates += 1
+                return False
+            self.__seen[key] = None
+            if len(self.__seen) > self.maxsize:
+                self.__seen.popitem(last=False)
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """A `QueueHandler` that never blocks the logging thread: when the bounded queue is full the record is dropped and counted."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Merges the arguments into the message as `QueueHandler` does, and keeps the message template as the `template` attribute so that records can still be grouped by message once formatted."""
+        template = get_message_key(record)[1]
+        record = super().prepare(record)
+        record.template = template
+        return record
+
+
+class RootForwardingHandler(logging.Handler):
+    """Hands records taken off the queue to the handlers of the root logger, so auth records end up wherever the application configured logging. If the root logger has no handlers, e.g. under the default uvicorn configuration, records go to `logging.lastResort` like records of any other logger would."""
+
+    def emit(self, record: logging.LogRecord) -> None:
+        handlers = logging.getLogger().handlers
+        if not handlers and logging.lastResort is not None:
+            handlers = [logging.lastResort]
+        for handler in handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+
+class StructuredFormatter(logging.Formatter):
+    """Formats records as one JSON object per line: time, level, logger and message, the fields of `STRUCTURED_FIELDS` that are set (the message template, the number of suppressed records and the deduplication key) and the exception, if any."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in STRUCTURED_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value if isinstance(value, (int, float)) else str(value)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry)
+
+
+def create_output_handler() -> logging.Handler:
+    """Returns the handler the background thread hands records to: a JSON lines handler on stderr if `AUTH_LOG_FORMAT` is `json`, otherwise a `RootForwardingHandler`."""
+    if settings.AUTH_LOG_FORMAT == "json":
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(StructuredFormatter())
+        return handler
+    return RootForwardingHandler()
+
+
+queue_handler: Optional[DroppingQueueHandler] = None
+queue_listener: Optional[QueueListener] = None
+rate_limit_filter: Optional[RateLimitFilter] = None
+deduplicate_filter: Optional[DeduplicateFilter] = None
+configure_lock = threading.Lock()
+
+
+def configure_auth_logging():
+    '''"""
+    This function makes logging of the auth package asynchronous and rate limited.
+
+    Records of the `auth` logger and its children are deduplicated, rate limited per message and put on a bounded queue. A background thread hands them to the handlers of the root logger (or `logging.lastResort` if it has none), or writes them as JSON lines to stderr if `AUTH_LOG_FORMAT` is `json`, so request threads never wait on log I/O. Records keep their message template, suppressed count and deduplication key as attributes for structured handlers. Calling the function again does nothing.
+    """'''
+    global queue_handler, queue_listener, rate_limit_filter, deduplicate_filter
+    with configure_lock:
+        if queue_handler is not None:
+            return
+        deduplicate_filter = DeduplicateFilter()
+        rate_limit_filter = RateLimitFilter()
+        queue_handler = DroppingQueueHandler(queue.Queue(settings.AUTH_LOG_QUEUE_SIZE))
+        queue_handler.addFilter(deduplicate_filter)
+        queue_handler.addFilter(rate_limit_filter)
+        queue_listener = QueueListener(queue_handler.queue, create_output_handler())
+        queue_listener.start()
+        atexit.register(queue_listener.stop)
+        auth_logger = logging.getLogger(AUTH_LOGGER_NAME)
+        auth_logger.addHandler(queue_handler)
+        auth_logger.propagate = False
+
+
+def get_logging_stats() -> dict:
+    '''"""
+    This function returns the counters of the auth logging pipeline.
+
+    Returns:
+        dict: The number of records suppressed by rate limiting per message, of duplicates dropped, and of records dropped because the queue was full.
+    """'''
+    if queue_handler is None:
+        return {"suppressed": {}, "duplicates": 0, "dropped": 0}
+    return {
+        "suppressed": {
+            f"{name}: {msg}": count
+            for (name, msg), count in dict(rate_limit_filter.suppressed).items()
+        },
+        "duplicates": deduplicate_filter.duplicates,
+        "dropped": queue_handler.dropped,
+    }
@@ -0,0 +1,74 @@
+from collections.abc import Mapping
+from functools import lru_cache
+from typing import Optional
+
+_MISSING = object()
+
+
+class ClaimProjection:
+    """The `ClaimProjection` class describes which claims of a decoded token are kept on the `User`.
+
+    It holds the claim names as a tuple together with a name -> position index. Both are shared by every `ProjectedClaims` created from the projection, so each user only stores a tuple of values.
+
+    Example usage:
+    ```python
+    projection = ClaimProjection(["name", "email"])
+    claims = projection.project({"name": "Jane", "email": "jane@example.com", "groups": [...]})
+    print(claims["email"])  # Output: jane@example.com
+    print("groups" in claims)  # Output: False
+    ```
+    """
+
+    def __init__(self, names):
+        self.names = tuple(dict.fromkeys(names))
+        self.index = {name: position for position, name in enumerate(self.names)}
+
+    def project(self, claims: dict) -> "ProjectedClaims":
+        """Returns the projected claims of `claims`. Claims that are not declared by the projection are dropped."""
+        return ProjectedClaims(
+            self, tuple(claims.get(name, _MISSING) for name in self.names)
+        )
+
+
+class ProjectedClaims(Mapping):
+    """A compact, read-only mapping of the claims kept by a `ClaimProjection`. It behaves like a `dict` for reading (`claims["name"]`, `claims.get("email")`, `"oid" in claims`)."""
+
+    __slots__ = ("_projection", "_values")
+
+    def __init__(self, projection: ClaimProjection, values: tuple):
+        self._projection = projection
+        self._values = values
+
+    def __getitem__(self, name):
+        position = self._projection.index.get(name)
+        if position is None or self._values[position] is _MISSING:
+            raise KeyError(name)
+        return self._values[position]
+
+    def __iter__(self):
+        return (
+            name
+            for name, value in zip(self._projection.names, self._values)
+            if value is not _MISSING
+        )
+
+    def __len__(self):
+        return sum(1 for value in self._values if value is not _MISSING)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+@lru_cache()
+def get_claim_projection(retained_claims: str) -> ClaimProjection:
+    """Returns the shared `ClaimProjection` for a comma-separated list of claim names."""
+    return ClaimProjection(
+        name.strip() for name in retained_claims.split(",") if name.strip()
+    )
+
+
+def project_claims(claims: dict, projection: Optional[ClaimProjection]):
+    """Applies `projection`, the compiled `RETAINED_CLAIMS` setting (see `auth.auth_config.AuthConfig.retained_claims`), to the claims of a decoded token. If `projection` is `None`, the claims are returned unchanged."""
+    if projection is None:
+        return claims
+    return projection.project(claims)
@@ -1,6 +1,8 @@
-from config import get_settings
+import hashlib
 
-settings = get_settings()
+from auth.auth_config import get_auth_config
+
+EMPTY_ROLES = frozenset()
 
 
 class Role:
@@ -89,6 +91,10 @@ class RoleCollection:
 
         This method does not return anything."""
         self.roles = []
+        self._effective_roles = None
+        self._fingerprint = None
+        self._permission_set_id = None
+        self._frozen = False
 
     def add_role(self, role):
         """This method adds a role to the list of roles for the object.
@@ -98,7 +104,10 @@ class RoleCollection:
 
         Returns:
         None"""
+        self.__check_not_frozen()
         self.roles.append(role)
+        self._effective_roles = None
+        self._fingerprint = None
 
     def add_roles(self, roles):
         """The `add_roles` method is used to add new roles to an existing list of roles for an object. It takes in a parameter `roles`, which is a list of roles to be added. The method extends the existing list of roles with the new roles provided.
@@ -117,7 +126,40 @@ class RoleCollection:
         obj.add_roles(new_roles)
         print(obj.roles)  # Output: ['admin', 'user', 'manager', 'guest']
         ```"""
+        self.__check_not_frozen()
         self.roles.extend(roles)
+        self._effective_roles = None
+        self._fingerprint = None
+
+    def freeze(self):
+        """Makes the collection immutable so that it can be shared between users. The roles are stored as a tuple, the permission index is built eagerly and `add_role`/`add_roles` raise a `TypeError` afterwards.
+
+        Returns:
+        - The collection itself."""
+        self.roles = tuple(self.roles)
+        self._frozen = True
+        self.__get_effective_roles()
+        return self
+
+    def fingerprint(self) -> str:
+        """Returns a stable digest of the effective permission set. Collections holding the same roles have the same fingerprint, whatever the order or duplicates of their roles, so it can key data that depends only on the permissions of a user."""
+        if self._fingerprint is None:
+            digest = hashlib.sha256()
+            for role in sorted(
+                {role.get_role_in_group_format() for role in self.roles}
+            ):
+                digest.update(role.encode())
+                digest.update(b"\0")
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
+    def is_frozen(self):
+        """Returns `True` if `freeze` has been called on the collection."""
+        return self._frozen
+
+    def __check_not_frozen(self):
+        if self._frozen:
+            raise TypeError("A frozen RoleCollection cannot be modified")
 
     def get_rbac_by_type(self, role_type):
         """This method takes in a role_type as a parameter and returns a dictionary containing all the roles of that type. The dictionary is structured such that the role_type is the key and the value is a list of roles that match the given role_type. The method iterates over the list of roles and filters out the roles that do not match the given role_type. The resulting dictionary is then returned."""
@@ -183,6 +225,105 @@ class RoleCollection:
         """'''
         return {role.env for role in self.roles}
 
+    def __get_effective_roles(self):
+        """Returns the precomputed permission index of this collection, building it on first use.
+
+        The index is a pair of dictionaries:
+        - `effective_roles` maps `(app_name, env)` to the frozenset of role types granted for that application and environment. The `(None, env)` entries hold the union over all applications.
+        - `wildcard_roles` maps `env` to the role types of platform admins, i.e. roles whose group name matches `ADMIN_GROUP_PATTERN` (for example `plat-dev-admin`). These apply to every application in that environment and are already merged into `effective_roles`.
+
+        The index is rebuilt lazily after `add_role`/`add_roles`."""
+        index = self._effective_roles
+        if index is None:
+            grouped = {}
+            for role in self.roles:
+                grouped.setdefault((role.app_name, role.env), set()).add(role.role_type)
+                grouped.setdefault((None, role.env), set()).add(role.role_type)
+            wildcard_roles = {}
+            admin_group_pattern = get_auth_config().admin_group_pattern
+            for role in self.roles:
+                if admin_group_pattern.fullmatch(role.get_role_in_group_format()):
+                    wildcard_roles[role.env] = frozenset(
+                        grouped[(role.app_name, role.env)]
+                    )
+            effective_roles = {
+                (app_name, env): frozenset(
+                    role_types | wildcard_roles.get(env, EMPTY_ROLES)
+                )
+                for (app_name, env), role_types in grouped.items()
+            }
+            index = (effective_roles, wildcard_roles)
+            self._effective_roles = index
+        return index
+
+    def __lookup(self, index, app_name, env):
+        effective_roles, wildcard_roles = index
+        return effective_roles.get((app_name, env)) or wildcard_roles.get(
+            env, EMPTY_ROLES
+        )
+
+    def get_effective_roles(self, env, app_name=None):
+        """Returns the role types granted in the given environment as a frozenset.
+
+        Parameters:
+        - `env` (str): The environment to look up.
+        - `app_name` (str, optional): Restricts the lookup to one application. If `None`, roles of every application in `env` are returned.
+
+        Returns:
+        - `frozenset`: The role types granted, including those of a platform admin of `env`, or an empty frozenset.
+        """
+        return self.__lookup(self.__get_effective_roles(), app_name, env)
+
+    def authorize_batch(self, app_names, envs, required_roles):
+        """Checks a batch of `(app_name, env, required_role)` triples against the collection in a single pass.
+
+        The three sequences are read in parallel and must have the same length. An `app_name` of `None` matches any application in the environment.
+
+        Parameters:
+        - `app_names` (list): The application of each item, or `None`.
+        - `envs` (list): The environment of each item.
+        - `required_roles` (list): The role type needed for each item.
+
+        Returns:
+        - `list[bool]`: A mask where `True` means the role is granted for that item.
+
+        Raises:
+        - `ValueError`: If the sequences have different lengths.
+
+        Example usage:
+        ```
+        rc.authorize_batch([None, "plat"], ["dev", "prod"], ["reader", "admin"])  # [True, False]
+        ```"""
+        if not len(app_names) == len(envs) == len(required_roles):
+            raise ValueError(
+                "app_names, envs and required_roles must have the same length"
+            )
+        index = self.__get_effective_roles()
+        return [
+            required_role in self.__lookup(index, app_name, env)
+            for app_name, env, required_role in zip(app_names, envs, required_roles)
+        ]
+
+    def get_allowed_environments(self, role_type, app_name=None):
+        """Returns the environments in which the collection grants `role_type`. The result can be pushed down into a database query (e.g. `WHERE env IN (...)`) instead of filtering rows one at a time.
+
+        Parameters:
+        - `role_type` (str): The role type needed.
+        - `app_name` (str, optional): Restricts the result to one application.
+
+        Returns:
+        - `set`: The environments in which `role_type` is granted."""
+        effective_roles, wildcard_roles = self.__get_effective_roles()
+        allowed_envs = {
+            env
+            for (app, env), role_types in effective_roles.items()
+            if app == app_name and role_type in role_types
+        }
+        allowed_envs.update(
+            env for env, role_types in wildcard_roles.items() if role_type in role_types
+        )
+        return allowed_envs
+
     def __repr__(self):
         """The `__repr__` method is a special method in Python that returns a string representation of an object. In this case, the `__repr__` method is defined for a class called `RoleCollection`.
 
@@ -190,7 +331,7 @@ class RoleCollection:
 
         This method is typically used for debugging and logging purposes, as it provides a concise and informative representation of the object.
         """
-        return f"RoleCollection(roles={self.roles})"
+        return f"RoleCollection(roles={list(self.roles)})"
 
 
 def is_valid_role(role: str) -> bool:
@@ -208,5 +349,4 @@ def is_valid_role(role: str) -> bool:
     is_valid_role("user")  # True
     is_valid_role("guest")  # False
     ```"""
-    acceptable_roles = settings.VALID_ROLES.split(",")
-    return role.lower() in acceptable_roles
+    return role.lower() in get_auth_config().valid_roles
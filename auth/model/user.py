@@ -1,4 +1,8 @@
+from auth.auth_config import get_auth_config
+from auth.decisions import decision_cache
+from auth.jwttoken.backends import get_jwt_backend
 from auth.model.roles import RoleCollection
+from auth.profiling import allocation_profiler
 from config import get_settings
 
 settings = get_settings()
@@ -20,7 +24,7 @@ class User:
         - `name` (str): The name of the user. Default is `None`.
         - `access_token` (str): The access token for the user. Default is `None`.
         - `role_collection` (RoleCollection): An instance of the `RoleCollection` class representing the roles assigned to the user. If not provided, a new instance of `RoleCollection` will be created.
-        - `claims` (list): A list of claims associated with the user. Default is an empty list.
+        - `claims` (Mapping): The claims associated with the user. Tokens decoded by the token service only keep the claims declared in the `RETAINED_CLAIMS` setting, see `full_claims` for the others. Default is an empty list.
 
         Returns:
         - None
@@ -38,14 +42,25 @@ class User:
         self.id_token = id_token
         self.role_collection = role_collection or RoleCollection()
 
+    @property
+    def full_claims(self) -> dict:
+        """Returns every claim of the ID token, including those dropped by the `RETAINED_CLAIMS` projection.
+
+        The payload is parsed from the ID token on each access and not kept on the user, so use it sparingly. The token has already been validated when the user was created.
+        """
+        if self.id_token is None:
+            return dict(self.claims)
+        return get_jwt_backend().get_unverified_claims(self.id_token)
+
     def get_admin_roles(self):
         """This method retrieves the admin roles from the role collection.
 
         Returns:
         - A list of admin roles if they exist in the role collection.
         - None if no admin roles are found."""
-        admin_roles = self.role_collection.get_rbac_by_type(settings.ADMIN_ROLE_NAME)
-        return admin_roles[settings.ADMIN_ROLE_NAME] if admin_roles else admin_roles
+        admin_role_name = get_auth_config().admin_role_name
+        admin_roles = self.role_collection.get_rbac_by_type(admin_role_name)
+        return admin_roles[admin_role_name] if admin_roles else admin_roles
 
     def is_plat_admin(self):
         """This method checks if the user has the platform admin role.
@@ -56,16 +71,19 @@ class User:
         Returns:
         - True if the user has the platform admin role.
         - False otherwise."""
+        admin_role_name = get_auth_config().admin_role_name
         for role in self.role_collection.roles:
-            if role.role_type.lower() == settings.ADMIN_ROLE_NAME:
+            if role.role_type.lower() == admin_role_name:
                 return True
         return False
 
-    def is_authorized(self, roles):
+    def is_authorized(self, roles, env=None, app_name=None):
         """The `is_authorized` method checks if the user is authorized based on their roles.
 
         Parameters:
         - `roles` (list): A list of roles to check for authorization.
+        - `env` (str, optional): The environment the roles are needed in. If provided, the check is scoped to that environment, see `is_authorized_in_env`.
+        - `app_name` (str, optional): The application the roles are needed for. Only used together with `env`.
 
         Returns:
         - `True` if the user is authorized.
@@ -75,12 +93,68 @@ class User:
         - This method will always return `True` if the `FEATURE_RBAC_ENABLED` setting is disabled.
         - The user is considered authorized if they are a platform admin (`is_plat_admin()` returns `True`).
         - The user is considered authorized if they have all the roles specified in the `roles` parameter.
+        - Decisions for the frozen role collections built by the token service are memoized per permission set and policy, see `auth.decisions.DecisionCache`.
         """
-        return (
-            not settings.FEATURE_RBAC_ENABLED
-            or self.is_plat_admin()
-            or all((self.role_collection.get_rbac_by_type(role) for role in roles))
+        if not settings.FEATURE_RBAC_ENABLED:
+            return True
+        with allocation_profiler.stage("authorize"):
+            return decision_cache.is_authorized(
+                self.role_collection,
+                roles,
+                env,
+                app_name,
+                lambda: self.__evaluate(roles, env, app_name),
+            )
+
+    def __evaluate(self, roles, env, app_name):
+        if env is not None:
+            return self.is_authorized_in_env(roles, env, app_name)
+        return self.is_plat_admin() or all(
+            (self.role_collection.get_rbac_by_type(role) for role in roles)
         )
 
+    def is_authorized_in_env(self, roles, env, app_name=None):
+        """Checks if the user holds all of `roles` in the environment `env`.
+
+        The lookup uses the `(app, env)` -> effective roles map that the role collection builds once, so each check is a constant-time set lookup. A platform admin of `env` (a group matching `ADMIN_GROUP_PATTERN`, e.g. `plat-dev-admin`) is granted its roles for every application in `env` but not in other environments.
+
+        Parameters:
+        - `roles` (list): The role types needed.
+        - `env` (str): The environment the roles are needed in.
+        - `app_name` (str, optional): The application the roles are needed for. If `None`, a role held for any application in `env` counts.
+
+        Returns:
+        - `True` if the user is authorized, always `True` if the `FEATURE_RBAC_ENABLED` setting is disabled.
+        - `False` otherwise."""
+        if not settings.FEATURE_RBAC_ENABLED:
+            return True
+        effective_roles = self.role_collection.get_effective_roles(env, app_name)
+        return all(role in effective_roles for role in roles)
+
+    def authorize_batch(self, app_names, envs, required_roles):
+        """Checks a batch of `(app_name, env, required_role)` triples for the user in a single pass. See `RoleCollection.authorize_batch`.
+
+        Returns:
+        - `list[bool]`: A mask where `True` means the user may access that item, as `is_authorized` with the same `env` and `app_name` would decide. A platform admin of an environment is granted its roles for every application in that environment only. Every item is allowed if the `FEATURE_RBAC_ENABLED` setting is disabled.
+        """
+        if not settings.FEATURE_RBAC_ENABLED:
+            if not len(app_names) == len(envs) == len(required_roles):
+                raise ValueError(
+                    "app_names, envs and required_roles must have the same length"
+                )
+            return [True] * len(envs)
+        return self.role_collection.authorize_batch(app_names, envs, required_roles)
+
+    def get_allowed_environments(self, role_type, app_name=None):
+        """Returns the environments in which the user holds `role_type`, ready to be pushed down into a database query.
+
+        Returns:
+        - `set`: The allowed environments.
+        - `None` if the `FEATURE_RBAC_ENABLED` setting is disabled, meaning no environment restriction applies.
+        """
+        if not settings.FEATURE_RBAC_ENABLED:
+            return None
+        return self.role_collection.get_allowed_environments(role_type, app_name)
+
     def __repr__(self):
         return f"User(id_token='{self.id_token}', name='{self.name}', access_token='{self.access_token}', role_collection={self.role_collection}, claims={self.claims})"
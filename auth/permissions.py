@@ -0,0 +1,123 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from auth import (
+    RoleHierarchySnapshot,
+    add_additional_permissions_based_on_hierarchy,
+    get_role_hierarchy_snapshot,
+)
+from auth.auth_config import get_auth_config
+from auth.model.roles import Role, RoleCollection, is_valid_role
+from config import get_settings
+
+settings = get_settings()
+log = logging.getLogger(__name__)
+
+
+def get_group_fingerprint(groups) -> str:
+    """Returns a stable fingerprint of a set of group names. The order of the groups and duplicates do not change the fingerprint."""
+    digest = hashlib.sha256()
+    for group in sorted(set(groups)):
+        digest.update(group.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def build_role_collection(
+    groups, snapshot: RoleHierarchySnapshot = None
+) -> RoleCollection:
+    """Builds the effective `RoleCollection` of a set of groups.
+
+    Every group matching `GROUP_PATTERN` with a valid role is turned into a `Role` and expanded with the implicit permissions of the role hierarchy. Invalid groups are logged and ignored. If the `FEATURE_RBAC_ENABLED` setting is disabled, an admin role for `CP_AUTH_BYPASS_ENV` is added.
+
+    Parameters:
+    - `groups` (list): The group names of the user.
+    - `snapshot` (RoleHierarchySnapshot, optional): The role hierarchy to expand the roles with. Defaults to the current one.
+
+    Returns:
+    - `RoleCollection`: The effective roles of the groups.
+    """
+    auth_config = get_auth_config()
+    role_collection = RoleCollection()
+    for group in groups:
+        match = auth_config.group_pattern.match(group)
+        if match:
+            role = match.group(3)
+            if is_valid_role(role):
+                role_obj = Role(match.group(1), match.group(2), role)
+                role_collection.add_roles(
+                    add_additional_permissions_based_on_hierarchy(role_obj, snapshot)
+                )
+            else:
+                log.warning(
+                    "Invalid group %s found for user that will be ignored",
+                    group,
+                    extra={"dedup_key": group},
+                )
+    if not settings.FEATURE_RBAC_ENABLED:
+        admin_role = Role(
+            app_name=auth_config.app_name,
+            env=auth_config.bypass_env,
+            role=auth_config.admin_role_name,
+        )
+        role_collection.add_role(admin_role)
+    return role_collection
+
+
+class PermissionSetCache:
+    """Caches effective permission sets by the fingerprint of the groups they were built from.
+
+    Users with the same groups share one frozen `RoleCollection`, and a user keeps hitting the same entry when their token is renewed because the key does not depend on the token. Entries are keyed on the group fingerprint, the role hierarchy version and the `FEATURE_RBAC_ENABLED` setting, and the cache is cleared whenever the `AuthConfig` changes (group patterns, valid roles, bypass environment, ...), like `auth.decisions.DecisionCache`, so neither a hierarchy nor a configuration change serves a stale permission set. At most `maxsize` permission sets are kept, evicting the least recently used one.
+
+    Example usage:
+    ```python
+    cache = PermissionSetCache()
+    role_collection = cache.get_role_collection(["system-dev-reader"])
+    ```
+    """
+
+    def __init__(self, maxsize: int = None):
+        self.maxsize = maxsize or settings.PERMISSION_SET_CACHE_SIZE
+        self.__entries: OrderedDict[tuple, RoleCollection] = OrderedDict()
+        self.__auth_config = get_auth_config()
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def get_role_collection(self, groups) -> RoleCollection:
+        """Returns the frozen effective `RoleCollection` of `groups`, building it on a cache miss."""
+        snapshot = get_role_hierarchy_snapshot()
+        auth_config = get_auth_config()
+        key = (
+            get_group_fingerprint(groups),
+            snapshot.version,
+            settings.FEATURE_RBAC_ENABLED,
+        )
+        with self.__lock:
+            if self.__auth_config is not auth_config:
+                self.__entries.clear()
+                self.__auth_config = auth_config
+            role_collection = self.__entries.get(key)
+            if role_collection is not None:
+                self.__entries.move_to_end(key)
+                return role_collection
+        role_collection = build_role_collection(groups, snapshot).freeze()
+        with self.__lock:
+            if self.__auth_config is not auth_config:
+                return role_collection
+            role_collection = self.__entries.setdefault(key, role_collection)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.maxsize:
+                self.__entries.popitem(last=False)
+        return role_collection
+
+    def clear(self):
+        """Drops every cached permission set."""
+        with self.__lock:
+            self.__entries.clear()
+
+
+permission_set_cache = PermissionSetCache()
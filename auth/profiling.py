@@ -0,0 +1,178 @@
+import sys
+import threading
+import tracemalloc
+from collections import deque
+from contextlib import nullcontext
+
+from config import get_settings
+
+settings = get_settings()
+
+NO_STAGE = nullcontext()
+
+
+class Stage:
+    """Measures the memory allocated between entering and leaving a stage with `tracemalloc`.
+
+    - `bytes`: the peak of traced memory above its level at the start of the stage, i.e. what the stage needed at most, including temporary objects.
+    - `net_bytes`: the traced memory still held when the stage ends, e.g. cached or returned objects.
+    - `blocks`: the change in allocated memory blocks (`sys.getallocatedblocks`), a proxy for the number of objects kept.
+
+    Entering a stage resets the peak of `tracemalloc`, so stages cannot be nested: the peak of the outer stage would be lost.
+    """
+
+    __slots__ = ("profiler", "name", "start", "start_blocks")
+
+    def __init__(self, profiler: "AllocationProfiler", name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        outer = getattr(self.profiler.local, "stage", None)
+        assert outer is None, f"Stage {self.name} is nested in stage {outer.name}"
+        self.profiler.local.stage = self
+        self.start = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        self.start_blocks = sys.getallocatedblocks()
+        return self
+
+    def __exit__(self, *exc_info):
+        current, peak = tracemalloc.get_traced_memory()
+        self.profiler.local.stage = None
+        self.profiler.record(
+            self.name,
+            peak - self.start,
+            current - self.start,
+            sys.getallocatedblocks() - self.start_blocks,
+        )
+
+
+class RequestCollector:
+    """Adds up the stages run by the current thread while the request is handled and records the totals as the `request` stage."""
+
+    __slots__ = ("profiler", "name", "totals")
+
+    def __init__(self, profiler: "AllocationProfiler", name: str):
+        self.profiler = profiler
+        self.name = name
+        self.totals = {}
+
+    def __enter__(self):
+        self.profiler.local.collector = self
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.local.collector = None
+        self.profiler.record_request(self.name, self.totals)
+
+
+class AllocationProfiler:
+    """The `AllocationProfiler` class attributes the memory allocated by the auth pipeline to its stages.
+
+    It is disabled by default and then costs one attribute check per stage. When enabled, `tracemalloc` is started and each `stage` records the bytes and memory blocks it allocated (see `Stage`). The stages of one request are also added up per request (see `request`), and the last `history` requests are kept for allocation budgets in tests.
+
+    `tracemalloc` traces the whole process and slows it down noticeably, so this is meant for debugging and tests. Numbers are only exact when one request is handled at a time; stages of concurrent requests see each other's allocations.
+
+    Example usage:
+    ```python
+    with allocation_profiler.stage("permissions"):
+        role_collection = permission_set_cache.get_role_collection(groups)
+    ```
+    """
+
+    def __init__(self, history: int = 1000):
+        self.enabled = False
+        self.requests = deque(maxlen=history)
+        self.local = threading.local()
+        self.__stats: dict[str, list] = {}
+        self.__started_tracing = False
+        self.__lock = threading.Lock()
+
+    def enable(self):
+        """Starts `tracemalloc` if needed and starts recording."""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.__started_tracing = True
+        self.enabled = True
+
+    def disable(self):
+        """Stops recording, and stops `tracemalloc` if `enable` started it."""
+        self.enabled = False
+        if self.__started_tracing:
+            tracemalloc.stop()
+            self.__started_tracing = False
+
+    def stage(self, name: str):
+        """Returns a context manager measuring the allocations of the stage `name`, or a no-op one if the profiler is disabled."""
+        if not self.enabled:
+            return NO_STAGE
+        return Stage(self, name)
+
+    def request(self, name: str = "request"):
+        """Returns a context manager adding up the stages of one request, or a no-op one if the profiler is disabled."""
+        if not self.enabled:
+            return NO_STAGE
+        return RequestCollector(self, name)
+
+    def record(self, name: str, allocated: int, net: int, blocks: int):
+        with self.__lock:
+            stats = self.__stats.setdefault(name, [0, 0, 0, 0])
+            stats[0] += 1
+            stats[1] += allocated
+            stats[2] += net
+            stats[3] += blocks
+        collector = getattr(self.local, "collector", None)
+        if collector is not None:
+            totals = collector.totals.setdefault(name, [0, 0, 0])
+            totals[0] += allocated
+            totals[1] += net
+            totals[2] += blocks
+
+    def record_request(self, name: str, totals: dict):
+        allocated = sum(stage[0] for stage in totals.values())
+        net = sum(stage[1] for stage in totals.values())
+        blocks = sum(stage[2] for stage in totals.values())
+        self.requests.append(
+            {
+                "bytes": allocated,
+                "net_bytes": net,
+                "blocks": blocks,
+                "stages": {
+                    stage: {
+                        "bytes": values[0],
+                        "net_bytes": values[1],
+                        "blocks": values[2],
+                    }
+                    for stage, values in totals.items()
+                },
+            }
+        )
+        self.record(name, allocated, net, blocks)
+
+    def get_stats(self) -> dict:
+        '''"""
+        This function returns the allocations recorded per stage.
+
+        Returns:
+            dict: For each stage, the number of calls and the average bytes, net bytes and memory blocks per call.
+        """'''
+        with self.__lock:
+            stats = {name: list(values) for name, values in self.__stats.items()}
+        return {
+            name: {
+                "calls": calls,
+                "avg_bytes": allocated // calls,
+                "avg_net_bytes": net // calls,
+                "avg_blocks": blocks // calls,
+            }
+            for name, (calls, allocated, net, blocks) in stats.items()
+        }
+
+    def reset(self):
+        """Drops the recorded allocations."""
+        with self.__lock:
+            self.__stats.clear()
+            self.requests.clear()
+
+
+allocation_profiler = AllocationProfiler()
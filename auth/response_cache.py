@@ -0,0 +1,184 @@
+import asyncio
+import functools
+import hashlib
+import inspect
+import json
+import threading
+import time
+import typing
+from collections import OrderedDict
+from typing import Optional
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from starlette.concurrency import run_in_threadpool
+
+from auth.exception import AuthInitializationException
+from auth.model.user import User
+from config import get_settings
+
+settings = get_settings()
+
+
+class CachedResponse:
+    """A rendered JSON response body and its entity tag."""
+
+    __slots__ = ("body", "etag", "expires_at")
+
+    def __init__(self, body: bytes, expires_at: float):
+        self.body = body
+        self.etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+        self.expires_at = expires_at
+
+
+class RoleScopedResponseCache:
+    """The `RoleScopedResponseCache` class caches the responses of GET endpoints whose result depends only on the permissions of the caller, not on their identity.
+
+    Entries are keyed on the route, the endpoint parameters and the fingerprint of the effective `RoleCollection` of the user (see `RoleCollection.fingerprint`), so users with the same permissions share one cached response and a response is never served to a user with a different permission set. Entries expire after `ttl` seconds and at most `maxsize` entries are kept, evicting the least recently used one. Responses carry an `ETag` header, and a request whose `If-None-Match` header matches it gets an empty 304 response.
+
+    The decorated endpoint must have a parameter annotated as `User` (usually provided by `ValidateAndReturnUser`) and must return JSON-serializable data. It must not use the identity of the user, e.g. `user.name`, in its result.
+
+    Example usage:
+    ```python
+    response_cache = RoleScopedResponseCache(ttl=60)
+
+    @app.get("/authenticated/reports")
+    @response_cache
+    async def get_reports(user: User = Depends(ValidateAndReturnUser(expected_roles=["reader"]))):
+        return {"reports": [...]}
+    ```
+    """
+
+    def __init__(self, ttl: float = None, maxsize: int = None):
+        self.ttl = settings.RESPONSE_CACHE_TTL_SECONDS if ttl is None else ttl
+        self.maxsize = maxsize or settings.RESPONSE_CACHE_SIZE
+        self.hits = 0
+        self.misses = 0
+        self.__entries: OrderedDict[tuple, CachedResponse] = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def get(self, key: tuple) -> Optional[CachedResponse]:
+        """Returns the unexpired entry of `key`, or `None`."""
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.expires_at <= time.monotonic():
+                del self.__entries[key]
+                self.misses += 1
+                return None
+            self.__entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: tuple, body: bytes) -> CachedResponse:
+        """Stores the rendered `body` under `key` and returns the entry."""
+        entry = CachedResponse(body, time.monotonic() + self.ttl)
+        with self.__lock:
+            self.__entries[key] = entry
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.maxsize:
+                self.__entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        """Drops every cached response."""
+        with self.__lock:
+            self.__entries.clear()
+
+    def respond(self, request: Request, entry: CachedResponse) -> Response:
+        """Returns the response of `entry`, or an empty 304 response if the `If-None-Match` header of `request` matches its entity tag."""
+        headers = {
+            "ETag": entry.etag,
+            "Cache-Control": f"private, max-age={int(self.ttl)}",
+        }
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and (
+            if_none_match.strip() == "*"
+            or entry.etag in (tag.strip() for tag in if_none_match.split(","))
+        ):
+            return Response(status_code=304, headers=headers)
+        return Response(
+            content=entry.body, media_type="application/json", headers=headers
+        )
+
+    def __call__(self, endpoint):
+        # Resolve string annotations (e.g. under `from __future__ import annotations`) to find the user and request
+        hints = typing.get_type_hints(endpoint, include_extras=True)
+        signature = inspect.signature(endpoint)
+        signature = signature.replace(
+            parameters=[
+                param.replace(annotation=hints.get(name, param.annotation))
+                for name, param in signature.parameters.items()
+            ]
+        )
+        user_param = next(
+            (
+                name
+                for name, param in signature.parameters.items()
+                if param.annotation is User
+            ),
+            None,
+        )
+        if user_param is None:
+            raise AuthInitializationException(
+                f"{endpoint.__name__} needs a parameter annotated as User to be cached by role"
+            )
+        request_param = next(
+            (
+                name
+                for name, param in signature.parameters.items()
+                if param.annotation is Request
+            ),
+            None,
+        )
+        parameters = list(signature.parameters.values())
+        if request_param is None:
+            request_param = "__response_cache_request"
+            parameters.append(
+                inspect.Parameter(
+                    request_param, inspect.Parameter.KEYWORD_ONLY, annotation=Request
+                )
+            )
+        key_params = [
+            name
+            for name in signature.parameters
+            if name not in (user_param, request_param)
+        ]
+
+        @functools.wraps(endpoint)
+        async def wrapper(**kwargs):
+            request: Request = kwargs[request_param]
+            user: User = kwargs[user_param]
+            if request_param not in signature.parameters:
+                del kwargs[request_param]
+            if user.role_collection is None:
+                return await call_endpoint(kwargs)
+            route = request.scope.get("route")
+            key = (
+                route.path if route is not None else request.url.path,
+                tuple((name, repr(kwargs.get(name))) for name in key_params),
+                user.role_collection.fingerprint(),
+            )
+            entry = self.get(key)
+            if entry is None:
+                result = await call_endpoint(kwargs)
+                if isinstance(result, Response):
+                    return result
+                body = json.dumps(
+                    jsonable_encoder(result), separators=(",", ":")
+                ).encode()
+                entry = self.put(key, body)
+            return self.respond(request, entry)
+
+        async def call_endpoint(kwargs):
+            if asyncio.iscoroutinefunction(endpoint):
+                return await endpoint(**kwargs)
+            return await run_in_threadpool(endpoint, **kwargs)
+
+        wrapper.__signature__ = signature.replace(parameters=parameters)
+        return wrapper
@@ -0,0 +1,93 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional, Union
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """The `SingleFlight` class merges concurrent calls for the same key into one.
+
+    The first caller of `do` for a key runs the function while later callers for the same key wait for it and receive the same result or exception. A successful result can additionally be kept for a short time, so that callers arriving right after the call completed reuse it as well. At most `maxsize` results are kept, evicting the least recently stored one.
+
+    Example usage:
+    ```python
+    renewals = SingleFlight()
+    tokens = renewals.do(session_key, lambda: refresh(request), ttl=30)
+    ```
+    """
+
+    def __init__(self, maxsize: int = 10000):
+        self.maxsize = maxsize
+        self.__calls: dict[Hashable, _Call] = {}
+        self.__results: OrderedDict[Hashable, tuple[object, float]] = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__results)
+
+    def do(
+        self,
+        key: Hashable,
+        fn: Callable[[], object],
+        ttl: Union[float, Callable[[object], float]] = 0,
+    ):
+        """Runs `fn` unless a call for `key` is already running or a stored result is still fresh.
+
+        Parameters:
+        - `key`: Identifies the calls that are merged.
+        - `fn`: The function to run.
+        - `ttl`: How many seconds a successful result is kept, either a number or a function computing it from the result. `0` keeps nothing.
+
+        Returns:
+        - The result of `fn`, possibly from another caller.
+
+        Raises:
+        - Whatever `fn` raised, to every caller that waited for it."""
+        with self.__lock:
+            stored = self.__results.get(key)
+            if stored is not None:
+                if stored[1] > time.monotonic():
+                    return stored[0]
+                del self.__results[key]
+            call = self.__calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self.__calls[key] = call
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        else:
+            seconds = ttl(call.result) if callable(ttl) else ttl
+            if seconds > 0:
+                with self.__lock:
+                    self.__results[key] = (call.result, time.monotonic() + seconds)
+                    while len(self.__results) > self.maxsize:
+                        self.__results.popitem(last=False)
+            return call.result
+        finally:
+            with self.__lock:
+                self.__calls.pop(key, None)
+            call.done.set()
+
+    def forget(self, key: Hashable = None):
+        """Drops the stored result of `key`, or every stored result if no key is given."""
+        with self.__lock:
+            if key is None:
+                self.__results.clear()
+            else:
+                self.__results.pop(key, None)
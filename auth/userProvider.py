@@ -1,18 +1,27 @@
 import logging
+import time
 from typing import Optional
 
 from fastapi import HTTPException, Request
 from starlette import status
 
 from auth import is_initialized
+from auth.admission import verification_executor
+from auth.audit import get_audit_log
+from auth.capture import get_traffic_capture
 from auth.exception import (
     IdTokenMissingException,
     AccessTokenMissingException,
     UnAuthorizedException,
     AuthInitializationException,
+    CircuitOpenException,
+    GroupMembershipResolutionException,
+    InvalidTokenException,
+    OverloadedException,
 )
 from auth.jwttoken.token_service import get_token_service
 from auth.model.user import User
+from auth.profiling import allocation_profiler
 from config import get_settings
 
 log = logging.getLogger(__name__)
@@ -22,14 +31,23 @@ settings = get_settings()
 class ValidateAndReturnUser:
     """The `ValidateAndReturnUser` class is responsible for validating user authentication and authorization based on the expected roles provided during initialization. It is designed to be used as a callable object."""
 
-    def __init__(self, expected_roles: list[str]) -> None:
+    def __init__(
+        self,
+        expected_roles: list[str],
+        env: Optional[str] = None,
+        env_param: Optional[str] = None,
+    ) -> None:
         """The `__init__` method is the constructor for the class. It initializes an instance of the class and sets the `expected_roles` attribute.
 
         Parameters:
         - `expected_roles` (list[str]): A list of expected roles for the user. Defaults to an empty list if not provided.
+        - `env` (str, optional): A fixed environment the roles are needed in.
+        - `env_param` (str, optional): The name of the path or query parameter that holds the environment the roles are needed in. Path parameters take precedence over query parameters.
+
+        If neither `env` nor `env_param` is provided, the roles are checked regardless of environment.
 
         Raises:
-        - `AuthInitializationException`: If the framework is not initialized before using this class.
+        - `AuthInitializationException`: If the framework is not initialized before using this class, or if both `env` and `env_param` are provided.
 
         Returns:
         - None"""
@@ -37,16 +55,118 @@ class ValidateAndReturnUser:
             raise AuthInitializationException(
                 "Framework is not initialized. Please call init() before using this class"
             )
+        if env is not None and env_param is not None:
+            raise AuthInitializationException(
+                "Only one of env and env_param can be provided"
+            )
         self.expected_roles = expected_roles or []
+        self.env = env
+        self.env_param = env_param
+
+    def get_env(self, request: Request) -> Optional[str]:
+        """Returns the environment the expected roles are needed in for this request, or `None` if the check is not environment scoped.
+
+        Raises:
+        - `HTTPException`: With status code 400 if `env_param` is configured but missing from the request.
+        """
+        if self.env_param is None:
+            return self.env
+        env = request.path_params.get(self.env_param) or request.query_params.get(
+            self.env_param
+        )
+        if env is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Missing environment parameter {self.env_param}",
+            )
+        return env
+
+    def record_decision(
+        self,
+        request: Request,
+        outcome: str,
+        started: float,
+        user_name=None,
+        role_collection=None,
+        env=None,
+        block: bool = True,
+    ):
+        """Records the authorization decision in the audit log and the request in the traffic capture, if they are enabled (see `auth.audit` and `auth.capture`). Only records are enqueued; they are written by a background thread.
+
+        Parameters:
+        - `request` (Request): The request. The route is recorded by its path template, e.g. `/{env}/messages`, so records of the same route group together.
+        - `outcome` (str): `allowed`, `forbidden`, `unauthenticated` or `unavailable`.
+        - `started` (float): When the decision started, from `time.perf_counter`.
+        - `user_name` (str, optional): The name of the user, if authenticated.
+        - `role_collection` (RoleCollection, optional): The effective roles of the user, if authenticated.
+        - `env` (str, optional): The environment the roles were needed in.
+        - `block` (bool): Whether the `block` backpressure policy of the audit log may wait for room. Decisions are recorded on the verification thread, where waiting only slows verification down; requests shed before reaching a thread are recorded on the event loop with `block=False`, which must never wait.
+        """
+        audit_log = get_audit_log()
+        traffic_capture = get_traffic_capture()
+        if audit_log is None and traffic_capture is None:
+            return
+        route = request.scope.get("route")
+        path = getattr(route, "path", None) or request.scope.get("path")
+        if audit_log is not None:
+            audit_log.record(
+                user_name,
+                path,
+                self.expected_roles,
+                role_collection,
+                outcome,
+                env,
+                block,
+            )
+        if traffic_capture is not None:
+            traffic_capture.record(
+                request,
+                path,
+                outcome,
+                time.perf_counter() - started,
+                self.env_param,
+            )
 
-    def __call__(self, request: Request) -> Optional[User]:
+    def decode_and_check_authorization(
+        self, token_service, request: Request, env: Optional[str], started: float
+    ) -> User:
+        """Decodes the token of `request` and checks the expected roles with `token_service`, profiling the allocations of the request if enabled, and records the decision (see `record_decision`). Runs on a verification thread, see `__call__`, so recording may wait for room in the audit log without stalling the event loop. The exceptions of `token_service` are re-raised for `__call__` to turn into responses."""
+        scope = {} if env is None else {"env": env}
+        try:
+            with allocation_profiler.request():
+                user = token_service.decode_and_check_authorization(
+                    self.expected_roles, request=request, **scope
+                )
+        except (
+            IdTokenMissingException,
+            AccessTokenMissingException,
+            InvalidTokenException,
+        ):
+            self.record_decision(request, "unauthenticated", started, env=env)
+            raise
+        except (CircuitOpenException, GroupMembershipResolutionException):
+            self.record_decision(request, "unavailable", started, env=env)
+            raise
+        except UnAuthorizedException as exp:
+            self.record_decision(
+                request, "forbidden", started, exp.user_name, exp.role_collection, env
+            )
+            raise
+        self.record_decision(
+            request, "allowed", started, user.name, user.role_collection, env
+        )
+        return user
+
+    async def __call__(self, request: Request) -> Optional[User]:
         """The `__call__` method is a special method in Python classes that allows an instance of the class to be called as a function. In this case, the `__call__` method takes a `request` parameter of type `Request` and returns an optional `User` object.
 
         The method first creates a dummy `User` object with some default values. Then, it tries to decode and check the authorization of the user's token using the `get_token_service().decode_and_check_authorization` method. If the token is missing or invalid, it logs an error and raises an `HTTPException` with a status code of 401 (Unauthorized) and a detail message of "Not authenticated".
 
         If the user is authenticated but not authorized, it logs an error and raises an `HTTPException` with a status code of 403 (Forbidden) and a detail message indicating the expected roles and the user's current roles.
 
-        Finally, the method returns the `User` object.
+        The method is async: the token is decoded on a thread of the bounded `verification_executor` (see `auth.admission`) and awaited, so a request waiting for verification holds no thread of the FastAPI thread pool and cannot starve the other routes. If verification is saturated, the request is shed with a status code of 503 (Service Unavailable) and a `Retry-After` header instead of queueing. Outside of FastAPI, call it with `asyncio.run(validate_and_return_user(request))`.
+
+        Finally, the method returns the `User` object. Every decision, including rejected requests, is recorded in the audit log and the traffic capture if they are enabled (see `record_decision`), on the verification thread; requests shed before reaching a thread are recorded without waiting for room in the audit log.
 
         Note: The method assumes the existence of certain exception classes (`IdTokenMissingException`, `AccessTokenMissingException`, `UnAuthorizedException`) and a logger (`log`). It also references a `get_token_service()` function. These details are not provided in the code snippet and should be defined elsewhere.
         """
@@ -57,21 +177,53 @@ class ValidateAndReturnUser:
             role_collection=None,
             claims={"email": "no-mail-id@invaliddomain.com"},
         )
+        started = time.perf_counter()
+        env = self.get_env(request)
         try:
-            user = get_token_service().decode_and_check_authorization(
-                self.expected_roles, request=request
+            user = await verification_executor.run_async(
+                self.decode_and_check_authorization,
+                get_token_service(),
+                request,
+                env,
+                started,
             )
-        except (IdTokenMissingException, AccessTokenMissingException) as exp:
+        except OverloadedException as exp:
+            log.warning(exp)
+            self.record_decision(request, "unavailable", started, env=env, block=False)
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many requests are being authenticated. Please try again later.",
+                headers={"Retry-After": str(exp.retry_after)},
+            )
+        except (
+            IdTokenMissingException,
+            AccessTokenMissingException,
+            InvalidTokenException,
+        ) as exp:
             log.error(exp)
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Not authenticated",
                 headers={"WWW-Authenticate": "Bearer"},
             )
+        except CircuitOpenException as exp:
+            log.error(exp)
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Authentication service is unavailable. Please try again later.",
+                headers={"Retry-After": str(exp.retry_after)},
+            )
+        except GroupMembershipResolutionException as exp:
+            log.error(exp)
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Group membership could not be resolved. Please try again later.",
+            )
         except UnAuthorizedException as exp:
             log.error(exp)
+            in_env = "" if env is None else f" in the {env} environment"
             raise HTTPException(
                 status_code=403,
-                detail=f"Not authorized. You need to be a member of the {self.expected_roles} roles. Your current roles are {user.role_collection}",
+                detail=f"Not authorized. You need to be a member of the {self.expected_roles} roles{in_env}. Your current roles are {user.role_collection}",
             )
         return user
@@ -35,4 +35,30 @@ Feature: API Scenarios
     When I hit the /authenticated/message/hello of type post with below data
     Then The response status code should be 403
 
+  Scenario: call environment scoped api with reader role in that environment
+    Given I am part of below groups
+      | group             |
+      | system-dev-reader |
+    When I hit the /authenticated/dev/messages to get records
+    Then The response status code should be 200
+
+  Scenario: call environment scoped api with reader role in another environment
+    Given I am part of below groups
+      | group             |
+      | system-dev-reader |
+    When I hit the /authenticated/prod/messages to get records
+    Then The response status code should be 403
 
+  Scenario: call environment scoped api as platform admin of that environment
+    Given I am part of below groups
+      | group           |
+      | plat-prod-admin |
+    When I hit the /authenticated/prod/messages to get records
+    Then The response status code should be 200
+
+  Scenario: call environment scoped api as platform admin of another environment
+    Given I am part of below groups
+      | group          |
+      | plat-dev-admin |
+    When I hit the /authenticated/prod/messages to get records
+    Then The response status code should be 403
@@ -12,12 +12,16 @@ class settings(BaseSettings):
     AZURE_TENANT_ID: Optional[str] = None
     WEBSITE_AUTH_ENABLED: bool = False  # https://learn.microsoft.com/en-us/azure/app-service/reference-app-settings?tabs=kudu%2Cpython#authentication--authorization
     AZURE_CLIENT_ID: Optional[str] = None
+    AZURE_TENANTS: dict = {}
     ADMIN_ROLE_NAME: Optional[str] = "admin"
     CONTRIBUTOR_ROLE_NAME: Optional[str] = "contributor"
     READER_ROLE_NAME: Optional[str] = "reader"
     CP_APP_NAME = "plat"
     VALID_ROLES: str = f"{ADMIN_ROLE_NAME},{CONTRIBUTOR_ROLE_NAME},{READER_ROLE_NAME}"
     BYPASS_AUTH_FOR_BEHAVE_TESTING = False
+    BYPASS_AUTH_TOKEN_LIFETIME_SECONDS = 86400
+    BYPASS_AUTH_IDENTITIES: dict = {}
+    BYPASS_AUTH_IDENTITY_HEADER = "X-Bypass-Auth-Identity"
     IS_ON_APP_SERVICE = "WEBSITE_SITE_NAME" in environ
     CP_AUTH_BYPASS_ENV = "dev"
     GROUP_NAME_SEPARATOR = "-"
@@ -32,9 +36,61 @@ class settings(BaseSettings):
         r"" + CP_APP_NAME + "-[a-zA-Z]+" + GROUP_NAME_SEPARATOR + "" + ADMIN_ROLE_NAME
     )
     GROUP_NODE_IN_DECODED_TOKEN = "groups"
+    JWT_BACKEND = "jose"
+    JWT_ALLOWED_ALGORITHMS = "RS256"
+    MAX_TOKEN_SIZE = 16384
+    UNKNOWN_KID_CACHE_SECONDS = 60
+    UNKNOWN_KID_CACHE_SIZE = 1024
+    KEY_REFRESH_MIN_INTERVAL_SECONDS = 30
+    FAILED_TOKEN_CACHE_SECONDS = 300
+    FAILED_TOKEN_CACHE_SIZE = 10000
     APP_SERVICE_ID_TOKEN_HEADER = "X-MS-TOKEN-AAD-ID-TOKEN"
     APP_SERVICE_ACCESS_TOKEN_HEADER = "X-MS-TOKEN-AAD-ACCESS-TOKEN"
+    APP_SERVICE_SESSION_COOKIE = "AppServiceAuthSession"
+    TOKEN_RENEWAL_CACHE_SECONDS = 30
+    TOKEN_REFRESH_AHEAD_SECONDS = 0
     FEATURE_RBAC_ENABLED = False
+    AZURE_AUTHORITY_HOST = "https://login.microsoftonline.com"
+    CIRCUIT_BREAKER_FAILURE_THRESHOLD = 5
+    CIRCUIT_BREAKER_RESET_SECONDS = 30
+    RETRY_BUDGET_RATIO = 0.2
+    RETRY_BUDGET_MIN_PER_SECOND = 1.0
+    GROUP_OVERAGE_RESOLUTION_ENABLED = False
+    GRAPH_API_ENDPOINT = "https://graph.microsoft.com/v1.0"
+    GRAPH_BATCH_SIZE = 20
+    GROUP_MEMBERSHIP_CACHE_TTL_SECONDS = 3600
+    GROUP_MEMBERSHIP_REFRESH_AHEAD_SECONDS = 300
+    GROUP_MEMBERSHIP_CACHE_SIZE = 10000
+    PERMISSION_SET_CACHE_SIZE = 1024
+    RESPONSE_CACHE_TTL_SECONDS = 60
+    RESPONSE_CACHE_SIZE = 1024
+    DECISION_CACHE_SIZE = 4096
+    RETAINED_CLAIMS = "name,exp,oid,email"
+    ROLE_HIERARCHY_FILE: Optional[str] = None
+    ROLE_HIERARCHY_RELOAD_SECONDS = 0
+    AUTH_ASYNC_LOGGING_ENABLED = True
+    AUTH_LOG_QUEUE_SIZE = 10000
+    AUTH_LOG_FORMAT = "text"
+    AUTH_LOG_RATE_LIMIT = 10
+    AUTH_LOG_RATE_LIMIT_INTERVAL_SECONDS = 60
+    AUTH_ALLOCATION_PROFILING_ENABLED = False
+    AUTH_VERIFICATION_WORKERS = 4
+    AUTH_VERIFICATION_QUEUE_SIZE = 16
+    AUTH_VERIFICATION_QUEUE_TIMEOUT_SECONDS = 2.0
+    AUTH_VERIFICATION_RETRY_AFTER_SECONDS = 1
+    AUTH_AUDIT_LOG_ENABLED = False
+    AUTH_AUDIT_LOG_FILE = "audit/auth-decisions.jsonl"
+    AUTH_AUDIT_LOG_MAX_BYTES = 10 * 1024 * 1024
+    AUTH_AUDIT_LOG_BACKUP_COUNT = 5
+    AUTH_AUDIT_BUFFER_SIZE = 10000
+    AUTH_AUDIT_BATCH_SIZE = 500
+    AUTH_AUDIT_FLUSH_INTERVAL_SECONDS = 1.0
+    AUTH_AUDIT_BACKPRESSURE = "drop_oldest"
+    AUTH_AUDIT_BLOCK_TIMEOUT_SECONDS = 0.1
+    AUTH_CAPTURE_ENABLED = False
+    AUTH_CAPTURE_FILE = "capture/auth-traffic.jsonl"
+    AUTH_CAPTURE_MAX_BYTES = 100 * 1024 * 1024
+    AUTH_CAPTURE_BACKUP_COUNT = 5
 
     class Config:
         env_file = ".env"
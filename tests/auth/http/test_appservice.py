@@ -0,0 +1,136 @@
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from auth.exception import IdTokenMissingException
+from auth.http.appservice import (
+    AppServiceBasedTokenProvider,
+    get_renewal_ttl,
+    get_session_key,
+    parse_auth_me,
+    renewals,
+)
+from auth.jwttoken.token import IdAndAccessToken
+from config import get_settings
+
+settings = get_settings()
+
+
+def create_request(session):
+    request = MagicMock()
+    request.cookies = (
+        {} if session is None else {settings.APP_SERVICE_SESSION_COOKIE: session}
+    )
+    request.headers = {}
+    return request
+
+
+def test_session_key_does_not_expose_cookie():
+    key = get_session_key(create_request("secret-cookie"))
+    assert "secret-cookie" not in key
+    assert key == get_session_key(create_request("secret-cookie"))
+    assert key != get_session_key(create_request("other-cookie"))
+
+
+def test_renewals_are_merged_per_session():
+    renewals.forget()
+    calls = []
+
+    def get_new_token(request):
+        calls.append(request)
+        time.sleep(0.1)
+        return [{"access_token": "new"}]
+
+    provider = AppServiceBasedTokenProvider()
+    with patch.object(
+        AppServiceBasedTokenProvider,
+        "_AppServiceBasedTokenProvider__get_new_token",
+        side_effect=get_new_token,
+    ):
+        threads = [
+            threading.Thread(
+                target=provider.renew_token, kwargs={"request": create_request("a")}
+            )
+            for _ in range(20)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(calls) == 1
+        provider.renew_token(request=create_request("a"))
+        assert len(calls) == 1
+        provider.renew_token(request=create_request("b"))
+        assert len(calls) == 2
+    renewals.forget()
+
+
+def test_requests_without_session_are_renewed_on_their_own():
+    renewals.forget()
+    assert get_session_key(create_request(None)) is None
+    calls = []
+    provider = AppServiceBasedTokenProvider()
+    with patch.object(
+        AppServiceBasedTokenProvider,
+        "_AppServiceBasedTokenProvider__get_new_token",
+        side_effect=calls.append,
+    ):
+        provider.renew_token(request=create_request(None))
+        provider.renew_token(request=create_request(None))
+    assert len(calls) == 2 and not renewals
+    renewals.forget()
+
+
+AUTH_ME = [
+    {"provider_name": "github", "id_token": "other", "access_token": "other"},
+    {
+        "provider_name": "aad",
+        "access_token": "access",
+        "id_token": "id",
+        "expires_on": "2030-01-01T00:00:00.0000000Z",
+        "user_claims": [
+            {"typ": "name", "val": "Jane"},
+            {"typ": "exp", "val": "1893456000"},
+            {
+                "typ": "http://schemas.microsoft.com/identity/claims/objectidentifier",
+                "val": "oid-1",
+            },
+            {"typ": "groups", "val": "system-dev-reader"},
+            {"typ": "amr", "val": "pwd"},
+            {"typ": "amr", "val": "mfa"},
+        ],
+    },
+]
+
+
+def test_auth_me_is_parsed_into_tokens_and_claims():
+    tokens = parse_auth_me(AUTH_ME)
+    assert (tokens.access_token, tokens.id_token) == ("access", "id")
+    assert tokens.claims == {
+        "name": "Jane",
+        "exp": 1893456000,
+        "oid": "oid-1",
+        "groups": ["system-dev-reader"],
+        "amr": ["pwd", "mfa"],
+    }
+    assert tokens.expires_at == 1893456000
+
+
+def test_auth_me_without_id_token_is_rejected():
+    with pytest.raises(IdTokenMissingException):
+        parse_auth_me([{"provider_name": "aad", "access_token": "access"}])
+
+
+def test_renewed_tokens_are_kept_until_they_expire():
+    assert (
+        50
+        < get_renewal_ttl(IdAndAccessToken("a", "i", expires_at=time.time() + 60))
+        <= 60
+    )
+    assert get_renewal_ttl(IdAndAccessToken("a", "i", expires_at=time.time() - 5)) == 0
+    assert (
+        get_renewal_ttl([{"access_token": "new"}])
+        == settings.TOKEN_RENEWAL_CACHE_SECONDS
+    )
@@ -0,0 +1,143 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from auth.http.graph import (
+    CachedGroupMembershipResolver,
+    GraphGroupMembershipResolver,
+    GroupMembershipResolver,
+    has_group_overage,
+    run_sync,
+)
+
+GROUPS = {
+    "user-1": [f"team{i}-dev-reader" for i in range(5)],
+    "user-2": ["system-prod-admin"],
+}
+PAGE_SIZE = 2
+
+
+class FakeGraphHandler(BaseHTTPRequestHandler):
+    calls = []
+
+    def log_message(self, *args):
+        pass
+
+    def page(self, object_id, skip):
+        groups = GROUPS[object_id]
+        body = {"value": [{"displayName": g} for g in groups[skip : skip + PAGE_SIZE]]}
+        if skip + PAGE_SIZE < len(groups):
+            host = f"http://{self.headers['Host']}"
+            body["@odata.nextLink"] = (
+                f"{host}/users/{object_id}/page?skip={skip + PAGE_SIZE}"
+            )
+        return body
+
+    def send_json(self, body):
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        self.calls.append(("POST", self.path, self.headers["Authorization"]))
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        responses = []
+        for item in request["requests"]:
+            object_id = item["url"].split("/")[2]
+            responses.append(
+                {"id": item["id"], "status": 200, "body": self.page(object_id, 0)}
+            )
+        self.send_json({"responses": responses})
+
+    def do_GET(self):
+        self.calls.append(("GET", self.path, self.headers["Authorization"]))
+        url = urlparse(self.path)
+        object_id = url.path.split("/")[2]
+        self.send_json(self.page(object_id, int(parse_qs(url.query)["skip"][0])))
+
+
+@pytest.fixture
+def graph_endpoint():
+    FakeGraphHandler.calls = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeGraphHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+def test_has_group_overage():
+    assert has_group_overage({"_claim_names": {"groups": "src1"}, "_claim_sources": {}})
+    assert not has_group_overage({"groups": ["system-dev-reader"]})
+    assert not has_group_overage({})
+
+
+def test_graph_resolver_batches_and_paginates(graph_endpoint):
+    resolver = GraphGroupMembershipResolver(endpoint=graph_endpoint)
+    cache = CachedGroupMembershipResolver(resolver, ttl=60, refresh_ahead=0)
+    groups = run_sync(resolver.fetch_groups_batch(["user-1", "user-2"], "token"))
+    assert groups == GROUPS
+    assert [c[0] for c in FakeGraphHandler.calls] == ["POST", "GET", "GET"]
+    assert all(c[2] == "Bearer token" for c in FakeGraphHandler.calls)
+    assert cache.get_groups("user-1", "token") == GROUPS["user-1"]
+
+
+def test_cached_resolver_fetches_once_per_user(graph_endpoint):
+    cache = CachedGroupMembershipResolver(
+        GraphGroupMembershipResolver(endpoint=graph_endpoint), ttl=60, refresh_ahead=0
+    )
+    threads = [
+        threading.Thread(target=cache.get_groups, args=("user-2", "token"))
+        for _ in range(10)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert cache.get_groups("user-2", "token") == GROUPS["user-2"]
+    assert len(FakeGraphHandler.calls) == 1
+
+
+def test_cached_resolver_refreshes_ahead_in_background(graph_endpoint):
+    cache = CachedGroupMembershipResolver(
+        GraphGroupMembershipResolver(endpoint=graph_endpoint), ttl=60, refresh_ahead=60
+    )
+    assert cache.get_groups("user-2", "token") == GROUPS["user-2"]
+    assert cache.get_groups("user-2", "token") == GROUPS["user-2"]
+    deadline = time.monotonic() + 5
+    while len(FakeGraphHandler.calls) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(FakeGraphHandler.calls) == 2
+
+
+class SlowResolver(GroupMembershipResolver):
+    def __init__(self):
+        self.fetches = 0
+
+    async def fetch_groups_batch(self, object_ids, access_token):
+        self.fetches += 1
+        await asyncio.sleep(0.01)
+        return {object_id: [f"{object_id}-dev-reader"] for object_id in object_ids}
+
+
+def test_cached_resolver_queues_refreshes_on_one_thread():
+    resolver = SlowResolver()
+    cache = CachedGroupMembershipResolver(resolver, ttl=60, refresh_ahead=60)
+    users = [f"user-{i}" for i in range(20)]
+    for object_id in users:
+        cache.get_groups(object_id, "token")
+    before = threading.active_count()
+    for object_id in users:
+        assert cache.get_groups(object_id, "token") == [f"{object_id}-dev-reader"]
+    assert threading.active_count() <= before + 1
+    deadline = time.monotonic() + 5
+    while resolver.fetches < 40 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert resolver.fetches == 40
@@ -0,0 +1,125 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from auth import guarded_request
+from auth.exception import CircuitOpenException
+from auth.http import resilience
+from auth.http.resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, RetryBudget
+from auth.jwttoken.keys import SigningKeyCache
+
+JWKS = {"keys": [{"kid": "key-1", "kty": "RSA", "n": "n", "e": "AQAB"}]}
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    """Serves the JWKS document, or fails with 503 while `failing` is set."""
+
+    failing = False
+    hits = 0
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        type(self).hits += 1
+        if self.failing:
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        payload = json.dumps(JWKS).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+@pytest.fixture
+def flaky_server(monkeypatch):
+    FlakyHandler.failing = False
+    FlakyHandler.hits = 0
+    monkeypatch.setattr(resilience, "circuit_breakers", {})
+    monkeypatch.setattr(
+        resilience, "retry_budget", RetryBudget(ratio=0, min_per_second=0, max_tokens=2)
+    )
+    monkeypatch.setattr(resilience.BudgetedRetry, "get_backoff_time", lambda self: 0)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FlakyHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+def test_circuit_breaker_opens_and_probes_when_half_open():
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=0.05)
+
+    def fail():
+        raise requests.ConnectionError()
+
+    for _ in range(2):
+        with pytest.raises(requests.ConnectionError):
+            breaker.call(fail)
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenException) as exc_info:
+        breaker.call(lambda: "not called")
+    assert exc_info.value.retry_after >= 1
+    time.sleep(0.06)
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(requests.ConnectionError):
+        breaker.call(fail)
+    assert breaker.state == OPEN
+    time.sleep(0.06)
+    assert breaker.call(lambda: "probe") == "probe"
+    assert breaker.state == CLOSED
+
+
+def test_retry_budget_limits_retries(flaky_server):
+    FlakyHandler.failing = True
+    with pytest.raises(requests.exceptions.RetryError):
+        guarded_request("flaky", "GET", flaky_server)
+    with pytest.raises(requests.exceptions.RetryError):
+        guarded_request("flaky", "GET", flaky_server)
+    # 2 budgeted retries in total instead of 3 per request
+    assert FlakyHandler.hits == 4
+    assert resilience.retry_budget.exhausted == 2
+
+
+def test_requests_deposit_into_the_current_retry_budget(flaky_server, monkeypatch):
+    budget = RetryBudget(ratio=0.5, min_per_second=0, max_tokens=10)
+    budget.tokens = 0
+    monkeypatch.setattr(resilience, "retry_budget", budget)
+    guarded_request("flaky", "GET", flaky_server)
+    guarded_request("flaky", "GET", flaky_server)
+    assert budget.tokens == 1
+
+
+def test_open_circuit_fails_fast_without_calling_upstream(flaky_server):
+    FlakyHandler.failing = True
+    for _ in range(resilience.get_circuit_breaker("flaky").failure_threshold):
+        with pytest.raises(requests.exceptions.RetryError):
+            guarded_request("flaky", "GET", flaky_server)
+    hits = FlakyHandler.hits
+    with pytest.raises(CircuitOpenException):
+        guarded_request("flaky", "GET", flaky_server)
+    assert FlakyHandler.hits == hits
+    assert resilience.get_circuit_states() == {"flaky": OPEN}
+
+
+def test_signing_keys_are_served_stale_while_upstream_fails(flaky_server):
+    key_cache = SigningKeyCache(flaky_server)
+    assert key_cache.refresh().keys() == {"key-1"}
+    FlakyHandler.failing = True
+    for _ in range(10):
+        assert key_cache.refresh().keys() == {"key-1"}
+    assert key_cache.stale
+    assert key_cache.get("key-1") is not None
+
+
+def test_signing_key_refresh_raises_without_stale_keys(flaky_server):
+    FlakyHandler.failing = True
+    with pytest.raises(requests.RequestException):
+        SigningKeyCache(flaky_server).refresh()
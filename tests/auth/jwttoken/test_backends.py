@@ -0,0 +1,107 @@
+import time
+
+import pytest
+
+from auth.exception import (
+    AuthInitializationException,
+    InvalidSignatureException,
+    InvalidTokenException,
+    TokenExpiredException,
+)
+from auth.jwttoken.backends import JWT_BACKENDS, generate_rsa_key, get_jwt_backend
+
+PRIVATE_PEM, JWK = generate_rsa_key("key-1")
+_, OTHER_JWK = generate_rsa_key("key-2")
+AUDIENCE = "client-id"
+
+
+def claims(**overrides):
+    token_claims = {
+        "aud": AUDIENCE,
+        "exp": int(time.time()) + 300,
+        "name": "Jane",
+        "groups": ["system-dev-reader", "plat-dev-admin"],
+    }
+    token_claims.update(overrides)
+    return token_claims
+
+
+@pytest.fixture(params=sorted(JWT_BACKENDS))
+def backend(request):
+    return get_jwt_backend(request.param)
+
+
+@pytest.fixture(params=sorted(JWT_BACKENDS))
+def signer(request):
+    return get_jwt_backend(request.param)
+
+
+def test_rs256_tokens_of_every_backend_verify(backend, signer):
+    token = signer.encode(claims(), PRIVATE_PEM, "RS256", headers={"kid": "key-1"})
+    assert backend.get_unverified_header(token)["kid"] == "key-1"
+    assert backend.get_unverified_claims(token)["name"] == "Jane"
+    verified = backend.verify(token, JWK, ["RS256"], audience=AUDIENCE)
+    assert verified["groups"] == ["system-dev-reader", "plat-dev-admin"]
+
+
+def test_hs256_round_trip(backend, signer):
+    token = signer.encode(
+        {"name": "Dummy"}, "my_secret_key", "HS256", headers={"kid": "x"}
+    )
+    assert backend.verify(token, "my_secret_key", ["HS256"]) == {"name": "Dummy"}
+
+
+@pytest.mark.parametrize("key", [JWK, 12345, None])
+def test_hs256_with_a_key_that_is_not_a_secret_is_an_invalid_token(backend, key):
+    token = backend.encode({"name": "Dummy"}, "my_secret_key", "HS256")
+    with pytest.raises(InvalidTokenException):
+        backend.verify(token, key, ["HS256"])
+
+
+def test_wrong_key_is_an_invalid_signature(backend):
+    token = backend.encode(claims(), PRIVATE_PEM, "RS256")
+    with pytest.raises(InvalidSignatureException):
+        backend.verify(token, OTHER_JWK, ["RS256"], audience=AUDIENCE)
+
+
+def test_tampered_claims_are_an_invalid_signature(backend):
+    header, _, signature = backend.encode(claims(), PRIVATE_PEM, "RS256").split(".")
+    _, forged, _ = backend.encode(claims(name="Eve"), PRIVATE_PEM, "RS256").split(".")
+    with pytest.raises(InvalidSignatureException):
+        backend.verify(
+            f"{header}.{forged}.{signature}", JWK, ["RS256"], audience=AUDIENCE
+        )
+
+
+def test_expired_token(backend):
+    token = backend.encode(claims(exp=int(time.time()) - 60), PRIVATE_PEM, "RS256")
+    with pytest.raises(TokenExpiredException):
+        backend.verify(token, JWK, ["RS256"], audience=AUDIENCE)
+
+
+def test_wrong_audience(backend):
+    token = backend.encode(claims(aud="someone-else"), PRIVATE_PEM, "RS256")
+    with pytest.raises(InvalidTokenException) as error:
+        backend.verify(token, JWK, ["RS256"], audience=AUDIENCE)
+    assert not isinstance(
+        error.value, (TokenExpiredException, InvalidSignatureException)
+    )
+
+
+def test_disallowed_algorithm(backend):
+    token = backend.encode(claims(), "my_secret_key", "HS256")
+    with pytest.raises(InvalidTokenException):
+        backend.verify(token, JWK, ["RS256"], audience=AUDIENCE)
+
+
+@pytest.mark.parametrize("token", ["", "not-a-token", "a.b", "a.b.c.d", "!!.??.##"])
+def test_malformed_tokens(backend, token):
+    with pytest.raises(InvalidTokenException):
+        backend.get_unverified_claims(token)
+    with pytest.raises(InvalidTokenException):
+        backend.verify(token, JWK, ["RS256"], audience=AUDIENCE)
+
+
+def test_unknown_backend():
+    with pytest.raises(AuthInitializationException):
+        get_jwt_backend("unknown")
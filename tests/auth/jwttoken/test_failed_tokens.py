@@ -0,0 +1,148 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from auth import init
+from auth.http.appservice import AppServiceBasedTokenProvider
+from auth.jwttoken import token_service
+from auth.jwttoken.backends import generate_rsa_key, get_jwt_backend
+from auth.jwttoken.failed_tokens import FailedTokenCache, get_token_digest
+from auth.jwttoken.keys import SigningKeyCache
+from auth.jwttoken.precheck import PreVerificationPipeline
+from auth.jwttoken.token import IdAndAccessToken
+from auth.userProvider import ValidateAndReturnUser
+from config import get_settings
+from tests.conftest import create_request
+
+from .test_precheck import AUDIENCE
+
+settings = get_settings()
+
+PEM, JWK = generate_rsa_key("known")
+ROTATED_PEM, ROTATED_JWK = generate_rsa_key("known")
+
+
+def sign(pem=PEM, **claims):
+    claims = {
+        "aud": AUDIENCE,
+        "exp": int(time.time()) + 600,
+        "name": "user",
+        "groups": ["system-dev-reader"],
+        **claims,
+    }
+    return get_jwt_backend().encode(claims, pem, "RS256", headers={"kid": "known"})
+
+
+@pytest.fixture
+def key_cache(monkeypatch):
+    cache = SigningKeyCache("http://127.0.0.1:9/keys")
+    cache.jwks = {"known": JWK}
+    monkeypatch.setattr(cache, "fetch", lambda: cache.jwks)
+    cache.refresh()
+    return cache
+
+
+@pytest.fixture
+def call(monkeypatch, key_cache):
+    init()
+    monkeypatch.setattr(settings, "IS_ON_APP_SERVICE", True)
+    monkeypatch.setattr(settings, "WEBSITE_AUTH_ENABLED", True)
+    monkeypatch.setattr(settings, "FEATURE_RBAC_ENABLED", True)
+    monkeypatch.setattr(token_service, "tenant_id", "failed-tokens-tenant")
+    monkeypatch.setattr(token_service, "client_id", AUDIENCE)
+    monkeypatch.setattr(token_service, "signing_key_cache", key_cache)
+    monkeypatch.setattr(
+        token_service,
+        "pre_verification",
+        PreVerificationPipeline(token_service.resolve_tenant),
+    )
+    backend = get_jwt_backend()
+    verify = backend.verify
+    verifications = []
+
+    def counting_verify(*args, **kwargs):
+        verifications.append(args[0])
+        return verify(*args, **kwargs)
+
+    monkeypatch.setattr(backend, "verify", counting_verify)
+    dependency = ValidateAndReturnUser(expected_roles=["reader"])
+
+    def call(token):
+        try:
+            return asyncio.run(dependency(create_request(token))).name
+        except HTTPException as e:
+            return e.status_code
+
+    call.verifications = verifications
+    return call
+
+
+def test_failed_tokens_expire_and_are_bounded(key_cache):
+    cache = FailedTokenCache(maxsize=2, ttl=60)
+    assert not cache
+    for token in ("a", "b", "c"):
+        cache.add(get_token_digest(token), key_cache, key_cache.generation)
+    assert len(cache) == 2
+    assert not cache.has_failed(get_token_digest("a"))
+    assert cache.has_failed(get_token_digest("c")) and cache.hits == 1
+
+    cache = FailedTokenCache(maxsize=2, ttl=-1)
+    cache.add(get_token_digest("a"), key_cache, key_cache.generation)
+    assert not cache.has_failed(get_token_digest("a")) and not cache
+
+    cache = FailedTokenCache(maxsize=0, ttl=60)
+    cache.add(get_token_digest("a"), key_cache, key_cache.generation)
+    assert not cache
+
+
+def test_failures_against_older_keys_are_ignored(key_cache):
+    cache = FailedTokenCache(maxsize=10, ttl=60)
+    generation = key_cache.generation
+    key_cache.jwks = {"known": ROTATED_JWK}
+    key_cache.refresh()
+    cache.add(get_token_digest("raced"), key_cache, generation)
+    assert not cache.has_failed(get_token_digest("raced")) and not cache
+
+
+def test_tampered_tokens_are_verified_once(call):
+    header, claims, signature = sign().split(".")
+    tampered = ".".join(
+        (
+            header,
+            claims,
+            signature[:-4] + ("AAAA" if signature[-4:] != "AAAA" else "BBBB"),
+        )
+    )
+    assert [call(tampered) for _ in range(20)] == [401] * 20
+    assert call.verifications == [tampered]
+    stats = token_service.pre_verification.get_stats()
+    assert stats["rejected"]["failed_before"] == 19
+    assert stats["failed_tokens"] == {"size": 1, "hits": 19}
+    assert call(sign()) == "user"
+
+
+def test_tokens_failing_before_a_key_rotation_are_verified_again(call, key_cache):
+    token = sign(pem=ROTATED_PEM)
+    assert call(token) == 401
+    assert call(token) == 401
+    assert len(call.verifications) == 1
+
+    key_cache.jwks = {"known": ROTATED_JWK}
+    key_cache.refresh()
+    assert call(token) == "user"
+    assert len(call.verifications) == 2
+
+
+def test_expired_tokens_are_not_remembered(call, monkeypatch):
+    renewed = sign(name="renewed")
+    monkeypatch.setattr(
+        AppServiceBasedTokenProvider,
+        "renew_token",
+        lambda self, **kwargs: IdAndAccessToken(renewed, renewed),
+    )
+    token = sign(exp=int(time.time()) - 60)
+    assert call(token) == "renewed"
+    assert call.verifications == [token, renewed]
+    assert not token_service.pre_verification.failed_tokens
@@ -0,0 +1,182 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from auth import init
+from auth.exception import InvalidTokenException
+from auth.http.appservice import AppServiceBasedTokenProvider
+from auth.jwttoken import token_service
+from auth.jwttoken.backends import generate_rsa_key, get_jwt_backend
+from auth.jwttoken.keys import SigningKeyCache
+from auth.jwttoken.precheck import PreVerificationPipeline
+from auth.jwttoken.token import IdAndAccessToken
+from auth.userProvider import ValidateAndReturnUser
+from config import get_settings
+from tests.conftest import create_request
+
+settings = get_settings()
+
+AUDIENCE = "precheck-client"
+
+
+PEM, JWK = generate_rsa_key("known")
+
+
+def sign(kid="known", algorithm="RS256", **claims):
+    claims = {
+        "aud": AUDIENCE,
+        "exp": int(time.time()) + 600,
+        "name": "user",
+        "groups": ["system-dev-reader"],
+        **claims,
+    }
+    key = PEM if algorithm == "RS256" else "secret"
+    return get_jwt_backend().encode(
+        claims, key, algorithm, headers={} if kid is None else {"kid": kid}
+    )
+
+
+@pytest.fixture
+def key_cache(monkeypatch):
+    cache = SigningKeyCache("http://127.0.0.1:9/keys")
+    cache.fetches = 0
+
+    def fetch():
+        cache.fetches += 1
+        return {"known": JWK}
+
+    monkeypatch.setattr(cache, "fetch", fetch)
+    cache.refresh()
+    cache.fetches = 0
+    cache.attempted_at -= settings.KEY_REFRESH_MIN_INTERVAL_SECONDS
+    return cache
+
+
+def test_each_check_rejects_its_junk_and_counts_it(key_cache):
+    pipeline = PreVerificationPipeline(lambda claims: (key_cache, AUDIENCE))
+    key_cache.add_unknown("junk")
+    rejected = {
+        "size": "x" * (settings.MAX_TOKEN_SIZE + 1),
+        "segments": "header.claims",
+        "algorithm": sign(algorithm="HS256"),
+        "key_id": sign(kid="junk"),
+        "lifetime": sign(nbf=int(time.time()) + 600),
+        "audience": sign(aud="someone-else"),
+    }
+    for token in rejected.values():
+        with pytest.raises(InvalidTokenException):
+            pipeline.run(token)
+    with pytest.raises(InvalidTokenException):
+        pipeline.run(sign(kid=None))
+    with pytest.raises(InvalidTokenException):
+        pipeline.run(sign(exp="soon"))
+    assert pipeline.rejected == {
+        "size": 1,
+        "failed_before": 0,
+        "segments": 1,
+        "algorithm": 1,
+        "key_id": 2,
+        "lifetime": 2,
+        "audience": 1,
+    }
+
+    assert pipeline.run(sign(exp=int(time.time()) - 1)).key == JWK
+    candidate = pipeline.run(sign(kid="new"))
+    assert candidate.key is None and candidate.key_cache is key_cache
+    candidate = pipeline.run(sign())
+    assert (
+        candidate.key == JWK
+        and candidate.audience == AUDIENCE
+        and candidate.header["kid"] == "known"
+    )
+    assert pipeline.get_stats()["passed"] == 3
+
+
+def test_unknown_key_ids_are_forgotten_when_the_keys_change(key_cache, monkeypatch):
+    key_cache.add_unknown("rotated")
+    key_cache.refresh()
+    assert key_cache.is_unknown("rotated")
+    monkeypatch.setattr(key_cache, "fetch", lambda: {"known": JWK, "rotated": JWK})
+    key_cache.refresh()
+    assert not key_cache.is_unknown("rotated")
+
+
+def test_unknown_key_ids_are_bounded(key_cache, monkeypatch):
+    monkeypatch.setattr(settings, "UNKNOWN_KID_CACHE_SIZE", 2)
+    for kid in ("a", "b", "c"):
+        key_cache.add_unknown(kid)
+    assert list(key_cache.unknown_kids) == ["b", "c"]
+    monkeypatch.setattr(settings, "UNKNOWN_KID_CACHE_SECONDS", -1)
+    key_cache.add_unknown("d")
+    assert not key_cache.is_unknown("d")
+
+
+@pytest.fixture
+def call(monkeypatch, key_cache):
+    init()
+    monkeypatch.setattr(settings, "IS_ON_APP_SERVICE", True)
+    monkeypatch.setattr(settings, "WEBSITE_AUTH_ENABLED", True)
+    monkeypatch.setattr(settings, "FEATURE_RBAC_ENABLED", True)
+    monkeypatch.setattr(token_service, "tenant_id", "precheck-tenant")
+    monkeypatch.setattr(token_service, "client_id", AUDIENCE)
+    monkeypatch.setattr(token_service, "signing_key_cache", key_cache)
+    monkeypatch.setattr(
+        token_service,
+        "pre_verification",
+        PreVerificationPipeline(token_service.resolve_tenant),
+    )
+    dependency = ValidateAndReturnUser(expected_roles=["reader"])
+
+    def call(token):
+        try:
+            return asyncio.run(dependency(create_request(token))).name
+        except HTTPException as e:
+            return e.status_code
+
+    return call
+
+
+def test_junk_key_ids_cause_a_single_key_refresh(call, key_cache):
+    junk = sign(kid="junk")
+    assert [call(junk) for _ in range(50)] == [401] * 50
+    assert key_cache.fetches == 1
+    assert call(sign(kid="other-junk", aud="someone-else")) == 401
+    assert call(sign(algorithm="HS256")) == 401
+    assert key_cache.fetches == 1
+    assert call(sign()) == "user"
+
+
+def test_distinct_junk_key_ids_cause_at_most_one_refresh_per_interval(
+    call, key_cache, monkeypatch
+):
+    assert [call(sign(kid=f"junk-{i}")) for i in range(50)] == [401] * 50
+    assert key_cache.fetches == 1
+    assert key_cache.is_unknown("junk-49")
+
+    monkeypatch.setattr(settings, "KEY_REFRESH_MIN_INTERVAL_SECONDS", 0.5)
+    monkeypatch.setattr(key_cache, "fetch", lambda: {"known": JWK, "rotated": JWK})
+    rotated = sign(kid="rotated")
+    key_cache.attempted_at = time.monotonic()
+    assert call(rotated) == 401
+    time.sleep(0.5)
+    assert not key_cache.is_unknown("rotated")
+    assert call(rotated) == "user"
+
+
+def test_only_verified_expired_tokens_are_renewed(call, monkeypatch):
+    renewals = []
+
+    def renew_token(self, **kwargs):
+        renewals.append(kwargs)
+        renewed = sign(name="renewed")
+        return IdAndAccessToken(renewed, renewed)
+
+    monkeypatch.setattr(AppServiceBasedTokenProvider, "renew_token", renew_token)
+    header, claims, _ = sign(exp=int(time.time()) - 60).split(".")
+    _, _, signature = sign().split(".")
+    assert call(f"{header}.{claims}.{signature}") == 401
+    assert renewals == []
+    assert call(sign(exp=int(time.time()) - 60)) == "renewed"
+    assert len(renewals) == 1
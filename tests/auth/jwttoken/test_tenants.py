@@ -0,0 +1,153 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from fastapi import HTTPException
+
+from auth import init
+from auth.exception import InvalidTokenException
+from auth.http import resilience
+from auth.http.resilience import RetryBudget
+from auth.jwttoken import token_service
+from auth.jwttoken.backends import generate_rsa_key, get_jwt_backend
+from auth.jwttoken.tenants import Tenant, TenantRegistry
+from auth.userProvider import ValidateAndReturnUser
+from config import get_settings
+from tests.conftest import create_request
+
+settings = get_settings()
+
+
+class TenantKey:
+    def __init__(self, tenant_id):
+        self.kid = f"{tenant_id}-key"
+        self.pem, self.jwk = generate_rsa_key(self.kid)
+
+    def sign(self, claims):
+        claims = {
+            "exp": int(time.time()) + 600,
+            "name": "user",
+            "groups": ["system-dev-reader"],
+            **claims,
+        }
+        return get_jwt_backend().encode(
+            claims, self.pem, "RS256", headers={"kid": self.kid}
+        )
+
+
+class TenantJwksHandler(BaseHTTPRequestHandler):
+    """Serves the key of the tenant named in the path, `/<tenant id>/discovery/v2.0/keys`, and counts the fetches per tenant."""
+
+    keys = {}
+    fetches = {}
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        tenant_id = self.path.split("/")[1]
+        TenantJwksHandler.fetches[tenant_id] = (
+            TenantJwksHandler.fetches.get(tenant_id, 0) + 1
+        )
+        key = TenantJwksHandler.keys.get(tenant_id)
+        payload = json.dumps({"keys": [key.jwk] if key else []}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+@pytest.fixture
+def authority(monkeypatch):
+    init()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), TenantJwksHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(
+        settings, "AZURE_AUTHORITY_HOST", f"http://127.0.0.1:{server.server_port}"
+    )
+    monkeypatch.setattr(settings, "IS_ON_APP_SERVICE", True)
+    monkeypatch.setattr(settings, "WEBSITE_AUTH_ENABLED", True)
+    monkeypatch.setattr(settings, "FEATURE_RBAC_ENABLED", True)
+    monkeypatch.setattr(resilience, "circuit_breakers", {})
+    monkeypatch.setattr(
+        resilience, "retry_budget", RetryBudget(ratio=0, min_per_second=0, max_tokens=0)
+    )
+    TenantJwksHandler.keys = {
+        "contoso": TenantKey("contoso"),
+        "fabrikam": TenantKey("fabrikam"),
+    }
+    TenantJwksHandler.fetches = {}
+    yield settings.AZURE_AUTHORITY_HOST
+    server.shutdown()
+
+
+def test_tokens_are_routed_by_issuer_or_tenant_id(authority):
+    contoso = Tenant("contoso", ["client-a"])
+    fabrikam = Tenant("fabrikam", ["client-b", "client-c"])
+    registry = TenantRegistry([contoso, fabrikam])
+    assert registry.resolve({"iss": f"{authority}/contoso/v2.0"}) is contoso
+    assert registry.resolve({"iss": "https://sts.windows.net/fabrikam/"}) is fabrikam
+    assert registry.resolve({"tid": "fabrikam"}) is fabrikam
+    with pytest.raises(InvalidTokenException):
+        registry.resolve({"iss": f"{authority}/other/v2.0", "tid": "contoso"})
+    assert fabrikam.get_audience({"aud": "client-c"}) == "client-c"
+    assert fabrikam.get_audience({"aud": ["unknown", "client-c"]}) == "client-c"
+    assert fabrikam.get_audience({"aud": "client-a"}) == "client-b"
+    assert not contoso.is_loaded()
+
+
+def test_registry_from_settings_includes_the_home_tenant(monkeypatch):
+    home_cache = token_service.signing_key_cache
+    monkeypatch.setattr(settings, "AZURE_TENANTS", {})
+    assert TenantRegistry.from_settings(settings, home_cache) is None
+    monkeypatch.setattr(settings, "AZURE_TENANT_ID", "contoso")
+    monkeypatch.setattr(settings, "AZURE_CLIENT_ID", "client-a")
+    monkeypatch.setattr(
+        settings, "AZURE_TENANTS", {"contoso": ["client-b"], "fabrikam": "client-c"}
+    )
+    registry = TenantRegistry.from_settings(settings, home_cache)
+    assert registry.tenants["contoso"].audiences == ("client-a", "client-b")
+    assert registry.tenants["contoso"].signing_key_cache is home_cache
+    assert registry.tenants["fabrikam"].audiences == ("client-c",)
+    assert not registry.tenants["fabrikam"].is_loaded()
+
+
+def test_each_tenant_verifies_with_its_own_keys_and_audiences(monkeypatch, authority):
+    registry = TenantRegistry(
+        [Tenant("contoso", ["client-a"]), Tenant("fabrikam", ["client-b", "client-c"])]
+    )
+    monkeypatch.setattr(token_service, "tenant_registry", registry)
+    contoso_key, fabrikam_key = (
+        TenantJwksHandler.keys["contoso"],
+        TenantJwksHandler.keys["fabrikam"],
+    )
+    dependency = ValidateAndReturnUser(expected_roles=["reader"])
+
+    def call(key, **claims):
+        try:
+            return asyncio.run(dependency(create_request(key.sign(claims)))).name
+        except HTTPException as e:
+            return e.status_code
+
+    contoso_issuer, fabrikam_issuer = (
+        f"{authority}/contoso/v2.0",
+        f"{authority}/fabrikam/v2.0",
+    )
+    assert (
+        call(contoso_key, iss=contoso_issuer, aud="client-a", name="alice") == "alice"
+    )
+    assert TenantJwksHandler.fetches == {"contoso": 1}
+    assert not registry.tenants["fabrikam"].is_loaded()
+
+    assert call(fabrikam_key, iss=fabrikam_issuer, aud="client-c", name="bob") == "bob"
+    assert call(fabrikam_key, tid="fabrikam", aud="client-b", name="carol") == "carol"
+    assert TenantJwksHandler.fetches == {"contoso": 1, "fabrikam": 1}
+
+    assert call(contoso_key, iss=fabrikam_issuer, aud="client-b") == 401
+    assert call(contoso_key, iss=contoso_issuer, aud="client-b") == 401
+    assert call(contoso_key, iss=f"{authority}/unknown/v2.0", aud="client-a") == 401
+    assert "unknown" not in TenantJwksHandler.fetches
@@ -1,4 +1,18 @@
+import dataclasses
+import threading
+import time
+
+import pytest
+from jose import jwt
+
+from auth import auth_config
+from auth.auth_config import get_auth_config
+from auth.exception import InvalidTokenException, TokenExpiredException
+from auth.jwttoken.token import IdAndAccessToken, TokenProvider
 from auth.jwttoken.token_service import DefaultTokenService, DummyTokenProvider
+from config import get_settings
+
+settings = get_settings()
 
 
 def test_default_token_service():
@@ -7,3 +21,112 @@ def test_default_token_service():
     user = token_service.decode_and_check_authorization(["admin"])
     assert user is not None
     assert user.name == "Dummy User"
+
+
+class StaticGroupResolver:
+    def get_groups(self, object_id, access_token):
+        return ["system-dev-reader"]
+
+
+class OverageTokenProvider(TokenProvider):
+    def __init__(self, oid="user-1"):
+        self.oid = oid
+
+    def get_id_and_access_token(self, **kwargs) -> IdAndAccessToken:
+        claims = {
+            "name": "Overage User",
+            "_claim_names": {"groups": "src1"},
+            "_claim_sources": {"src1": {"endpoint": "https://graph.windows.net"}},
+        }
+        if self.oid is not None:
+            claims["oid"] = self.oid
+        token = jwt.encode(claims, "my_secret_key", algorithm="HS256")
+        return IdAndAccessToken(access_token=token, id_token=token)
+
+    def renew_token(self, **kwargs):
+        pass
+
+
+def test_default_token_service_resolves_group_overage():
+    token_service = DefaultTokenService(
+        OverageTokenProvider(), group_resolver=StaticGroupResolver()
+    )
+    user = token_service.decode_and_check_authorization([])
+    assert "system-dev-reader" in user.role_collection.get_in_group_format()
+
+
+def test_group_overage_without_object_id_is_an_invalid_token():
+    token_service = DefaultTokenService(
+        OverageTokenProvider(oid=None), group_resolver=StaticGroupResolver()
+    )
+    with pytest.raises(InvalidTokenException):
+        token_service.decode_and_check_authorization([])
+
+
+def test_default_token_service_projects_claims():
+    token_service = DefaultTokenService(DummyTokenProvider())
+    user = token_service.decode_and_check_authorization([])
+    assert set(user.claims) == {"name", "exp", "email"}
+    assert user.full_claims["groups"]
+
+
+class SoonExpiringTokenProvider(TokenProvider):
+    def __init__(self):
+        self.renewed = threading.Event()
+        self.renewals = 0
+
+    def get_id_and_access_token(self, **kwargs) -> IdAndAccessToken:
+        claims = {"name": "Expiring User", "exp": int(time.time()) + 30}
+        token = jwt.encode(claims, "my_secret_key", algorithm="HS256")
+        return IdAndAccessToken(access_token=token, id_token=token)
+
+    def renew_token(self, **kwargs):
+        self.renewals += 1
+        self.renewed.set()
+
+
+def test_default_token_service_refreshes_ahead(monkeypatch):
+    token_provider = SoonExpiringTokenProvider()
+    token_service = DefaultTokenService(token_provider)
+    compiled = get_auth_config()
+    monkeypatch.setattr(
+        auth_config,
+        "auth_config",
+        dataclasses.replace(compiled, token_refresh_ahead_seconds=10),
+    )
+    token_service.decode_and_check_authorization([])
+    assert token_provider.renewals == 0
+    monkeypatch.setattr(
+        auth_config,
+        "auth_config",
+        dataclasses.replace(compiled, token_refresh_ahead_seconds=60),
+    )
+    user = token_service.decode_and_check_authorization([])
+    assert user.name == "Expiring User"
+    assert token_provider.renewed.wait(5)
+    assert token_provider.renewals == 1
+
+
+def test_dummy_token_provider_hands_out_prebuilt_user():
+    token_service = DefaultTokenService(DummyTokenProvider())
+    user = token_service.decode_and_check_authorization([])
+    assert token_service.decode_and_check_authorization([]) is user
+
+
+class ExpiredTokenProvider(TokenProvider):
+    def get_id_and_access_token(self, **kwargs) -> IdAndAccessToken:
+        raise TokenExpiredException("Signature has expired.")
+
+    def renew_token(self, **kwargs) -> IdAndAccessToken:
+        return IdAndAccessToken(
+            access_token="not a jwt",
+            id_token="not a jwt either",
+            claims={"name": "Renewed User", "groups": ["system-dev-reader"]},
+        )
+
+
+def test_default_token_service_uses_claims_of_renewed_tokens():
+    token_service = DefaultTokenService(ExpiredTokenProvider())
+    user = token_service.decode_and_check_authorization([])
+    assert user.name == "Renewed User"
+    assert "system-dev-reader" in user.role_collection.get_in_group_format()
@@ -1,4 +1,13 @@
+from unittest.mock import MagicMock
+
+import pytest
+from jose import jwt
+
+from auth.exception import IdTokenMissingException
 from auth.jwttoken.token_stub import DummyTokenProvider
+from config import get_settings
+
+settings = get_settings()
 
 
 def test_dummy_token_provider():
@@ -7,3 +16,28 @@ def test_dummy_token_provider():
     assert token is not None
     assert token.access_token is not None
     assert token.id_token is not None
+
+
+def test_dummy_token_provider_reuses_minted_tokens():
+    token_provider = DummyTokenProvider()
+    assert (
+        token_provider.get_id_and_access_token()
+        is token_provider.get_id_and_access_token()
+    )
+
+
+def test_dummy_token_provider_selects_synthetic_identity():
+    token_provider = DummyTokenProvider(
+        identities={
+            "reader": {"groups": ["system-prod-reader"], "claims": {"name": "Reader"}}
+        }
+    )
+    request = MagicMock()
+    request.headers = {settings.BYPASS_AUTH_IDENTITY_HEADER: "reader"}
+    token = token_provider.get_id_and_access_token(request=request)
+    claims = jwt.get_unverified_claims(token.id_token)
+    assert claims["groups"] == ["system-prod-reader"]
+    assert claims["name"] == "Reader"
+    request.headers = {settings.BYPASS_AUTH_IDENTITY_HEADER: "unknown"}
+    with pytest.raises(IdTokenMissingException):
+        token_provider.get_id_and_access_token(request=request)
@@ -0,0 +1,21 @@
+from auth.model.claims import ClaimProjection, get_claim_projection
+
+
+def test_projection_keeps_only_declared_claims():
+    projection = ClaimProjection(["name", "email", "oid"])
+    claims = projection.project(
+        {"name": "Jane", "oid": "1", "groups": ["a-dev-reader"]}
+    )
+    assert dict(claims) == {"name": "Jane", "oid": "1"}
+    assert claims.get("email") is None
+    assert "groups" not in claims
+    assert len(claims) == 2
+
+
+def test_projections_share_claim_names():
+    projection = get_claim_projection("name, exp")
+    assert projection is get_claim_projection("name, exp")
+    first = projection.project({"name": "a"})
+    second = projection.project({"name": "b"})
+    assert first._projection is second._projection
+    assert projection.names == ("name", "exp")
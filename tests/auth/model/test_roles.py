@@ -0,0 +1,115 @@
+import pytest
+
+from auth.model.roles import Role, RoleCollection
+from auth.model.user import User
+from config import get_settings
+
+settings = get_settings()
+
+
+def create_role_collection():
+    role_collection = RoleCollection()
+    role_collection.add_roles(
+        [
+            Role("system", "dev", "contributor"),
+            Role("system", "dev", "reader"),
+            Role("system", "prod", "reader"),
+            Role("billing", "test", "reader"),
+        ]
+    )
+    return role_collection
+
+
+def test_authorize_batch():
+    role_collection = create_role_collection()
+    mask = role_collection.authorize_batch(
+        ["system", "system", None, "billing", "system", None],
+        ["dev", "prod", "test", "dev", "test", "prod"],
+        ["contributor", "contributor", "reader", "reader", "reader", "reader"],
+    )
+    assert mask == [True, False, True, False, False, True]
+
+
+def test_authorize_batch_rejects_mismatched_lengths():
+    with pytest.raises(ValueError):
+        RoleCollection().authorize_batch(["system"], ["dev", "prod"], ["reader"])
+
+
+def test_permission_index_is_rebuilt_after_adding_roles():
+    role_collection = create_role_collection()
+    assert role_collection.get_effective_roles("prod") == {"reader"}
+    role_collection.add_role(Role("system", "prod", "admin"))
+    assert role_collection.get_effective_roles("prod") == {"reader", "admin"}
+    assert role_collection.get_effective_roles("prod", "billing") == frozenset()
+
+
+def test_get_allowed_environments():
+    role_collection = create_role_collection()
+    assert role_collection.get_allowed_environments("reader") == {"dev", "prod", "test"}
+    assert role_collection.get_allowed_environments("reader", "billing") == {"test"}
+    assert role_collection.get_allowed_environments("admin") == set()
+
+
+def test_user_batch_authorization_honours_rbac_flag(monkeypatch):
+    user = User(role_collection=create_role_collection())
+    monkeypatch.setattr(settings, "FEATURE_RBAC_ENABLED", False)
+    assert user.authorize_batch([None], ["prod"], ["admin"]) == [True]
+    assert user.get_allowed_environments("admin") is None
+    monkeypatch.setattr(settings, "FEATURE_RBAC_ENABLED", True)
+    assert user.authorize_batch([None], ["prod"], ["admin"]) == [False]
+    assert user.get_allowed_environments("contributor") == {"dev"}
+
+
+def test_batch_authorization_matches_is_authorized(monkeypatch):
+    monkeypatch.setattr(settings, "FEATURE_RBAC_ENABLED", True)
+    role_collection = create_role_collection()
+    role_collection.add_role(Role("system", "dev", settings.ADMIN_ROLE_NAME))
+    user = User(role_collection=role_collection)
+    items = [
+        ("system", "dev", "admin"),
+        ("system", "prod", "admin"),
+        ("billing", "prod", "contributor"),
+        ("billing", "test", "reader"),
+        (None, "dev", "admin"),
+        (None, "prod", "contributor"),
+        (None, "test", "admin"),
+    ]
+    app_names, envs, required_roles = zip(*items)
+    mask = user.authorize_batch(app_names, envs, required_roles)
+    assert mask == [
+        user.is_authorized([role], env, app_name) for app_name, env, role in items
+    ]
+    assert mask == [True, False, False, True, True, False, False]
+    assert user.get_allowed_environments("admin", "system") == {"dev"}
+    with pytest.raises(ValueError):
+        user.authorize_batch(["billing"], ["prod", "test"], ["contributor"])
+
+
+def test_platform_admin_is_scoped_to_its_environment():
+    role_collection = RoleCollection()
+    role_collection.add_roles(
+        [
+            Role(settings.CP_APP_NAME, "dev", settings.ADMIN_ROLE_NAME),
+            Role(settings.CP_APP_NAME, "dev", settings.READER_ROLE_NAME),
+            Role("system", "prod", settings.READER_ROLE_NAME),
+        ]
+    )
+    assert settings.READER_ROLE_NAME in role_collection.get_effective_roles(
+        "dev", "system"
+    )
+    assert settings.ADMIN_ROLE_NAME in role_collection.get_effective_roles(
+        "dev", "billing"
+    )
+    assert role_collection.get_effective_roles("prod", "billing") == frozenset()
+    assert role_collection.get_allowed_environments(
+        settings.ADMIN_ROLE_NAME, "billing"
+    ) == {"dev"}
+
+
+def test_user_is_authorized_in_env(monkeypatch):
+    monkeypatch.setattr(settings, "FEATURE_RBAC_ENABLED", True)
+    user = User(role_collection=create_role_collection())
+    assert user.is_authorized(["reader"], env="prod")
+    assert not user.is_authorized(["contributor"], env="prod")
+    assert user.is_authorized(["contributor"], env="dev", app_name="system")
+    assert not user.is_authorized(["reader"], env="dev", app_name="billing")
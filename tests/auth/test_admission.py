@@ -0,0 +1,208 @@
+import asyncio
+import contextvars
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import httpx
+import pytest
+from anyio import to_thread
+from fastapi import Depends, FastAPI, HTTPException, Request
+
+import auth
+from auth import userProvider
+from auth.admission import QUEUE_FULL, QUEUE_TIMEOUT, VerificationExecutor
+from auth.exception import OverloadedException
+from auth.model.user import User
+from auth.userProvider import ValidateAndReturnUser
+
+request_id = contextvars.ContextVar("request_id", default=None)
+
+
+@pytest.fixture
+def executor():
+    executor = VerificationExecutor(
+        workers=1, queue_size=1, queue_timeout=5, retry_after=3
+    )
+    yield executor
+    executor.shutdown()
+
+
+def occupy(executor, release: threading.Event, count=1):
+    """Starts `count` calls that hold a verification thread or a queue slot until `release` is set."""
+    threads = [
+        threading.Thread(target=executor.run, args=(release.wait,))
+        for _ in range(count)
+    ]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + 5
+    while executor.pending < count and time.monotonic() < deadline:
+        time.sleep(0.001)
+    return threads
+
+
+def test_runs_in_the_context_of_the_caller_and_raises_its_errors(executor):
+    request_id.set("abc")
+    assert executor.run(lambda suffix: request_id.get() + suffix, "-1") == "abc-1"
+    assert threading.current_thread().name != executor.run(
+        lambda: threading.current_thread().name
+    )
+    with pytest.raises(ZeroDivisionError):
+        executor.run(lambda: 1 / 0)
+    stats = executor.get_stats()
+    assert stats["admitted"] == stats["completed"] == 3
+    assert stats["queue_depth"] == stats["running"] == 0
+    assert stats["wait_ms"]["p50"] is not None
+
+
+def test_requests_beyond_the_queue_are_shed_immediately(executor):
+    release = threading.Event()
+    threads = occupy(executor, release, count=2)
+    assert (
+        executor.get_stats()["running"] == 1
+        and executor.get_stats()["queue_depth"] == 1
+    )
+    started = time.perf_counter()
+    with pytest.raises(OverloadedException) as e:
+        executor.run(lambda: "never")
+    assert time.perf_counter() - started < 0.1
+    assert e.value.reason == QUEUE_FULL and e.value.retry_after == 3
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert executor.run(lambda: "served") == "served"
+    assert executor.get_stats()["shed"] == {QUEUE_FULL: 1, QUEUE_TIMEOUT: 0}
+
+
+def test_requests_waiting_too_long_are_shed_when_dequeued():
+    executor = VerificationExecutor(workers=1, queue_size=1, queue_timeout=0.05)
+    called = []
+    release = threading.Event()
+    threads = occupy(executor, release)
+    waiter = threading.Thread(
+        target=lambda: pytest.raises(
+            OverloadedException, executor.run, called.append, 1
+        )
+    )
+    waiter.start()
+    time.sleep(0.1)
+    release.set()
+    waiter.join()
+    for thread in threads:
+        thread.join()
+    assert called == []
+    stats = executor.get_stats()
+    assert stats["shed"][QUEUE_TIMEOUT] == 1 and stats["max_wait_ms"] >= 50
+    executor.shutdown()
+
+
+def test_cancelled_waiters_release_their_queue_slot(executor):
+    release = threading.Event()
+    threads = occupy(executor, release)
+    called = []
+
+    async def scenario():
+        waiter = asyncio.create_task(executor.run_async(called.append, 1))
+        deadline = time.monotonic() + 2
+        while executor.pending < 2 and time.monotonic() < deadline:
+            await asyncio.sleep(0.001)
+        while executor.running < 1 and time.monotonic() < deadline:
+            await asyncio.sleep(0.001)
+        assert executor.get_stats()["queue_depth"] == 1
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+
+    try:
+        asyncio.run(scenario())
+        assert executor.get_stats()["queue_depth"] == 0
+    finally:
+        release.set()
+        for thread in threads:
+            thread.join()
+    assert called == []
+    assert executor.run(lambda: "served") == "served"
+    assert executor.pending == 0
+
+
+def test_without_workers_verification_runs_on_the_caller():
+    executor = VerificationExecutor(workers=0, queue_size=0)
+    assert (
+        executor.run(lambda: threading.current_thread()) is threading.current_thread()
+    )
+
+
+def test_shed_requests_get_503_with_retry_after(monkeypatch, executor):
+    auth.init()
+    monkeypatch.setattr(userProvider, "verification_executor", executor)
+    release = threading.Event()
+    threads = occupy(executor, release, count=2)
+    request = MagicMock(spec=Request)
+    with patch("auth.userProvider.get_token_service") as mock_get_token_service:
+        mock_get_token_service.return_value.decode_and_check_authorization.return_value = User(
+            name="Dummy"
+        )
+        with pytest.raises(HTTPException) as e:
+            asyncio.run(ValidateAndReturnUser(["reader"])(request))
+        assert e.value.status_code == 503
+        assert e.value.headers == {"Retry-After": "3"}
+        release.set()
+        for thread in threads:
+            thread.join()
+        assert asyncio.run(ValidateAndReturnUser(["reader"])(request)).name == "Dummy"
+
+
+def test_waiting_verifications_do_not_hold_application_threads(monkeypatch):
+    auth.init()
+    executor = VerificationExecutor(workers=1, queue_size=8, queue_timeout=5)
+    monkeypatch.setattr(userProvider, "verification_executor", executor)
+    release = threading.Event()
+    app = FastAPI()
+
+    @app.get("/protected")
+    async def protected(user: User = Depends(ValidateAndReturnUser(["reader"]))):
+        return user.name
+
+    @app.get("/unauthenticated")
+    def unauthenticated():
+        return "served"
+
+    async def scenario():
+        to_thread.current_default_thread_limiter().total_tokens = 2
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://test"
+        ) as client:
+            protected_calls = [
+                asyncio.create_task(client.get("/protected")) for _ in range(6)
+            ]
+            deadline = time.monotonic() + 2
+            while executor.pending < 6 and time.monotonic() < deadline:
+                await asyncio.sleep(0.001)
+            try:
+                response = await asyncio.wait_for(
+                    client.get("/unauthenticated"), timeout=2
+                )
+            finally:
+                release.set()
+            return response, await asyncio.gather(*protected_calls)
+
+    def verify(*args, **kwargs):
+        release.wait(5)
+        return User(name="Dummy")
+
+    with patch("auth.userProvider.get_token_service") as mock_get_token_service:
+        mock_get_token_service.return_value.decode_and_check_authorization.side_effect = (
+            verify
+        )
+        response, protected_responses = asyncio.run(scenario())
+    executor.shutdown()
+    assert response.json() == "served"
+    assert [r.json() for r in protected_responses] == ["Dummy"] * 6
+
+
+def test_without_workers_async_verification_runs_on_the_application_thread_pool():
+    executor = VerificationExecutor(workers=0, queue_size=0)
+    caller = threading.current_thread()
+    assert asyncio.run(executor.run_async(threading.current_thread)) is not caller
@@ -0,0 +1,198 @@
+import json
+import threading
+import time
+
+import pytest
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+
+from auth import audit, init, userProvider
+from auth.admission import VerificationExecutor
+from auth.audit import BLOCK, AuditLog, AuditRecord, AuditRingBuffer
+from auth.model.user import User
+from auth.userProvider import ValidateAndReturnUser
+from config import get_settings
+
+settings = get_settings()
+
+
+def read_records(path):
+    with open(path, encoding="utf-8") as file:
+        return [json.loads(line) for line in file]
+
+
+def test_drop_oldest_keeps_the_newest_records():
+    buffer = AuditRingBuffer(capacity=3)
+    for i in range(5):
+        assert buffer.put(AuditRecord(f"user {i}", "/", [], None, "allowed"))
+    assert [record.user for record in buffer.take(10)] == ["user 2", "user 3", "user 4"]
+    assert buffer.dropped == 2 and buffer.enqueued == 5
+
+
+def test_block_waits_for_room_then_drops_the_new_record():
+    buffer = AuditRingBuffer(capacity=1, policy=BLOCK, block_timeout=0.05)
+    assert buffer.put(AuditRecord("first", "/", [], None, "allowed"))
+    assert not buffer.put(AuditRecord("timed out", "/", [], None, "allowed"))
+    assert buffer.dropped == 1
+
+    threading.Timer(0.01, buffer.take, args=(1,)).start()
+    buffer.block_timeout = 5
+    assert buffer.put(AuditRecord("unblocked", "/", [], None, "allowed"))
+    assert [record.user for record in buffer.take(10)] == ["unblocked"]
+
+
+def test_block_drops_the_new_record_at_once_when_not_blocking():
+    buffer = AuditRingBuffer(capacity=1, policy=BLOCK, block_timeout=5)
+    assert buffer.put(AuditRecord("first", "/", [], None, "allowed"))
+    started = time.perf_counter()
+    assert not buffer.put(AuditRecord("shed", "/", [], None, "allowed"), block=False)
+    assert time.perf_counter() - started < 1 and buffer.dropped == 1
+
+
+def test_unknown_backpressure_policy_is_rejected():
+    with pytest.raises(ValueError):
+        AuditRingBuffer(capacity=1, policy="drop_newest")
+
+
+def test_records_are_written_in_batches_and_rotated(tmp_path):
+    path = tmp_path / "audit" / "decisions.jsonl"
+    audit_log = AuditLog(
+        str(path), batch_size=10, flush_interval=0.01, max_bytes=2000, backup_count=2
+    )
+    audit_log.start()
+    for i in range(100):
+        audit_log.record(
+            f"user {i}", "/authenticated/messages", ["reader"], None, "allowed"
+        )
+    audit_log.stop()
+
+    stats = audit_log.get_stats()
+    assert stats["written"] == 100 and stats["dropped"] == 0 and stats["pending"] == 0
+    assert stats["batches"] >= 10
+    assert path.stat().st_size <= 2000
+    rotated = [tmp_path / "audit" / f"decisions.jsonl.{i}" for i in (1, 2)]
+    assert all(file.exists() for file in rotated)
+    assert not (tmp_path / "audit" / "decisions.jsonl.3").exists()
+    records = read_records(rotated[1]) + read_records(rotated[0]) + read_records(path)
+    users = [record["user"] for record in records]
+    assert users == sorted(users, key=lambda user: int(user.split()[1]))
+    assert records[-1] == {
+        "ts": records[-1]["ts"],
+        "user": "user 99",
+        "route": "/authenticated/messages",
+        "expected": ["reader"],
+        "effective": [],
+        "outcome": "allowed",
+    }
+
+
+def create_app():
+    init()
+    app = FastAPI()
+
+    @app.get("/unauthenticated/messages")
+    def get_public_messages():
+        return {}
+
+    @app.get("/authenticated/messages")
+    def get_messages(
+        user: User = Depends(ValidateAndReturnUser(expected_roles=["admin"])),
+    ):
+        return {}
+
+    @app.get("/authenticated/{env}/messages")
+    def get_messages_for_env(
+        env: str,
+        user: User = Depends(
+            ValidateAndReturnUser(expected_roles=["admin"], env_param="env")
+        ),
+    ):
+        return {}
+
+    return app
+
+
+def test_decisions_of_protected_routes_are_audited(monkeypatch, tmp_path):
+    path = tmp_path / "decisions.jsonl"
+    audit_log = AuditLog(str(path))
+    monkeypatch.setattr(audit, "audit_log", audit_log)
+    monkeypatch.setattr(settings, "WEBSITE_AUTH_ENABLED", False)
+    monkeypatch.setattr(settings, "FEATURE_RBAC_ENABLED", True)
+
+    client = TestClient(create_app())
+    assert client.get("/authenticated/dev/messages").status_code == 200
+    assert client.get("/authenticated/prod/messages").status_code == 403
+    unknown_identity = {settings.BYPASS_AUTH_IDENTITY_HEADER: "nobody"}
+    assert (
+        client.get("/authenticated/messages", headers=unknown_identity).status_code
+        == 401
+    )
+    assert client.get("/unauthenticated/messages").status_code == 200
+    audit_log.flush()
+
+    allowed, forbidden, unauthenticated = read_records(path)
+    admin_group = "plat-dev-admin"
+    assert (
+        allowed["route"] == "/authenticated/{env}/messages" and allowed["env"] == "dev"
+    )
+    assert allowed["outcome"] == "allowed" and allowed["expected"] == ["admin"]
+    assert allowed["effective"] == [admin_group]
+    assert forbidden["outcome"] == "forbidden" and forbidden["env"] == "prod"
+    assert (
+        forbidden["user"] == allowed["user"] and admin_group in forbidden["effective"]
+    )
+    assert unauthenticated == {
+        "ts": unauthenticated["ts"],
+        "user": None,
+        "route": "/authenticated/messages",
+        "expected": ["admin"],
+        "effective": [],
+        "outcome": "unauthenticated",
+    }
+
+
+class ThreadRecordingAuditLog(AuditLog):
+    def __init__(self, path):
+        super().__init__(path)
+        self.calls = []
+
+    def record(
+        self,
+        user,
+        route,
+        expected_roles,
+        role_collection,
+        outcome,
+        env=None,
+        block=True,
+    ):
+        self.calls.append((outcome, threading.current_thread().name, block))
+        return super().record(
+            user, route, expected_roles, role_collection, outcome, env, block
+        )
+
+
+def test_decisions_are_recorded_on_the_verification_thread(monkeypatch, tmp_path):
+    audit_log = ThreadRecordingAuditLog(str(tmp_path / "decisions.jsonl"))
+    monkeypatch.setattr(audit, "audit_log", audit_log)
+    monkeypatch.setattr(settings, "WEBSITE_AUTH_ENABLED", False)
+    monkeypatch.setattr(settings, "FEATURE_RBAC_ENABLED", True)
+    client = TestClient(create_app())
+
+    executor = VerificationExecutor(workers=1, queue_size=1, queue_timeout=5)
+    monkeypatch.setattr(userProvider, "verification_executor", executor)
+    assert client.get("/authenticated/dev/messages").status_code == 200
+    assert client.get("/authenticated/prod/messages").status_code == 403
+    executor.shutdown()
+
+    shedding_executor = VerificationExecutor(workers=1, queue_size=1, queue_timeout=-1)
+    monkeypatch.setattr(userProvider, "verification_executor", shedding_executor)
+    assert client.get("/authenticated/dev/messages").status_code == 503
+    shedding_executor.shutdown()
+
+    (allowed, allowed_thread, allowed_block), forbidden, shed = audit_log.calls
+    assert allowed == "allowed" and allowed_thread.startswith("auth-verification")
+    assert forbidden[0] == "forbidden" and forbidden[1].startswith("auth-verification")
+    assert allowed_block and forbidden[2]
+    assert shed[0] == "unavailable" and not shed[1].startswith("auth-verification")
+    assert not shed[2]
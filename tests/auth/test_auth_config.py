@@ -0,0 +1,59 @@
+import dataclasses
+
+import pytest
+from starlette.requests import Request
+
+from auth.auth_config import compile_auth_config, get_auth_config
+from auth.http.appservice import AppServiceBasedTokenProvider
+from config import get_settings
+
+settings = get_settings()
+
+
+@pytest.fixture
+def restore_auth_config():
+    saved_valid_roles = settings.VALID_ROLES
+    saved_retained_claims = settings.RETAINED_CLAIMS
+    yield
+    settings.VALID_ROLES = saved_valid_roles
+    settings.RETAINED_CLAIMS = saved_retained_claims
+    compile_auth_config()
+
+
+def test_auth_config_is_compiled_and_frozen():
+    auth_config = get_auth_config()
+    assert auth_config.valid_roles == frozenset(["admin", "contributor", "reader"])
+    assert auth_config.group_pattern.match("plat-dev-reader").group(3) == "reader"
+    assert auth_config.id_token_header_raw == b"x-ms-token-aad-id-token"
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        auth_config.app_name = "other"
+
+
+def test_settings_changes_apply_on_compile(restore_auth_config):
+    settings.VALID_ROLES = "Admin, Auditor"
+    assert "auditor" not in get_auth_config().valid_roles
+    auth_config = compile_auth_config()
+    assert auth_config is get_auth_config()
+    assert auth_config.valid_roles == frozenset(["admin", "auditor"])
+
+
+def test_retained_claims_are_compiled_into_a_projection(restore_auth_config):
+    projection = get_auth_config().retained_claims
+    assert projection.names == ("name", "exp", "oid", "email")
+    settings.RETAINED_CLAIMS = "*"
+    assert get_auth_config().retained_claims is projection
+    assert compile_auth_config().retained_claims is None
+
+
+def test_tokens_are_read_from_raw_asgi_headers():
+    request = Request(
+        {
+            "type": "http",
+            "headers": [
+                (b"x-ms-token-aad-access-token", b"access"),
+                (b"x-ms-token-aad-id-token", b"id"),
+            ],
+        }
+    )
+    tokens = AppServiceBasedTokenProvider().get_id_and_access_token(request=request)
+    assert (tokens.access_token, tokens.id_token) == ("access", "id")
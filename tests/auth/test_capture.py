@@ -0,0 +1,204 @@
+import json
+import time
+
+import pytest
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+from jose import jwt
+
+from auth import capture, init
+from auth.capture import TrafficCapture, pseudonymize, sanitize_token
+from auth.jwttoken.backends import generate_rsa_key, get_jwt_backend
+from auth.model.user import User
+from auth.userProvider import ValidateAndReturnUser
+from config import get_settings
+from tools.replay import ReplaySigner, build_request, replay
+
+settings = get_settings()
+
+
+def create_token(name, groups, lifetime=3600):
+    now = int(time.time())
+    claims = {
+        "name": name,
+        "email": f"{name.lower()}@contoso.com",
+        "groups": groups,
+        "aud": "client",
+        "iat": now,
+        "exp": now + lifetime,
+    }
+    return jwt.encode(
+        claims, "my_secret_key", algorithm="HS256", headers={"kid": "production-key"}
+    )
+
+
+def get_headers(token):
+    return {
+        settings.APP_SERVICE_ID_TOKEN_HEADER: token,
+        settings.APP_SERVICE_ACCESS_TOKEN_HEADER: token,
+    }
+
+
+@pytest.fixture
+def client(monkeypatch):
+    init()
+    monkeypatch.setattr(settings, "WEBSITE_AUTH_ENABLED", True)
+    monkeypatch.setattr(settings, "IS_ON_APP_SERVICE", False)
+    monkeypatch.setattr(settings, "FEATURE_RBAC_ENABLED", True)
+    app = FastAPI()
+
+    @app.get("/authenticated/{env}/messages")
+    def get_messages_for_env(
+        env: str,
+        user: User = Depends(
+            ValidateAndReturnUser(expected_roles=["reader"], env_param="env")
+        ),
+    ):
+        return {}
+
+    @app.get("/authenticated/{env}/users/{email}/messages")
+    def get_user_messages_for_env(
+        env: str,
+        email: str,
+        user: User = Depends(
+            ValidateAndReturnUser(expected_roles=["reader"], env_param="env")
+        ),
+    ):
+        return {}
+
+    return TestClient(app)
+
+
+def test_sanitized_tokens_keep_their_shape_but_not_the_identity():
+    now = time.time()
+    token = create_token("John", ["plat-dev-reader"], lifetime=600)
+    sanitized = sanitize_token(token, now, b"salt")
+    assert sanitized["size"] == len(token)
+    assert sanitized["header"] == {"alg": "HS256", "typ": "JWT"}
+    claims = sanitized["claims"]
+    assert claims["groups"] == ["plat-dev-reader"] and claims["aud"] == "client"
+    assert 599 <= claims["exp"] <= 600 and -1 <= claims["iat"] <= 0
+    assert "John" not in json.dumps(sanitized) and "contoso" not in json.dumps(
+        sanitized
+    )
+    assert claims["name"] == sanitize_token(token, now, b"salt")["claims"]["name"]
+    assert claims["name"] != sanitize_token(token, now, b"other salt")["claims"]["name"]
+    assert sanitize_token("opaque", now, b"salt") == {"size": 6, "malformed": True}
+    assert sanitize_token(None, now, b"salt") is None
+
+
+def test_claims_not_known_to_be_safe_are_pseudonymized():
+    now = int(time.time())
+    claims = {
+        "groups": ["plat-dev-reader"],
+        "iss": "https://sts.windows.net/tenant/",
+        "tid": "tenant",
+        "ver": "1.0",
+        "login_hint": "john@contoso.com",
+        "sid": "session-1",
+        "xms_pdl": "EUR",
+        "auth_time": now - 60,
+    }
+    token = jwt.encode(claims, "my_secret_key", algorithm="HS256")
+    sanitized = sanitize_token(token, now, b"salt")["claims"]
+    for claim in ("groups", "iss", "tid", "ver"):
+        assert sanitized[claim] == claims[claim]
+    assert sanitized["auth_time"] == -60
+    for claim in ("login_hint", "sid", "xms_pdl"):
+        assert sanitized[claim] == pseudonymize(claim, claims[claim], b"salt")
+    assert "contoso" not in json.dumps(sanitized)
+
+
+def test_captured_traffic_replays_with_re_signed_tokens(monkeypatch, tmp_path, client):
+    path = tmp_path / "traffic.jsonl"
+    traffic_capture = TrafficCapture(str(path))
+    monkeypatch.setattr(capture, "traffic_capture", traffic_capture)
+    tokens = [
+        create_token(
+            f"User {i}",
+            ["plat-dev-reader"] + [f"team{j}-dev-reader" for j in range(i * 20)],
+        )
+        for i in range(3)
+    ]
+    for token in tokens:
+        assert (
+            client.get(
+                "/authenticated/dev/messages", headers=get_headers(token)
+            ).status_code
+            == 200
+        )
+    assert (
+        client.get(
+            "/authenticated/prod/messages", headers=get_headers(tokens[0])
+        ).status_code
+        == 403
+    )
+    assert client.get("/authenticated/dev/messages").status_code == 401
+    traffic_capture.flush()
+
+    captured = path.read_text()
+    for token in tokens:
+        assert token.split(".")[2] not in captured
+    assert "production-key" not in captured and "User" not in captured
+    records = [json.loads(line) for line in captured.splitlines()]
+    assert [record["outcome"] for record in records] == ["allowed"] * 3 + [
+        "forbidden",
+        "unauthenticated",
+    ]
+    assert records[3]["path_params"] == {"env": "prod"}
+    assert {record["route"] for record in records} == {"/authenticated/{env}/messages"}
+    assert all(
+        record["duration_ms"] > 0 and record["method"] == "GET" for record in records
+    )
+
+    pem, jwk = generate_rsa_key("replay")
+    signer = ReplaySigner(pem, jwk["kid"], audience="replay-client")
+    for record in records[:3]:
+        _, _, headers = build_request(record, signer, time.time())
+        replayed = headers[settings.APP_SERVICE_ID_TOKEN_HEADER]
+        claims = get_jwt_backend().verify(
+            replayed, jwk, ["RS256"], audience="replay-client"
+        )
+        assert claims["groups"] == record["id_token"]["claims"]["groups"]
+        assert claims["exp"] > time.time() + 3500
+
+    padded = dict(records[0]["id_token"], size=2000)
+    assert 1996 <= len(signer.sign(padded, time.time())) <= 2000
+
+    def send(method, path, headers):
+        return client.request(method, path, headers=headers).status_code
+
+    report = replay(records, send, signer, rate=0, concurrency=1)
+    assert report["requests"] == 5 and report["mismatched_outcomes"] == 0
+    assert report["routes"]["/authenticated/{env}/messages"]["statuses"] == {
+        "200": 3,
+        "403": 1,
+        "401": 1,
+    }
+
+
+def test_path_parameters_other_than_the_environment_are_pseudonymized(
+    monkeypatch, tmp_path, client
+):
+    path = tmp_path / "traffic.jsonl"
+    traffic_capture = TrafficCapture(str(path))
+    monkeypatch.setattr(capture, "traffic_capture", traffic_capture)
+    headers = get_headers(create_token("John", ["plat-dev-reader"]))
+    url = "/authenticated/dev/users/john@contoso.com/messages"
+    assert client.get(url, headers=headers).status_code == 200
+    traffic_capture.flush()
+
+    captured = path.read_text()
+    assert "john" not in captured and "contoso" not in captured
+    record = json.loads(captured)
+    assert "path" not in record
+    assert record["route"] == "/authenticated/{env}/users/{email}/messages"
+    assert record["path_params"]["env"] == "dev"
+    assert record["path_params"]["email"].startswith("email-")
+
+    pem, jwk = generate_rsa_key("replay")
+    signer = ReplaySigner(pem, jwk["kid"], audience="replay-client")
+    _, replayed_path, _ = build_request(record, signer, time.time())
+    pseudonym = record["path_params"]["email"]
+    assert replayed_path == f"/authenticated/dev/users/{pseudonym}/messages"
+    assert client.get(replayed_path, headers=headers).status_code == 200
@@ -0,0 +1,82 @@
+import pytest
+
+from auth import hierarchy_changed, init
+from auth.decisions import DecisionCache, decision_cache
+from auth.model.roles import Role, RoleCollection
+from auth.model.user import User
+from config import get_settings
+
+settings = get_settings()
+
+
+@pytest.fixture(autouse=True)
+def setup():
+    init()
+    saved_rbac = settings.FEATURE_RBAC_ENABLED
+    settings.FEATURE_RBAC_ENABLED = True
+    decision_cache.clear()
+    yield
+    settings.FEATURE_RBAC_ENABLED = saved_rbac
+
+
+def frozen_roles(*roles):
+    role_collection = RoleCollection()
+    role_collection.add_roles(roles)
+    return role_collection.freeze()
+
+
+def test_users_with_the_same_permissions_share_decisions():
+    cache = DecisionCache()
+    calls = []
+
+    def evaluate():
+        calls.append(1)
+        return True
+
+    first = frozen_roles(
+        Role("system", "dev", "reader"), Role("system", "dev", "admin")
+    )
+    second = frozen_roles(
+        Role("system", "dev", "admin"), Role("system", "dev", "reader")
+    )
+    assert cache.is_authorized(first, ["reader"], None, None, evaluate)
+    assert cache.is_authorized(second, ["reader"], None, None, evaluate)
+    assert cache.get_permission_set_id(first) == cache.get_permission_set_id(second)
+    assert len(calls) == 1 and cache.hits == 1
+    cache.is_authorized(first, ["reader"], "dev", None, evaluate)
+    assert len(calls) == 2
+
+
+def test_mutable_collections_are_not_memoized():
+    cache = DecisionCache()
+    role_collection = RoleCollection()
+    cache.is_authorized(role_collection, ["reader"], None, None, lambda: False)
+    assert len(cache) == 0
+
+
+def test_decisions_are_dropped_when_the_hierarchy_changes():
+    cache = DecisionCache()
+    role_collection = frozen_roles(Role("system", "dev", "reader"))
+    cache.is_authorized(role_collection, ["reader"], None, None, lambda: True)
+    assert len(cache) == 1
+    hierarchy_changed()
+    cache.is_authorized(role_collection, ["admin"], None, None, lambda: False)
+    assert len(cache) == 1 and cache.misses == 2
+
+
+def test_cache_is_bounded():
+    cache = DecisionCache(maxsize=2)
+    role_collection = frozen_roles(Role("system", "dev", "reader"))
+    for env in ["dev", "test", "prod"]:
+        cache.is_authorized(role_collection, ["reader"], env, None, lambda: True)
+    assert len(cache) == 2
+
+
+def test_user_decisions_match_uncached_evaluation():
+    reader = User(role_collection=frozen_roles(Role("system", "dev", "reader")))
+    for _ in range(2):
+        assert reader.is_authorized(["reader"])
+        assert not reader.is_authorized(["admin"])
+        assert reader.is_authorized(["reader"], env="dev")
+        assert not reader.is_authorized(["reader"], env="prod")
+    assert decision_cache.hits >= 4
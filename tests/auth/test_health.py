@@ -0,0 +1,77 @@
+from fastapi.testclient import TestClient
+
+from auth import health
+from auth.health import WarmUpState, get_readiness, warm_up
+from auth.jwttoken import token_service
+from auth.jwttoken.keys import SigningKeyCache
+from config import get_settings
+
+settings = get_settings()
+
+
+def test_not_ready_before_warm_up(monkeypatch):
+    monkeypatch.setattr(health, "warm_up_state", WarmUpState())
+    assert not get_readiness()["ready"]
+
+
+def test_warm_up_failures_are_recorded_and_block_readiness(monkeypatch):
+    monkeypatch.setattr(health, "warm_up_state", WarmUpState())
+    monkeypatch.setattr(settings, "WEBSITE_AUTH_ENABLED", True)
+    monkeypatch.setattr(token_service, "tenant_id", None)
+    monkeypatch.setattr(
+        token_service, "signing_key_cache", SigningKeyCache("http://127.0.0.1:9/keys")
+    )
+    state = warm_up()
+    assert state.completed
+    assert set(state.errors) == {"signing_keys"}
+    readiness = get_readiness()
+    assert not readiness["ready"]
+    assert readiness["signing_keys"] == {
+        "count": 0,
+        "age_seconds": None,
+        "stale": False,
+        "unknown_kids": 0,
+    }
+
+
+def test_warm_up_decode_verifies_rs256_with_auth_enabled(monkeypatch):
+    monkeypatch.setattr(health, "warm_up_state", WarmUpState())
+    monkeypatch.setattr(settings, "IS_ON_APP_SERVICE", True)
+    monkeypatch.setattr(settings, "WEBSITE_AUTH_ENABLED", True)
+    monkeypatch.setattr(settings, "FEATURE_RBAC_ENABLED", True)
+    monkeypatch.setattr(token_service, "tenant_id", "warm-up-tenant")
+    monkeypatch.setattr(token_service, "client_id", "warm-up-client")
+    key_cache = SigningKeyCache("http://127.0.0.1:9/keys")
+    monkeypatch.setattr(
+        key_cache,
+        "fetch",
+        lambda: {"real": {"kid": "real", "kty": "RSA", "n": "AQAB", "e": "AQAB"}},
+    )
+    monkeypatch.setattr(token_service, "signing_key_cache", key_cache)
+    verified = []
+    backend = health.get_jwt_backend()
+    verify = backend.verify
+    monkeypatch.setattr(
+        backend,
+        "verify",
+        lambda token, key, **kwargs: verified.append(key["kid"])
+        or verify(token, key, **kwargs),
+    )
+    state = warm_up()
+    assert "synthetic_decode" not in state.errors
+    assert verified == ["warm-up"]
+    assert key_cache.refreshes == 1
+
+
+def test_health_endpoints_report_ready_after_lifespan_warm_up(monkeypatch):
+    monkeypatch.setattr(health, "warm_up_state", WarmUpState())
+    from api import app
+
+    with TestClient(app) as client:
+        assert client.get("/health/live").json() == {"status": "ok"}
+        response = client.get("/health/ready")
+    assert response.status_code == 200
+    readiness = response.json()
+    assert readiness["ready"]
+    assert readiness["warm_up"]["errors"] == {}
+    assert readiness["caches"]["permission_sets"] >= 1
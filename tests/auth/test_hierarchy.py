@@ -0,0 +1,130 @@
+import json
+import os
+import threading
+
+import pytest
+
+from auth import (
+    RoleHierarchy,
+    RoleHierarchyRepository,
+    RoleHierarchySnapshot,
+    add_additional_permissions_based_on_hierarchy,
+    get_role_hierarchy_snapshot,
+    swap_role_hierarchy,
+)
+from auth.exception import AuthInitializationException
+from auth.hierarchy import RoleHierarchyReloader, load_role_hierarchy
+from auth.model.roles import Role
+from auth.permissions import PermissionSetCache
+
+FLAT = {"roles": {"admin": ["reader"], "contributor": [], "reader": []}}
+NESTED = {"roles": {"admin": ["contributor"], "contributor": ["reader"], "reader": []}}
+
+
+@pytest.fixture(autouse=True)
+def restore_repository():
+    repo = RoleHierarchyRepository()
+    saved_roles = repo.roles
+    yield
+    swap_role_hierarchy(saved_roles)
+
+
+def write_hierarchy(path, document):
+    path.write_text(json.dumps(document))
+    return str(path)
+
+
+def implied(role_type):
+    return [
+        role.role_type
+        for role in add_additional_permissions_based_on_hierarchy(
+            Role("system", "dev", role_type)
+        )
+    ]
+
+
+def test_snapshot_compiles_transitive_closure():
+    snapshot = RoleHierarchySnapshot.compile(
+        {"admin": ["contributor"], "contributor": ["reader", "admin"], "reader": []}, 1
+    )
+    assert snapshot.get_implicit_roles("admin") == ("contributor", "reader")
+    assert snapshot.get_implicit_roles("contributor") == ("reader", "admin")
+    assert snapshot.get_implicit_roles("unknown") == ()
+    with pytest.raises(TypeError):
+        snapshot.implicit_roles["reader"] = ("admin",)
+
+
+def test_none_implicit_permissions_are_kept_and_grant_nothing():
+    reader = RoleHierarchy("reader")
+    swap_role_hierarchy({"reader": reader})
+    reader.provide_implicit_permissions(None)
+    assert reader.implicit_permissions == [None]
+    assert implied("reader") == ["reader"]
+
+
+def test_load_role_hierarchy_swaps_snapshot(tmp_path):
+    version = get_role_hierarchy_snapshot().version
+    load_role_hierarchy(write_hierarchy(tmp_path / "hierarchy.json", NESTED))
+    assert get_role_hierarchy_snapshot().version > version
+    assert implied("admin") == ["admin", "contributor", "reader"]
+    assert (
+        RoleHierarchyRepository().get_role_hierarchy("contributor").name
+        == "contributor"
+    )
+
+
+def test_invalid_hierarchy_keeps_current_snapshot(tmp_path):
+    load_role_hierarchy(write_hierarchy(tmp_path / "hierarchy.json", NESTED))
+    snapshot = get_role_hierarchy_snapshot()
+    invalid = {"roles": {"admin": ["owner"]}}
+    with pytest.raises(AuthInitializationException):
+        load_role_hierarchy(write_hierarchy(tmp_path / "invalid.json", invalid))
+    assert get_role_hierarchy_snapshot() is snapshot
+
+
+def test_reloader_picks_up_changed_file(tmp_path):
+    path = write_hierarchy(tmp_path / "hierarchy.json", FLAT)
+    load_role_hierarchy(path)
+    reloader = RoleHierarchyReloader(path, interval=60)
+    assert not reloader.check()
+    write_hierarchy(tmp_path / "hierarchy.json", NESTED)
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1_000_000))
+    assert reloader.check()
+    assert implied("admin") == ["admin", "contributor", "reader"]
+
+
+def test_readers_never_see_partial_hierarchy_during_reloads(tmp_path):
+    flat = write_hierarchy(tmp_path / "flat.json", FLAT)
+    nested = write_hierarchy(tmp_path / "nested.json", NESTED)
+    load_role_hierarchy(flat)
+    cache = PermissionSetCache()
+    valid_results = ({"admin", "reader"}, {"admin", "contributor", "reader"})
+    stop = threading.Event()
+    errors = []
+
+    def reload_continuously():
+        while not stop.is_set():
+            load_role_hierarchy(nested)
+            load_role_hierarchy(flat)
+
+    def read_continuously():
+        for _ in range(2000):
+            roles = set(implied("admin"))
+            cached = set(
+                cache.get_role_collection(["system-dev-admin"]).get_effective_roles(
+                    "dev", "system"
+                )
+            )
+            if roles not in valid_results or cached not in valid_results:
+                errors.append((roles, cached))
+
+    reloader = threading.Thread(target=reload_continuously)
+    readers = [threading.Thread(target=read_continuously) for _ in range(8)]
+    reloader.start()
+    for reader in readers:
+        reader.start()
+    for reader in readers:
+        reader.join()
+    stop.set()
+    reloader.join()
+    assert errors == []
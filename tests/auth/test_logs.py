@@ -0,0 +1,88 @@
+import json
+import logging
+import queue
+import time
+
+import auth
+from auth import logs
+from auth.logs import (
+    DeduplicateFilter,
+    DroppingQueueHandler,
+    RateLimitFilter,
+    StructuredFormatter,
+)
+
+
+def create_record(msg, *args, **extra):
+    record = logging.LogRecord(
+        "auth.test", logging.WARNING, __file__, 1, msg, args, None
+    )
+    record.__dict__.update(extra)
+    return record
+
+
+def test_rate_limit_filter_suppresses_and_reports_per_message():
+    rate_limit_filter = RateLimitFilter(rate=2, interval=0.05)
+    passed = [
+        rate_limit_filter.filter(create_record("Invalid group %s", f"group-{i}"))
+        for i in range(5)
+    ]
+    assert passed == [True, True, False, False, False]
+    assert rate_limit_filter.filter(create_record("Another message"))
+    assert rate_limit_filter.suppressed == {("auth.test", "Invalid group %s"): 3}
+    time.sleep(0.06)
+    record = create_record("Invalid group %s", "group-5")
+    assert rate_limit_filter.filter(record)
+    assert record.suppressed == 3
+
+
+def test_deduplicate_filter_logs_each_key_once():
+    deduplicate_filter = DeduplicateFilter()
+    results = [
+        deduplicate_filter.filter(
+            create_record("Invalid group %s", group, dedup_key=group)
+        )
+        for group in ["a", "b", "a", "a"]
+    ]
+    assert results == [True, True, False, False]
+    assert deduplicate_filter.duplicates == 2
+    assert deduplicate_filter.filter(create_record("No key"))
+
+
+def test_queue_handler_drops_instead_of_blocking():
+    handler = DroppingQueueHandler(queue.Queue(maxsize=1))
+    handler.handle(create_record("first"))
+    handler.handle(create_record("second"))
+    assert handler.queue.qsize() == 1
+    assert handler.dropped == 1
+
+
+def test_records_are_printed_when_the_root_logger_has_no_handlers(monkeypatch, capsys):
+    monkeypatch.setattr(logging.getLogger(), "handlers", [])
+    auth.init()
+    logging.getLogger("auth.userProvider").error("Not authenticated %s", "for the test")
+    deadline = time.monotonic() + 2
+    err = ""
+    while "Not authenticated for the test" not in err and time.monotonic() < deadline:
+        time.sleep(0.01)
+        err += capsys.readouterr().err
+    assert "Not authenticated for the test" in err
+
+
+def test_structured_records_keep_the_template_and_counters():
+    handler = DroppingQueueHandler(queue.Queue())
+    record = create_record(
+        "Invalid group %s", "group-1", dedup_key="group-1", suppressed=3
+    )
+    prepared = handler.prepare(record)
+    entry = json.loads(StructuredFormatter().format(prepared))
+    assert entry["message"] == "Invalid group group-1"
+    assert entry["template"] == "Invalid group %s"
+    assert entry["dedup_key"] == "group-1" and entry["suppressed"] == 3
+    assert entry["level"] == "WARNING" and entry["logger"] == "auth.test"
+
+
+def test_json_format_writes_to_stderr(monkeypatch):
+    monkeypatch.setattr(logs.settings, "AUTH_LOG_FORMAT", "json")
+    handler = logs.create_output_handler()
+    assert isinstance(handler.formatter, StructuredFormatter)
@@ -0,0 +1,89 @@
+import pytest
+
+from auth import RoleHierarchyRepository, init
+from auth.auth_config import compile_auth_config
+from auth.permissions import PermissionSetCache, get_group_fingerprint
+from config import get_settings
+
+settings = get_settings()
+
+
+@pytest.fixture(autouse=True)
+def setup():
+    repo = RoleHierarchyRepository()
+    saved_roles = {
+        name: list(role.implicit_permissions) for name, role in repo.roles.items()
+    }
+    role_hierarchy_spec = init()
+    admin = role_hierarchy_spec.create_role("admin")
+    reader = role_hierarchy_spec.create_role("reader")
+    if reader not in admin.implicit_permissions:
+        admin.provide_implicit_permissions(reader)
+    yield
+    for name in list(repo.roles):
+        if name not in saved_roles:
+            del repo.roles[name]
+        else:
+            repo.roles[name].implicit_permissions[:] = saved_roles[name]
+
+
+def test_group_fingerprint_ignores_order_and_duplicates():
+    assert get_group_fingerprint(
+        ["a-dev-reader", "b-dev-admin"]
+    ) == get_group_fingerprint(["b-dev-admin", "a-dev-reader", "a-dev-reader"])
+    assert get_group_fingerprint(["a-dev-reader"]) != get_group_fingerprint(
+        ["a-dev-admin"]
+    )
+
+
+def test_identical_group_sets_share_one_frozen_role_collection():
+    cache = PermissionSetCache()
+    role_collection = cache.get_role_collection(["system-dev-admin", "other-group"])
+    assert role_collection is cache.get_role_collection(
+        ["other-group", "system-dev-admin"]
+    )
+    assert role_collection.is_frozen()
+    assert "system-dev-reader" in role_collection.get_in_group_format()
+    with pytest.raises(TypeError):
+        role_collection.add_role(None)
+    assert len(cache) == 1
+
+
+def test_hierarchy_change_invalidates_cached_permission_sets():
+    cache = PermissionSetCache()
+    role_collection = cache.get_role_collection(["system-dev-admin"])
+    auditor = init().create_role("auditor")
+    assert cache.get_role_collection(["system-dev-admin"]) is not role_collection
+    init().create_role("admin").provide_implicit_permissions(auditor)
+    assert (
+        "system-dev-auditor"
+        in cache.get_role_collection(["system-dev-admin"]).get_in_group_format()
+    )
+
+
+def test_auth_config_change_invalidates_cached_permission_sets():
+    cache = PermissionSetCache()
+    role_collection = cache.get_role_collection(["system-dev-reader"])
+    assert "system-dev-reader" in role_collection.get_in_group_format()
+    saved_valid_roles = settings.VALID_ROLES
+    settings.VALID_ROLES = "admin,contributor"
+    try:
+        compile_auth_config()
+        assert (
+            "system-dev-reader"
+            not in cache.get_role_collection(
+                ["system-dev-reader"]
+            ).get_in_group_format()
+        )
+        assert len(cache) == 1
+    finally:
+        settings.VALID_ROLES = saved_valid_roles
+        compile_auth_config()
+    assert cache.get_role_collection(["system-dev-reader"]) is not role_collection
+
+
+def test_cache_is_size_bounded():
+    cache = PermissionSetCache(maxsize=2)
+    for env in ["dev", "test", "prod"]:
+        cache.get_role_collection([f"system-{env}-reader"])
+    assert len(cache) == 2
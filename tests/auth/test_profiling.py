@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+from jose import jwt
+
+from auth import init
+from auth.profiling import AllocationProfiler, allocation_profiler
+from auth.userProvider import ValidateAndReturnUser
+from config import get_settings
+from tests.conftest import create_request
+
+settings = get_settings()
+
+
+def create_user_request(name, groups):
+    token = jwt.encode(
+        {"name": name, "groups": groups}, "my_secret_key", algorithm="HS256"
+    )
+    return create_request(token)
+
+
+@pytest.fixture
+def app_service(monkeypatch):
+    init()
+    monkeypatch.setattr(settings, "WEBSITE_AUTH_ENABLED", True)
+    monkeypatch.setattr(settings, "IS_ON_APP_SERVICE", False)
+    monkeypatch.setattr(settings, "FEATURE_RBAC_ENABLED", True)
+
+
+def test_disabled_profiler_records_nothing():
+    profiler = AllocationProfiler()
+    with profiler.request():
+        with profiler.stage("claims"):
+            [object() for _ in range(100)]
+    assert profiler.get_stats() == {} and not profiler.requests
+
+
+def test_stages_are_attributed_per_request():
+    profiler = AllocationProfiler()
+    profiler.enable()
+    try:
+        with profiler.request():
+            with profiler.stage("claims"):
+                kept = [bytearray(1000) for _ in range(100)]
+            with profiler.stage("user"):
+                [bytearray(1000) for _ in range(10)]
+    finally:
+        profiler.disable()
+    stats = profiler.get_stats()
+    assert stats["claims"]["avg_net_bytes"] >= 100_000
+    assert stats["claims"]["avg_blocks"] >= 100
+    assert 10_000 <= stats["user"]["avg_bytes"] < stats["claims"]["avg_bytes"]
+    assert stats["user"]["avg_net_bytes"] < 1_000
+    request = profiler.requests[0]
+    assert set(request["stages"]) == {"claims", "user"}
+    assert request["bytes"] == stats["request"]["avg_bytes"]
+    assert len(kept) == 100
+
+
+def test_authenticated_requests_stay_within_allocation_budget(
+    app_service, allocation_budget
+):
+    check_budget = allocation_budget(max_bytes=16_000, max_blocks=100)
+    dependency = ValidateAndReturnUser(expected_roles=["reader"])
+    for i in range(20):
+        user = asyncio.run(
+            dependency(
+                create_user_request(
+                    f"user {i}", ["system-dev-reader", f"team{i}-dev-reader"]
+                )
+            )
+        )
+        assert user.name == f"user {i}"
+    assert len(check_budget()) == 20
+    stats = allocation_profiler.get_stats()
+    assert {"claims", "groups", "permissions", "user", "authorize", "request"} <= set(
+        stats
+    )
+
+
+def test_exceeding_the_allocation_budget_fails_the_check(allocation_budget):
+    check_budget = allocation_budget(max_bytes=1_000)
+    with allocation_profiler.request():
+        with allocation_profiler.stage("claims"):
+            [bytearray(1000) for _ in range(10)]
+    with pytest.raises(AssertionError, match="1 of 1 requests exceeded"):
+        check_budget()
+
+
+def test_stages_cannot_be_nested():
+    profiler = AllocationProfiler()
+    profiler.enable()
+    try:
+        with profiler.stage("claims"):
+            with pytest.raises(AssertionError, match="nested in stage claims"):
+                with profiler.stage("groups"):
+                    pass
+        with profiler.stage("groups"):
+            pass
+    finally:
+        profiler.disable()
+    assert set(profiler.get_stats()) == {"claims", "groups"}
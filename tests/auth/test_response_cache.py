@@ -0,0 +1,104 @@
+import pytest
+from fastapi import Depends, FastAPI, Header
+from fastapi.testclient import TestClient
+
+from auth.exception import AuthInitializationException
+from auth.model.roles import Role, RoleCollection
+from auth.model.user import User
+from auth.response_cache import RoleScopedResponseCache
+
+
+def get_user(x_groups: str = Header()) -> User:
+    role_collection = RoleCollection()
+    for group in x_groups.split(","):
+        role_collection.add_role(Role(*group.split("-")))
+    return User(
+        id_token="id",
+        name=x_groups,
+        access_token="access",
+        role_collection=role_collection.freeze(),
+        claims={},
+    )
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.state.calls = 0
+    response_cache = RoleScopedResponseCache(ttl=60, maxsize=2)
+
+    @app.get("/items/{env}")
+    @response_cache
+    def get_items(env: str, limit: int = 10, user: User = Depends(get_user)):
+        app.state.calls += 1
+        return {
+            "env": env,
+            "limit": limit,
+            "roles": user.role_collection.get_in_group_format(),
+        }
+
+    client = TestClient(app)
+    client.response_cache = response_cache
+    yield client
+
+
+def test_users_with_the_same_roles_share_a_response(client):
+    first = client.get(
+        "/items/dev", headers={"x-groups": "plat-dev-reader,plat-dev-admin"}
+    )
+    second = client.get(
+        "/items/dev", headers={"x-groups": "plat-dev-admin,plat-dev-reader"}
+    )
+    assert first.status_code == second.status_code == 200
+    assert first.json() == second.json()
+    assert first.headers["etag"] == second.headers["etag"]
+    assert client.app.state.calls == 1
+
+
+def test_responses_are_not_shared_across_permission_sets_or_parameters(client):
+    reader = client.get("/items/dev", headers={"x-groups": "plat-dev-reader"})
+    admin = client.get("/items/dev", headers={"x-groups": "plat-dev-admin"})
+    limited = client.get("/items/dev?limit=1", headers={"x-groups": "plat-dev-admin"})
+    assert reader.json()["roles"] == ["plat-dev-reader"]
+    assert admin.json()["roles"] == ["plat-dev-admin"]
+    assert limited.json()["limit"] == 1
+    assert client.app.state.calls == 3
+    assert len(client.response_cache) == 2
+
+
+def test_if_none_match_returns_not_modified(client):
+    etag = client.get("/items/dev", headers={"x-groups": "plat-dev-reader"}).headers[
+        "etag"
+    ]
+    response = client.get(
+        "/items/dev", headers={"x-groups": "plat-dev-reader", "if-none-match": etag}
+    )
+    assert response.status_code == 304
+    assert response.content == b""
+
+
+def test_expired_entries_are_recomputed(client):
+    client.response_cache.ttl = 0
+    client.get("/items/dev", headers={"x-groups": "plat-dev-reader"})
+    client.get("/items/dev", headers={"x-groups": "plat-dev-reader"})
+    assert client.app.state.calls == 2
+
+
+def test_string_annotations_are_resolved():
+    app = FastAPI()
+    response_cache = RoleScopedResponseCache(ttl=60)
+
+    @app.get("/items/{env}")
+    @response_cache
+    def get_items(env: "str", user: "User" = Depends(get_user)):
+        return {"env": env, "name": user.name}
+
+    client = TestClient(app)
+    response = client.get("/items/dev", headers={"x-groups": "system-dev-reader"})
+    assert response.json() == {"env": "dev", "name": "system-dev-reader"}
+    assert len(response_cache) == 1
+
+
+def test_endpoint_without_user_cannot_be_cached():
+    with pytest.raises(AuthInitializationException):
+        RoleScopedResponseCache()(lambda: {})
@@ -0,0 +1,53 @@
+import threading
+import time
+
+import pytest
+
+from auth.singleflight import SingleFlight
+
+
+def run_concurrently(fn, count=10):
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(fn())) for _ in range(count)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_calls_for_a_key_are_merged():
+    single_flight = SingleFlight()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(0.1)
+        return "tokens"
+
+    results = run_concurrently(lambda: single_flight.do("session", slow))
+    assert results == ["tokens"] * 10
+    assert len(calls) == 1
+
+
+def test_result_is_kept_for_ttl():
+    single_flight = SingleFlight()
+    assert single_flight.do("session", lambda: 1, ttl=60) == 1
+    assert single_flight.do("session", lambda: 2, ttl=60) == 1
+    assert single_flight.do("other", lambda: 3) == 3
+    single_flight.forget("session")
+    assert single_flight.do("session", lambda: 4) == 4
+    assert len(single_flight) == 0
+
+
+def test_errors_are_shared_and_not_kept():
+    single_flight = SingleFlight()
+
+    def failing():
+        raise ValueError("refresh failed")
+
+    with pytest.raises(ValueError):
+        single_flight.do("session", failing, ttl=60)
+    assert single_flight.do("session", lambda: "ok") == "ok"
@@ -0,0 +1,238 @@
+"""Stress tests that run the whole auth path of `ValidateAndReturnUser` from many threads and asyncio tasks at once, while
+signing keys are rotated, the role hierarchy is swapped and the JWKS endpoint fails.
+
+Besides outcomes and JWKS fetches, the run checks a throughput floor of 100 requests per second. It measured 670 to 1000
+requests per second on a developer machine, so the floor only catches gross regressions such as verification serializing
+on a lock. Override it with `STRESS_MIN_REQUESTS_PER_SECOND`, e.g.
+`STRESS_MIN_REQUESTS_PER_SECOND=500 python -m pytest tests/auth/test_stress.py` on known hardware.
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from fastapi import HTTPException
+
+from auth import RoleHierarchyRepository, init, swap_role_hierarchy, userProvider
+from auth.admission import VerificationExecutor
+from auth.hierarchy import parse_role_hierarchy
+from auth.http import resilience
+from auth.http.resilience import RetryBudget
+from auth.jwttoken import token_service
+from auth.jwttoken.backends import generate_rsa_key, get_jwt_backend
+from auth.jwttoken.keys import SigningKeyCache
+from auth.userProvider import ValidateAndReturnUser
+from config import get_settings
+from tests.conftest import create_request
+
+settings = get_settings()
+
+AUDIENCE = "stress-client-id"
+THREADS = 16
+ASYNC_TASKS = 16
+ROTATIONS = 2
+# Requests completed in each phase of the test (before and after each key rotation and while the JWKS endpoint fails)
+PHASE_REQUESTS = 50
+MIN_REQUESTS_PER_SECOND = float(os.environ.get("STRESS_MIN_REQUESTS_PER_SECOND", 100))
+HIERARCHIES = [
+    {
+        "roles": {
+            "admin": ["contributor", "reader"],
+            "contributor": ["reader"],
+            "reader": [],
+        }
+    },
+    {"roles": {"admin": ["reader"], "contributor": ["reader"], "reader": []}},
+]
+
+
+class SigningKey:
+    def __init__(self, kid):
+        self.kid = kid
+        self.pem, self.jwk = generate_rsa_key(kid)
+
+    def sign(self, name, groups):
+        claims = {
+            "aud": AUDIENCE,
+            "exp": int(time.time()) + 600,
+            "name": name,
+            "groups": groups,
+        }
+        return get_jwt_backend().encode(
+            claims, self.pem, "RS256", headers={"kid": self.kid}
+        )
+
+
+class JwksHandler(BaseHTTPRequestHandler):
+    """Serves the published keys and counts the successful fetches, or fails with 503 while `failing` is set."""
+
+    keys = []
+    failing = False
+    served = 0
+    failed = 0
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if JwksHandler.failing:
+            JwksHandler.failed += 1
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        JwksHandler.served += 1
+        payload = json.dumps({"keys": [key.jwk for key in JwksHandler.keys]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class Traffic:
+    """The requests currently sent by the workers, with the outcome each one must have: a user name or an HTTP status."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = []
+
+    def issue(self, key: SigningKey):
+        reader = key.sign("reader", ["system-dev-reader"])
+        admin = key.sign("admin", ["system-dev-admin", "unrelated-group"])
+        nobody = key.sign("nobody", ["system-dev-unknownrole"])
+        header, claims, _ = reader.split(".")
+        _, _, signature = nobody.split(".")
+        tampered = f"{header}.{claims}.{signature}"
+        requests = [
+            (create_request(reader), "reader"),
+            (create_request(admin), "admin"),
+            (create_request(nobody), 403),
+            (create_request(tampered), 401),
+        ]
+        with self.lock:
+            self.requests = self.requests[-4:] + requests
+
+    def get(self, i):
+        requests = self.requests
+        return requests[i % len(requests)]
+
+
+@pytest.fixture
+def environment(monkeypatch):
+    repo = RoleHierarchyRepository()
+    saved_roles = repo.roles
+    init()
+    monkeypatch.setattr(settings, "IS_ON_APP_SERVICE", True)
+    monkeypatch.setattr(settings, "WEBSITE_AUTH_ENABLED", True)
+    monkeypatch.setattr(settings, "FEATURE_RBAC_ENABLED", True)
+    monkeypatch.setattr(settings, "KEY_REFRESH_MIN_INTERVAL_SECONDS", 0)
+    monkeypatch.setattr(resilience, "circuit_breakers", {})
+    monkeypatch.setattr(
+        resilience, "retry_budget", RetryBudget(ratio=0, min_per_second=0, max_tokens=0)
+    )
+    JwksHandler.keys = [SigningKey("key-0")]
+    JwksHandler.failing = False
+    JwksHandler.served = JwksHandler.failed = 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), JwksHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(token_service, "tenant_id", "stress-tenant")
+    monkeypatch.setattr(token_service, "client_id", AUDIENCE)
+    monkeypatch.setattr(
+        token_service,
+        "signing_key_cache",
+        SigningKeyCache(f"http://127.0.0.1:{server.server_port}/keys"),
+    )
+    # Admit every concurrent caller: this test checks outcomes under concurrency, test_admission covers shedding.
+    executor = VerificationExecutor(queue_size=THREADS + ASYNC_TASKS, queue_timeout=60)
+    monkeypatch.setattr(userProvider, "verification_executor", executor)
+    swap_role_hierarchy(parse_role_hierarchy(HIERARCHIES[0]))
+    yield
+    executor.shutdown()
+    server.shutdown()
+    swap_role_hierarchy(saved_roles)
+
+
+def test_validate_and_return_user_under_concurrent_load(environment):
+    dependency = ValidateAndReturnUser(expected_roles=["reader"])
+    traffic = Traffic()
+    traffic.issue(JwksHandler.keys[0])
+    token_service.populate_signing_keys()
+    stop = threading.Event()
+    errors = []
+    completed = [0]
+    count_lock = threading.Lock()
+
+    def call(i):
+        request, expected = traffic.get(i)
+        try:
+            outcome = asyncio.run(dependency(request)).name
+        except HTTPException as e:
+            outcome = e.status_code
+        except Exception as e:  # anything else is a bug under concurrency
+            outcome = repr(e)
+        if outcome != expected:
+            errors.append((expected, outcome))
+        with count_lock:
+            completed[0] += 1
+
+    def thread_worker(offset):
+        i = offset
+        while not stop.is_set():
+            call(i)
+            i += THREADS
+
+    async def async_worker(offset):
+        i = offset
+        while not stop.is_set():
+            await asyncio.to_thread(call, i)
+            i += ASYNC_TASKS
+
+    async def async_driver():
+        await asyncio.gather(*(async_worker(offset) for offset in range(ASYNC_TASKS)))
+
+    def swap_hierarchies():
+        i = 0
+        while not stop.wait(0.01):
+            i += 1
+            swap_role_hierarchy(parse_role_hierarchy(HIERARCHIES[i % 2]))
+
+    def run_phase():
+        target = completed[0] + PHASE_REQUESTS
+        deadline = time.monotonic() + 10
+        while completed[0] < target and time.monotonic() < deadline:
+            time.sleep(0.005)
+
+    rotated_keys = [
+        SigningKey(f"key-{rotation}") for rotation in range(1, ROTATIONS + 1)
+    ]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=THREADS + 2) as executor:
+        workers = [executor.submit(thread_worker, offset) for offset in range(THREADS)]
+        workers.append(executor.submit(asyncio.run, async_driver()))
+        workers.append(executor.submit(swap_hierarchies))
+        for key in rotated_keys:
+            run_phase()
+            JwksHandler.keys = JwksHandler.keys + [key]
+            traffic.issue(key)
+        run_phase()
+        JwksHandler.failing = True
+        token_service.populate_signing_keys()
+        run_phase()
+        JwksHandler.failing = False
+        stop.set()
+        for worker in workers:
+            worker.result()
+    elapsed = time.perf_counter() - started
+
+    assert errors == []
+    assert JwksHandler.served == 1 + ROTATIONS
+    assert JwksHandler.failed >= 1
+    assert token_service.signing_key_cache.stale
+    assert completed[0] >= PHASE_REQUESTS * (ROTATIONS + 2)
+    assert completed[0] / elapsed >= MIN_REQUESTS_PER_SECOND
@@ -1,7 +1,8 @@
+import asyncio
 from unittest.mock import MagicMock, patch
 
 import pytest
-from fastapi import Request
+from fastapi import HTTPException, Request
 
 import auth
 from auth.jwttoken.token import TokenService, TokenProvider
@@ -31,5 +32,26 @@ def test_validate_and_return_user():
     request.headers = {"Authorization": "Bearer some_token"}
     with patch("auth.userProvider.get_token_service") as mock_get_token_service:
         mock_get_token_service.return_value = MockTokenService()
-        user = user_provider(request)
+        user = asyncio.run(user_provider(request))
         assert user.name == "Dummy"
+
+
+def test_validate_and_return_user_passes_env_from_path_param():
+    user_provider = ValidateAndReturnUser(["reader"], env_param="env")
+    request = MagicMock(spec=Request)
+    request.path_params = {"env": "prod"}
+    with patch("auth.userProvider.get_token_service") as mock_get_token_service:
+        asyncio.run(user_provider(request))
+        mock_get_token_service.return_value.decode_and_check_authorization.assert_called_once_with(
+            ["reader"], request=request, env="prod"
+        )
+
+
+def test_validate_and_return_user_rejects_missing_env_param():
+    user_provider = ValidateAndReturnUser(["reader"], env_param="env")
+    request = MagicMock(spec=Request)
+    request.path_params = {}
+    request.query_params = {}
+    with pytest.raises(HTTPException) as exc_info:
+        asyncio.run(user_provider(request))
+    assert exc_info.value.status_code == 400
@@ -0,0 +1,47 @@
+import pytest
+from starlette.requests import Request
+
+from auth.profiling import allocation_profiler
+
+
+def create_request(token: str) -> Request:
+    """Returns a request carrying `token` as both the access token and the ID token, like App Service authentication forwards them."""
+    return Request(
+        {
+            "type": "http",
+            "headers": [
+                (b"x-ms-token-aad-access-token", token.encode()),
+                (b"x-ms-token-aad-id-token", token.encode()),
+            ],
+        }
+    )
+
+
+@pytest.fixture
+def allocation_budget():
+    """Profiles the allocations of the auth pipeline during the test (see `auth.profiling`).
+
+    The fixture is a function setting the budget: `check = allocation_budget(max_bytes=..., max_blocks=...)`. Calling `check()` in the test fails it if a request handled by `ValidateAndReturnUser` so far allocated more than its budget, and returns the profiled requests.
+    """
+    allocation_profiler.reset()
+    allocation_profiler.enable()
+
+    def set_budget(max_bytes: int = None, max_blocks: int = None):
+        def check():
+            requests = list(allocation_profiler.requests)
+            over_budget = [
+                request
+                for request in requests
+                if (max_bytes is not None and request["bytes"] > max_bytes)
+                or (max_blocks is not None and request["blocks"] > max_blocks)
+            ]
+            assert (
+                not over_budget
+            ), f"{len(over_budget)} of {len(requests)} requests exceeded the allocation budget of {max_bytes} bytes and {max_blocks} blocks: {over_budget[0]}"
+            return requests
+
+        return check
+
+    yield set_budget
+    allocation_profiler.disable()
+    allocation_profiler.reset()
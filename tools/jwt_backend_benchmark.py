@@ -0,0 +1,96 @@
+"""Reports the RS256 verification throughput of each JWT backend (see `auth.jwttoken.backends`) on ID tokens shaped like
+the ones Entra ID issues, to pick the `JWT_BACKEND` setting.
+
+Usage: python tools/jwt_backend_benchmark.py [--groups 5,50,200] [--seconds 1]
+"""
+
+import argparse
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from auth.jwttoken.backends import (
+    JWT_BACKENDS,
+    generate_rsa_key,
+    get_jwt_backend,
+)  # noqa: E402
+
+AUDIENCE = str(uuid.uuid4())
+
+
+def create_id_token(pem, group_count):
+    tenant_id = str(uuid.uuid4())
+    now = int(time.time())
+    claims = {
+        "aud": AUDIENCE,
+        "iss": f"https://login.microsoftonline.com/{tenant_id}/v2.0",
+        "iat": now,
+        "nbf": now,
+        "exp": now + 3600,
+        "name": "Benchmark User",
+        "oid": str(uuid.uuid4()),
+        "preferred_username": "benchmark.user@contoso.com",
+        "email": "benchmark.user@contoso.com",
+        "tid": tenant_id,
+        "ver": "2.0",
+        "groups": [
+            f"team{i}-{('dev', 'test', 'prod')[i % 3]}-reader"
+            for i in range(group_count)
+        ],
+    }
+    return get_jwt_backend("cryptography").encode(
+        claims, pem, "RS256", headers={"kid": "benchmark"}
+    )
+
+
+def measure(fn, seconds):
+    count = 0
+    started = time.perf_counter()
+    deadline = started + seconds
+    while time.perf_counter() < deadline:
+        for _ in range(50):
+            fn()
+        count += 50
+    return count / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--groups",
+        default="5,50,200",
+        help="comma-separated numbers of groups in the token",
+    )
+    parser.add_argument(
+        "--seconds",
+        type=float,
+        default=1.0,
+        help="measuring time per backend and token shape",
+    )
+    args = parser.parse_args()
+    pem, jwk = generate_rsa_key("benchmark")
+    print(
+        f"{'backend':<14}{'groups':>8}{'token bytes':>13}{'verify/s':>12}{'cold verify/s':>15}"
+    )
+    for group_count in (int(count) for count in args.groups.split(",")):
+        token = create_id_token(pem, group_count)
+        for name in sorted(JWT_BACKENDS):
+            backend = get_jwt_backend(name)
+
+            def verify():
+                backend.verify(token, jwk, ["RS256"], audience=AUDIENCE)
+
+            def cold_verify():
+                JWT_BACKENDS[name]().verify(token, jwk, ["RS256"], audience=AUDIENCE)
+
+            print(
+                f"{name:<14}{group_count:>8}{len(token):>13}"
+                f"{measure(verify, args.seconds):>12.0f}{measure(cold_verify, args.seconds):>15.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
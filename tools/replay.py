@@ -0,0 +1,297 @@
+"""Replays auth traffic recorded with `AUTH_CAPTURE_ENABLED` (see `auth.capture`) against a running instance of api.py, to
+reproduce production load profiles offline and compare latency across versions.
+
+The recorded tokens have no signature, so each one is re-signed with a local RSA key just before it is sent, with its
+time claims moved to the present and padded to its recorded size. Requests are sent at the recorded pace, scaled by
+`--rate` (2 replays twice as fast, 0 as fast as possible).
+
+To have the instance verify the re-signed tokens, start the replay with `--jwks-port 8400` and the instance with
+`AZURE_AUTHORITY_HOST=http://127.0.0.1:8400`, `AZURE_CLIENT_ID` set to `--audience` and `WEBSITE_SITE_NAME` set.
+
+Usage: python tools/replay.py capture/auth-traffic.jsonl.1 capture/auth-traffic.jsonl [--url http://127.0.0.1:8000]
+       [--rate 1] [--concurrency 16] [--audience CLIENT_ID] [--jwks-port 8400] [--output report.json]
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+from urllib.parse import quote
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cryptography.hazmat.primitives import serialization  # noqa: E402
+
+from auth.capture import TIME_CLAIMS  # noqa: E402
+from auth.jwttoken.backends import generate_rsa_key, get_jwt_backend  # noqa: E402
+from config import get_settings  # noqa: E402
+
+settings = get_settings()
+
+# A path parameter of a route template, e.g. `{env}` or `{user_id:int}`
+PATH_PARAM = re.compile(r"{(\w+)(?::\w+)?}")
+EXPECTED_STATUS = {
+    "allowed": 200,
+    "forbidden": 403,
+    "unauthenticated": 401,
+    "unavailable": 503,
+}
+
+
+class ReplaySigner:
+    """Turns the sanitized tokens of a capture back into signed tokens."""
+
+    def __init__(self, pem: bytes, kid: str, audience: Optional[str] = None):
+        self.private_key = serialization.load_pem_private_key(pem, password=None)
+        self.kid = kid
+        self.audience = audience
+        self.backend = get_jwt_backend("cryptography")
+
+    def sign(self, token: Optional[dict], now: float) -> Optional[str]:
+        """Signs a sanitized token (see `auth.capture.sanitize_token`), or returns a filler of the recorded size for tokens that were not JWTs. Returns `None` for missing tokens."""
+        if token is None:
+            return None
+        if token.get("malformed"):
+            return "x" * token["size"]
+        claims = {
+            claim: int(now + value) if claim in TIME_CLAIMS else value
+            for claim, value in token["claims"].items()
+        }
+        if self.audience is not None:
+            claims["aud"] = self.audience
+        signed = self.encode(claims)
+        padding = (token["size"] - len(signed)) * 3 // 4 - len(',"pad":""')
+        if padding > 0:
+            claims["pad"] = "x" * padding
+            signed = self.encode(claims)
+        return signed
+
+    def encode(self, claims: dict) -> str:
+        return self.backend.encode(
+            claims, self.private_key, "RS256", headers={"kid": self.kid}
+        )
+
+
+def load_records(paths: list[str]) -> list[dict]:
+    """Reads the captured records of the files, oldest first. Rotated files can be passed in any order."""
+    records = []
+    for path in paths:
+        with open(path, encoding="utf-8") as file:
+            records.extend(json.loads(line) for line in file if line.strip())
+    records.sort(key=lambda record: record["ts"])
+    return records
+
+
+def build_request(
+    record: dict, signer: ReplaySigner, now: float
+) -> tuple[str, str, dict]:
+    """Returns the method, path and headers replaying `record`. The path is the route template filled in with the recorded path parameters, see `auth.capture.sanitize_path_params`."""
+    headers = {}
+    for name, token in (
+        (settings.APP_SERVICE_ID_TOKEN_HEADER, record.get("id_token")),
+        (settings.APP_SERVICE_ACCESS_TOKEN_HEADER, record.get("access_token")),
+    ):
+        signed = signer.sign(token, now)
+        if signed is not None:
+            headers[name] = signed
+    path_params = record.get("path_params", {})
+    path = PATH_PARAM.sub(
+        lambda match: quote(str(path_params[match.group(1)]), safe=""),
+        record["route"],
+    )
+    return record["method"], path, headers
+
+
+def replay(
+    records: list[dict],
+    send: Callable[[str, str, dict], int],
+    signer: ReplaySigner,
+    rate: float = 1.0,
+    concurrency: int = 16,
+) -> dict:
+    '''"""
+    This function replays the records with `send` and reports the latency per route.
+
+    Parameters:
+        records (list): The captured records, oldest first.
+        send (Callable): Sends a request given its method, path and headers and returns the status code.
+        signer (ReplaySigner): Re-signs the tokens.
+        rate (float): How much faster than recorded to replay. 0 replays as fast as possible.
+        concurrency (int): The maximum number of requests in flight.
+
+    Returns:
+        dict: The number of requests, elapsed time and throughput, the number of requests whose status did not match the recorded outcome, how many were sent late because all workers were busy, and for each route the status codes and latency percentiles in milliseconds.
+    """'''
+    results = []
+    results_lock = threading.Lock()
+    late = 0
+
+    def run(record):
+        method, path, headers = build_request(record, signer, time.time())
+        started = time.perf_counter()
+        status = send(method, path, headers)
+        latency = time.perf_counter() - started
+        with results_lock:
+            results.append((record["route"], record["outcome"], status, latency))
+
+    first = records[0]["ts"] if records else 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for record in records:
+            if rate:
+                delay = (record["ts"] - first) / rate - (time.perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+                elif delay < -0.01:
+                    late += 1
+            executor.submit(run, record)
+    elapsed = time.perf_counter() - started
+    return summarize(results, elapsed, late)
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def summarize(results: list, elapsed: float, late: int) -> dict:
+    routes = {}
+    for route, _, status, latency in results:
+        summary = routes.setdefault(route, {"statuses": {}, "latencies": []})
+        summary["statuses"][str(status)] = summary["statuses"].get(str(status), 0) + 1
+        summary["latencies"].append(latency * 1000)
+    for summary in routes.values():
+        latencies = sorted(summary.pop("latencies"))
+        summary.update(
+            count=len(latencies),
+            p50_ms=round(percentile(latencies, 0.5), 3),
+            p95_ms=round(percentile(latencies, 0.95), 3),
+            p99_ms=round(percentile(latencies, 0.99), 3),
+            max_ms=round(latencies[-1], 3),
+        )
+    return {
+        "requests": len(results),
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput": round(len(results) / elapsed, 1) if elapsed else None,
+        "mismatched_outcomes": sum(
+            1
+            for _, outcome, status, _ in results
+            if EXPECTED_STATUS.get(outcome) != status
+        ),
+        "late": late,
+        "routes": routes,
+    }
+
+
+def http_sender(url: str) -> Callable[[str, str, dict], int]:
+    """Returns a `send` function calling the instance at `url`, with one connection pool per worker thread."""
+    import requests
+
+    local = threading.local()
+
+    def send(method, path, headers):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        try:
+            return session.request(
+                method, url.rstrip("/") + path, headers=headers, timeout=30
+            ).status_code
+        except requests.RequestException:
+            return 0
+
+    return send
+
+
+def wait_until_live(url: str, timeout: float = 60):
+    """Waits for the liveness endpoint of the instance, which only answers once its warm-up is over."""
+    import requests
+
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if requests.get(url.rstrip("/") + "/health/live", timeout=5).ok:
+                return
+        except requests.RequestException:
+            pass
+        if time.monotonic() > deadline:
+            raise SystemExit(f"{url} did not become live within {timeout} seconds")
+        time.sleep(0.5)
+
+
+def serve_jwks(port: int, jwk: dict) -> ThreadingHTTPServer:
+    """Serves the public replay key as the signing keys of any tenant."""
+    body = json.dumps({"keys": [jwk]}).encode()
+
+    class JwksHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), JwksHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "captures", nargs="+", help="Capture files, including rotated ones"
+    )
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=1.0,
+        help="Replay speed relative to the capture, 0 for unpaced",
+    )
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument(
+        "--audience",
+        help="Replaces the aud claim, e.g. with the AZURE_CLIENT_ID of the instance",
+    )
+    parser.add_argument(
+        "--jwks-port",
+        type=int,
+        help="Serves the replay key as signing keys on this port",
+    )
+    parser.add_argument(
+        "--output", help="Also writes the report to this file, to compare runs"
+    )
+    args = parser.parse_args()
+
+    pem, jwk = generate_rsa_key(f"replay-{uuid.uuid4()}")
+    if args.jwks_port:
+        serve_jwks(args.jwks_port, jwk)
+    records = load_records(args.captures)
+    wait_until_live(args.url)
+    report = replay(
+        records,
+        http_sender(args.url),
+        ReplaySigner(pem, jwk["kid"], args.audience),
+        rate=args.rate,
+        concurrency=args.concurrency,
+    )
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(output)
+
+
+if __name__ == "__main__":
+    main()